@@ -13,6 +13,7 @@ class YourAPI:
         url_uuid (str): URL or UUID of the manga
         language (str): Manga language with country codes. "en" --> english
         forcevol (bool): Force naming of volumes. Useful for mangas where chapters reset each volume
+        session (requests.Session): Shared http session. Use it for all requests. Can be None
 
     Attributes:
         api_name (str): Name of the API
@@ -26,13 +27,14 @@ class YourAPI:
     api_base_url = "https://api.mangadex.org"
     img_base_url = "https://uploads.mangadex.org"
 
-    def __init__(self, url_uuid: str, language: str, forcevol: bool):
+    def __init__(self, url_uuid: str, language: str, forcevol: bool, session=None):
         """get infos to initiate class."""
         self.api_name = "Your API Name"
 
         self.url_uuid = url_uuid
         self.language = language
         self.forcevol = forcevol
+        self.session = session
 
         # attributes needed by app.py
         self.manga_uuid = "abc"
@@ -0,0 +1,315 @@
+"""Local stand-in for the MangaDex api and the mangadex@home image servers.
+
+Serves a configurable amount of series with generated chapters and pages:
+
+- GET /manga/{id} and GET /manga?ids[]=...: manga infos
+- GET /manga/{id}/feed: chapter feed with limit/offset
+- GET /at-home/server/{chapter id}: image server and page names of a chapter
+- GET /node/{data,data-saver}/{hash}/{page} and /{data,data-saver}/{hash}/{page}: pages
+- POST /report: mangadex@home reports
+- GET /_stats: request counters as json
+
+Latency, bandwidth, error rate and the api rate limit (429 responses) are configurable.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+
+@dataclass
+class ServerConfig:
+    """Settings of the fake server.
+
+    Args:
+        series: Amount of series
+        chapters: Chapters per series
+        pages: Pages per chapter
+        page_size: Size of a page in bytes
+        latency: Delay of every response in seconds
+        bandwidth: Bytes per second per response. 0 means unlimited
+        error_rate: Fraction of page requests which fail with a 500 error
+        api_rate: Api requests per second before 429 responses. 0 means unlimited
+    """
+
+    series: int = 1
+    chapters: int = 1
+    pages: int = 10
+    page_size: int = 200_000
+    latency: float = 0.05
+    bandwidth: float = 0
+    error_rate: float = 0
+    api_rate: float = 0
+
+
+@dataclass
+class ServerStats:
+    """Request counters of the fake server."""
+
+    api_calls: dict[str, int] = field(default_factory=dict)
+    rate_limited: int = 0
+    pages: int = 0
+    page_errors: int = 0
+    bytes_sent: int = 0
+    reports: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def count_api(self, endpoint: str) -> None:
+        with self.lock:
+            self.api_calls[endpoint] = self.api_calls.get(endpoint, 0) + 1
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "api_calls": dict(self.api_calls),
+                "api_total": sum(self.api_calls.values()),
+                "rate_limited": self.rate_limited,
+                "pages": self.pages,
+                "page_errors": self.page_errors,
+                "bytes_sent": self.bytes_sent,
+                "reports": self.reports,
+            }
+
+
+def manga_uuid(series: int) -> str:
+    return f"{series:08x}-0000-4000-8000-000000000000"
+
+
+def chapter_uuid(series: int, chapter: int) -> str:
+    return f"{series:08x}-{chapter:04x}-4000-8000-000000000001"
+
+
+def manga_title(series: int) -> str:
+    return f"Series {series}"
+
+
+UUID_PATTERN = r"([0-9a-f]{8})-([0-9a-f]{4})-4000-8000-00000000000([01])"
+
+
+class FakeMangadex(ThreadingHTTPServer):
+    """Threaded http server with the generated mangas."""
+
+    daemon_threads = True
+
+    def __init__(self, config: ServerConfig, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), FakeMangadexHandler)
+        self.config = config
+        self.stats = ServerStats()
+        self.page = bytes(range(256)) * (config.page_size // 256) + b"\0" * (config.page_size % 256)
+        self.page_hash = hashlib.sha256(self.page).hexdigest()
+        # api rate limit: requests of the current second
+        self.api_window = (0, 0)
+        self.api_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def allow_api_request(self) -> bool:
+        if self.config.api_rate <= 0:
+            return True
+        now = int(time.monotonic())
+        with self.api_lock:
+            second, count = self.api_window
+            count = count + 1 if second == now else 1
+            self.api_window = (now, count)
+        return count <= self.config.api_rate
+
+    def manga_data(self, series: int) -> dict[str, Any]:
+        return {
+            "id": manga_uuid(series),
+            "type": "manga",
+            "attributes": {
+                "title": {"en": manga_title(series)},
+                "altTitles": [],
+                "description": {"en": f"Generated series {series}"},
+                "publicationDemographic": "shounen",
+            },
+        }
+
+    def chapter_data(self, series: int, chapter: int) -> dict[str, Any]:
+        # one chapter per week, the last one today
+        published = time.time() - (self.config.chapters - chapter) * 7 * 86400
+        return {
+            "id": chapter_uuid(series, chapter),
+            "type": "chapter",
+            "attributes": {
+                "volume": str((chapter - 1) // 10 + 1),
+                "chapter": str(chapter),
+                "title": f"Chapter {chapter}",
+                "pages": self.config.pages,
+                "externalUrl": None,
+                "publishAt": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(published)),
+            },
+        }
+
+    def page_names(self) -> list[str]:
+        return [f"{page}-{self.page_hash}.png" for page in range(1, self.config.pages + 1)]
+
+
+class FakeMangadexHandler(BaseHTTPRequestHandler):
+    """Handler for the api and image requests."""
+
+    protocol_version = "HTTP/1.1"
+    server: FakeMangadex
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def send_body(self, body: bytes, status: int = 200, headers: dict[str, str] | None = None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        bandwidth = self.server.config.bandwidth
+        if bandwidth <= 0:
+            self.wfile.write(body)
+            return
+        chunk_size = 64 * 1024
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start : start + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+    def send_json(self, data: Any, status: int = 200) -> None:
+        self.send_body(json.dumps(data).encode(), status, {"Content-Type": "application/json"})
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/report"):
+            with self.server.stats.lock:
+                self.server.stats.reports += 1
+            self.send_json({"result": "ok"})
+            return
+        self.send_json({"result": "error"}, 404)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        path, query = (url.path, parse_qs(url.query))
+        if path == "/_stats":
+            self.send_json(self.server.stats.to_dict())
+            return
+
+        time.sleep(self.server.config.latency)
+        page_match = re.fullmatch(r"(?:/node)?/(data|data-saver)/(\w+)/([\w.-]+)", path)
+        if page_match:
+            self.get_page()
+            return
+
+        # api requests
+        if not self.server.allow_api_request():
+            with self.server.stats.lock:
+                self.server.stats.rate_limited += 1
+            self.send_body(
+                b'{"result": "error"}',
+                429,
+                {
+                    "Retry-After": "1",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Retry-After": str(int(time.time()) + 1),
+                },
+            )
+            return
+        if path == "/manga":
+            self.server.stats.count_api("manga_batch")
+            self.get_manga_batch(query)
+        elif match := re.fullmatch(rf"/manga/{UUID_PATTERN}/feed", path):
+            self.server.stats.count_api("feed")
+            self.get_feed(int(match[1], 16), query)
+        elif match := re.fullmatch(rf"/manga/{UUID_PATTERN}", path):
+            self.server.stats.count_api("manga")
+            self.get_manga(int(match[1], 16))
+        elif match := re.fullmatch(rf"/at-home/server/{UUID_PATTERN}", path):
+            self.server.stats.count_api("at_home")
+            self.get_at_home(int(match[1], 16), int(match[2], 16))
+        else:
+            self.send_json({"result": "error"}, 404)
+
+    def valid_series(self, series: int) -> bool:
+        return 1 <= series <= self.server.config.series
+
+    def get_manga(self, series: int) -> None:
+        if not self.valid_series(series):
+            self.send_json({"result": "error"}, 404)
+            return
+        self.send_json({"result": "ok", "data": self.server.manga_data(series)})
+
+    def get_manga_batch(self, query: dict[str, list[str]]) -> None:
+        data = []
+        for uuid in query.get("ids[]", []):
+            match = re.fullmatch(UUID_PATTERN, uuid)
+            if match and self.valid_series(int(match[1], 16)):
+                data.append(self.server.manga_data(int(match[1], 16)))
+        self.send_json({"result": "ok", "data": data, "total": len(data)})
+
+    def get_feed(self, series: int, query: dict[str, list[str]]) -> None:
+        if not self.valid_series(series):
+            self.send_json({"result": "error"}, 404)
+            return
+        total = self.server.config.chapters
+        # nothing changes while the server runs
+        if "updatedAtSince" in query:
+            total = 0
+        limit = int(query.get("limit", ["100"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        chapters = range(offset + 1, min(offset + limit, total) + 1)
+        self.send_json(
+            {
+                "result": "ok",
+                "data": [self.server.chapter_data(series, chapter) for chapter in chapters],
+                "limit": limit,
+                "offset": offset,
+                "total": total,
+            }
+        )
+
+    def get_at_home(self, series: int, chapter: int) -> None:
+        if not self.valid_series(series) or not 1 <= chapter <= self.server.config.chapters:
+            self.send_json({"result": "error"}, 404)
+            return
+        pages = self.server.page_names()
+        self.send_json(
+            {
+                "result": "ok",
+                # another host than the api, like the mangadex@home nodes
+                "baseUrl": f"http://localhost:{self.server.server_address[1]}/node",
+                "chapter": {
+                    "hash": f"{series:08x}{chapter:04x}",
+                    "data": pages,
+                    "dataSaver": pages,
+                },
+            }
+        )
+
+    def get_page(self) -> None:
+        stats = self.server.stats
+        if random.random() < self.server.config.error_rate:
+            with stats.lock:
+                stats.page_errors += 1
+            self.send_body(b"error", 500)
+            return
+        with stats.lock:
+            stats.pages += 1
+            stats.bytes_sent += len(self.server.page)
+        self.send_body(self.server.page, headers={"Content-Type": "image/png"})
+
+
+def serve(config: ServerConfig, port_queue: Any = None) -> None:
+    """Run the server until the process is stopped.
+
+    Args:
+        config: Settings of the server
+        port_queue: Queue to send the port of the server to. Optional
+    """
+    server = FakeMangadex(config)
+    if port_queue is not None:
+        port_queue.put(server.server_address[1])
+    server.serve_forever()
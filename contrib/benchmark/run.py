@@ -0,0 +1,205 @@
+"""Benchmark manga-dlp against a local fake MangaDex server.
+
+The fake server runs in a separate process, so the peak RSS only covers manga-dlp.
+Every scenario of "all" runs in its own process for the same reason.
+
+Examples:
+    python contrib/benchmark/run.py --scenario backfill --workers 4 --no-client-limits
+    python contrib/benchmark/run.py --scenario sync --parallel 8 --global-queue
+    python contrib/benchmark/run.py --scenario all --latency 0.1 --bandwidth 5000000 --json
+"""
+
+import json
+import multiprocessing
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+import click
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parents[2] / "src"))
+
+from fake_mangadex import ServerConfig, manga_title, manga_uuid, serve  # noqa: E402
+
+from mangadlp import network  # noqa: E402
+from mangadlp.api.mangadex import Mangadex  # noqa: E402
+from mangadlp.cache import open_cache  # noqa: E402
+from mangadlp.logger import prepare_logger  # noqa: E402
+from mangadlp.scheduler import MangaScheduler  # noqa: E402
+
+# series, chapters per series and chapters per series which are already downloaded
+SCENARIOS: dict[str, dict[str, int]] = {
+    "single": {"series": 1, "chapters": 1, "cached": 0},
+    "backfill": {"series": 1, "chapters": 500, "cached": 0},
+    "sync": {"series": 400, "chapters": 20, "cached": 19},
+}
+
+
+def start_server(config: ServerConfig) -> tuple[multiprocessing.Process, str]:
+    port_queue: multiprocessing.Queue[int] = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(config, port_queue), daemon=True)
+    process.start()
+    return (process, f"http://127.0.0.1:{port_queue.get(timeout=10)}")
+
+
+def run_scenario(scenario: str, config: ServerConfig, options: dict[str, Any]) -> dict[str, Any]:
+    cached = SCENARIOS[scenario]["cached"]
+    server, server_url = start_server(config)
+    # point the api to the fake server
+    Mangadex.api_base_url = server_url
+    Mangadex.img_base_url = server_url
+    # the reports go to another host than the api, like api.mangadex.network. the pages use
+    # "localhost" and 127.1 is a short form of 127.0.0.1
+    Mangadex.athome_report_url = f"{server_url.replace('127.0.0.1', '127.1')}/report"
+
+    client_limits = options.pop("client_limits")
+    url_uuids = [manga_uuid(series) for series in range(1, config.series + 1)]
+    with tempfile.TemporaryDirectory() as download_path:
+        cache_path = Path(download_path) / "cache.json"
+        # the older chapters were downloaded by earlier runs
+        if cached:
+            for series in range(1, config.series + 1):
+                open_cache(cache_path, manga_uuid(series), "en", manga_title(series)).add_chapters(
+                    [str(chapter) for chapter in range(1, cached + 1)]
+                )
+
+        scheduler = MangaScheduler(
+            url_uuids,
+            chapters="all",
+            download_path=download_path,
+            cache_path=str(cache_path),
+            **options,
+        )
+        if not client_limits:
+            scheduler.session = network.create_session(
+                pool_size=max(options["download_workers"], options["host_connections"])
+            )
+        start_time = time.perf_counter()
+        failed_mangas = scheduler.run()
+        duration = time.perf_counter() - start_time
+
+    stats: dict[str, Any] = requests.get(f"{server_url}/_stats", timeout=10).json()
+    server.terminate()
+
+    return {
+        "scenario": scenario,
+        "duration_s": round(duration, 2),
+        "pages": stats["pages"],
+        "pages_per_s": round(stats["pages"] / duration, 1),
+        "mb_per_s": round(stats["bytes_sent"] / duration / 1_000_000, 2),
+        "api_calls": stats["api_total"],
+        "api_calls_by_endpoint": stats["api_calls"],
+        "rate_limited": stats["rate_limited"],
+        "page_errors": stats["page_errors"],
+        "reports": stats["reports"],
+        "failed_mangas": len(failed_mangas),
+        # kilobytes on linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def print_result(result: dict[str, Any]) -> None:
+    click.echo(f"Scenario: {result['scenario']}")
+    for key, value in result.items():
+        if key != "scenario":
+            click.echo(f"  {key:<24}{value}")
+
+
+@click.command(context_settings={"max_content_width": 120})
+@click.option(
+    "--scenario", type=click.Choice([*SCENARIOS, "all"]), default="single", show_default=True
+)
+@click.option("--series", type=int, default=None, help="Override the series of the scenario")
+@click.option("--chapters", type=int, default=None, help="Override the chapters per series")
+@click.option("--pages", type=int, default=10, show_default=True, help="Pages per chapter")
+@click.option("--page-size", type=int, default=200_000, show_default=True, help="Bytes per page")
+@click.option("--latency", type=float, default=0.05, show_default=True, help="Seconds per response")
+@click.option(
+    "--bandwidth",
+    type=float,
+    default=0,
+    show_default=True,
+    help="Bytes/s per response. 0 is unlimited",
+)
+@click.option(
+    "--error-rate",
+    type=float,
+    default=0,
+    show_default=True,
+    help="Fraction of failing page requests",
+)
+@click.option(
+    "--api-rate",
+    type=float,
+    default=0,
+    show_default=True,
+    help="Api requests/s before 429. 0 is unlimited",
+)
+@click.option("--workers", "download_workers", type=int, default=1, show_default=True)
+@click.option("--wait", "download_wait", type=float, default=0, show_default=True)
+@click.option("--parallel", type=int, default=1, show_default=True)
+@click.option("--global-queue", is_flag=True, default=False)
+@click.option("--host-connections", type=int, default=10, show_default=True)
+@click.option("--format", "file_format", type=str, default="cbz", show_default=True)
+@click.option("--engine", type=click.Choice(["sync", "async"]), default="sync", show_default=True)
+@click.option("--stream", "stream_archive", is_flag=True, default=False)
+@click.option("--pipeline", "pipeline_size", type=int, default=0, show_default=True)
+@click.option("--prefetch", "prefetch_size", type=int, default=0, show_default=True)
+@click.option(
+    "--client-limits/--no-client-limits",
+    default=True,
+    show_default=True,
+    help="Use the rate limits of manga-dlp for mangadex (5 api requests/s, 40 at-home requests/min)",
+)
+@click.option("--loglevel", type=int, default=40, show_default=True, help="Log level of manga-dlp")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print the results as json")
+def main(
+    scenario: str,
+    series: int | None,
+    chapters: int | None,
+    pages: int,
+    page_size: int,
+    latency: float,
+    bandwidth: float,
+    error_rate: float,
+    api_rate: float,
+    loglevel: int,
+    as_json: bool,
+    **options: Any,
+) -> None:
+    """Run a benchmark scenario against a local fake MangaDex server."""
+    # every scenario in its own process, so the peak rss is separate
+    if scenario == "all":
+        for name in SCENARIOS:
+            args = [arg for arg in sys.argv[1:] if arg not in ("--scenario", "all")]
+            subprocess.run([sys.executable, __file__, "--scenario", name, *args], check=True)
+        return
+
+    prepare_logger(loglevel)
+    config = ServerConfig(
+        series=series or SCENARIOS[scenario]["series"],
+        chapters=chapters or SCENARIOS[scenario]["chapters"],
+        pages=pages,
+        page_size=page_size,
+        latency=latency,
+        bandwidth=bandwidth,
+        error_rate=error_rate,
+        api_rate=api_rate,
+    )
+    result = run_scenario(scenario, config, options)
+    result["server"] = asdict(config)
+    if as_json:
+        click.echo(json.dumps(result))
+    else:
+        print_result(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,6 @@ python3 /app/manga-dlp.py \
     --path /app/downloads \
     --read /app/mangas.txt \
     --chapters all \
-    --wait 2
+    --wait 2 \
+    --parallel 4 \
+    "$@"
@@ -13,3 +13,5 @@
 : "${MDLP_WAIT:=0.5}"
 : "${MDLP_FORCEVOL:=false}"
 : "${MDLP_LOG_LEVEL:=}"
+: "${MDLP_DAEMON:=false}"
+: "${MDLP_INTERVAL:=86400}"
@@ -40,7 +40,7 @@ function set_vars() {
     cat << EOF > "/app/schedules/daily.sh"
 #!/bin/bash
 
-python3 /app/manga-dlp.py ${custom_args[@]}
+python3 /app/manga-dlp.py ${custom_args[@]} "\$@"
 
 EOF
 }
@@ -51,3 +51,9 @@ if [[ "${MDLP_GENERATE_SCHEDULE,,}" == "true" ]]; then
     prepare_vars
     set_vars
 fi
+
+# the daemon replaces the cron schedule
+if [[ "${MDLP_DAEMON,,}" == "true" ]]; then
+    echo "Using daemon instead of cron schedule"
+    rm -f /etc/cron.d/mangadlp
+fi
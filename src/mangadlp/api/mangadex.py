@@ -1,23 +1,47 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import cached_property, partial
 from time import sleep
 from typing import Any
 
 import requests
 from loguru import logger as log
 
-from mangadlp import utils
+from mangadlp import network, utils
+from mangadlp.cache import CacheDB, CacheSqliteDB
 from mangadlp.models import ChapterData, ComicInfo
 
 
+# isolate id from url
+UUID_REGEX = re.compile("[a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12}")
+# maximum amount of ids for a single manga list request
+MANGA_BATCH_SIZE = 100
+# image quality tiers of mangadex@home
+IMAGE_QUALITIES = ("data", "data-saver")
+# mangadex@home reports are sent in the background, so the downloads don't wait for them
+REPORT_QUEUE = network.PostQueue(workers=4)
+
+
 class Mangadex:
     """Mangadex API Class.
 
-    Get infos for a manga from mangadex.org.
+    Get infos for a manga from mangadex.org. Only the uuid is resolved on creation, all other
+    infos are requested from the api on first access and kept afterwards.
 
     Args:
         url_uuid (str): URL or UUID of the manga
         language (str): Manga language with country codes. "en" --> english
         forcevol (bool): Force naming of volumes. Useful for mangas where chapters reset each volume
+        session (requests.Session): Http session to use for the requests. Optional
+        feed_cache (CacheDB | CacheSqliteDB): Cache-db of the manga. If given, only chapters
+            which were updated since the last sync are requested and merged into the cached
+            chapter feed. Can be set after creation, as the cache needs the manga title. Optional
+        response_cache (ResponseCache): Persistent cache for the api responses. Optional
+        prefetched_manga (dict): Manga infos by uuid from get_manga_data_batch. If the manga is
+            included, its infos are not requested again. Optional
+        quality (str): Image quality. "data" for the originals, "data-saver" for compressed
+            images. Defaults to "data"
 
     Attributes:
         api_name (str): Name of the API
@@ -32,35 +56,74 @@ class Mangadex:
     # api information
     api_base_url = "https://api.mangadex.org"
     img_base_url = "https://uploads.mangadex.org"
+    athome_report_url = "https://api.mangadex.network/report"
+    # parallel requests for the chapter feed. mangadex allows ~5 requests per second
+    api_feed_workers = 4
 
     # get infos to initiate class
-    def __init__(self, url_uuid: str, language: str, forcevol: bool):  # noqa: D107
+    def __init__(  # noqa: D107
+        self,
+        url_uuid: str,
+        language: str,
+        forcevol: bool,
+        session: requests.Session | None = None,
+        feed_cache: CacheDB | CacheSqliteDB | None = None,
+        response_cache: network.ResponseCache | None = None,
+        prefetched_manga: dict[str, dict[str, Any]] | None = None,
+        quality: str = "data",
+    ):
         # static info
         self.api_name = "Mangadex"
 
         self.url_uuid = url_uuid
         self.language = language
         self.forcevol = forcevol
+        self.quality = quality
+        self.session = session
+        self.response_cache = response_cache
 
         # api stuff
         self.api_content_ratings = "contentRating[]=safe&contentRating[]=suggestive&contentRating[]=erotica&contentRating[]=pornographic"
         self.api_language = f"translatedLanguage[]={self.language}"
         self.api_additions = f"{self.api_language}&{self.api_content_ratings}"
 
-        # infos from functions
+        # infos from functions. everything else is requested on first access
+        self.feed_cache = feed_cache
         self.manga_uuid = self.get_manga_uuid()
-        self.manga_data = self.get_manga_data()
-        self.manga_title = self.get_manga_title()
-        self.manga_chapter_data = self.get_chapter_data()
-        self.chapter_list = self.create_chapter_list()
+        # image infos per chapter for the fallback to the mangadex servers
+        self.chapter_images: dict[str, tuple[str, list[str]]] = {}
+        if prefetched_manga and self.manga_uuid in prefetched_manga:
+            log.debug(f"Using prefetched manga data for: {self.manga_uuid}")
+            self.manga_data = prefetched_manga[self.manga_uuid]
+
+    @cached_property
+    def manga_data(self) -> dict[str, Any]:
+        return self.get_manga_data()
+
+    @cached_property
+    def manga_title(self) -> str:
+        return self.get_manga_title()
+
+    @cached_property
+    def manga_chapter_data(self) -> dict[str, ChapterData]:
+        return self.get_chapter_data()
+
+    @cached_property
+    def chapter_list(self) -> list[str]:
+        return self.create_chapter_list()
+
+    # request json from the api. uses the response cache if available
+    def get_api_json(self, url: str) -> Any:
+        if self.response_cache:
+            return self.response_cache.get_json(url, self.session, timeout=10)
+
+        return network.get(url, self.session, timeout=10).json()
 
     # get the uuid for the manga
     def get_manga_uuid(self) -> str:
-        # isolate id from url
-        uuid_regex = re.compile("[a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12}")
         # try to get uuid in string
         try:
-            uuid = uuid_regex.search(self.url_uuid)[0]  # type: ignore
+            uuid = UUID_REGEX.search(self.url_uuid)[0]  # type: ignore
         except Exception as exc:
             log.error("No valid UUID found")
             raise exc
@@ -73,18 +136,19 @@ class Mangadex:
         counter = 1
         while counter <= 3:
             try:
-                response = requests.get(f"{self.api_base_url}/manga/{self.manga_uuid}", timeout=10)
+                response_body: dict[str, dict[str, Any]] = self.get_api_json(
+                    f"{self.api_base_url}/manga/{self.manga_uuid}"
+                )
             except Exception as exc:
                 if counter >= 3:
                     log.error("Maybe the MangaDex API is down?")
                     raise exc
                 log.error("Mangadex API not reachable. Retrying")
-                sleep(2)
+                sleep(network.fixed_wait(self.session, 2))
                 counter += 1
             else:
                 break
 
-        response_body: dict[str, dict[str, Any]] = response.json()
         # check if manga exists
         if response_body["result"] != "ok":
             log.error("Manga not found")
@@ -129,17 +193,21 @@ class Mangadex:
         return title  # type: ignore
 
     # check if chapters are available in requested language
-    def check_chapter_lang(self) -> int:
+    def check_chapter_lang(self, since: str = "") -> int:
         log.debug(f"Checking for chapters in specified language for: {self.manga_uuid}")
-        r = requests.get(
-            f"{self.api_base_url}/manga/{self.manga_uuid}/feed?limit=0&{self.api_additions}",
-            timeout=10,
-        )
+        api_since = f"&updatedAtSince={since}" if since else ""
         try:
-            total_chapters: int = r.json()["total"]
+            response_body: dict[str, Any] = self.get_api_json(
+                f"{self.api_base_url}/manga/{self.manga_uuid}/feed?limit=0&{self.api_additions}{api_since}"
+            )
+            total_chapters: int = response_body["total"]
         except Exception as exc:
             log.error("Error retrieving the chapters list. Did you specify a valid language code?")
             raise exc
+        # no new chapters since the last sync
+        if total_chapters == 0 and since:
+            log.debug(f"No updated chapters since {since}")
+            return 0
         if total_chapters == 0:
             log.error("No chapters available to download in specified language")
             raise KeyError
@@ -150,56 +218,93 @@ class Mangadex:
     # get chapter data like name, uuid etc
     def get_chapter_data(self) -> dict[str, ChapterData]:
         log.debug(f"Getting chapter data for: {self.manga_uuid}")
-        api_sorting = "order[chapter]=asc&order[volume]=asc"
+        if not self.feed_cache:
+            return self.create_chapter_data(self.get_feed_entries())
+
+        # only get the chapters which were updated since the last sync
+        last_sync, cached_entries = self.feed_cache.get_feed()
+        sync_time = datetime.now(tz=timezone.utc).strftime(utils.SYNC_TIME_FORMAT)
+        feed_entries = self.get_feed_entries(last_sync)
+        if last_sync:
+            log.info(f"Updated chapters since last sync ({last_sync}): {len(feed_entries)}")
+            feed_entries = merge_feed_entries(cached_entries, feed_entries)
+        self.feed_cache.set_feed(sync_time, feed_entries)
+
+        return self.create_chapter_data(feed_entries)
+
+    # get all chapters of the feed
+    def get_feed_entries(self, since: str = "") -> list[ChapterData]:
         # check for chapters in specified lang
-        total_chapters = self.check_chapter_lang()
+        total_chapters = self.check_chapter_lang(since)
+        # the total is known, so the pages (500 chapters each) can be requested in parallel
+        offsets = list(range(0, total_chapters, 500))
+        if len(offsets) <= 1:
+            feed_pages = [self.get_feed_page(offset, since) for offset in offsets]
+        else:
+            log.debug(f"Requesting {len(offsets)} feed pages with {self.api_feed_workers} workers")
+            with ThreadPoolExecutor(max_workers=self.api_feed_workers) as executor:
+                # map keeps the order of the pages for the duplicate check
+                feed_pages = list(executor.map(partial(self.get_feed_page, since=since), offsets))
 
-        chapter_data: dict[str, ChapterData] = {}
-        last_volume, last_chapter = ("", "")
-        offset = 0
-        while offset < total_chapters:  # if more than 500 chapters
-            r = requests.get(
-                f"{self.api_base_url}/manga/{self.manga_uuid}/feed?{api_sorting}&limit=500&offset={offset}&{self.api_additions}",
-                timeout=10,
-            )
-            response_body: dict[str, Any] = r.json()
-            for chapter in response_body["data"]:
-                attributes: dict[str, Any] = chapter["attributes"]
-                # chapter infos from feed
-                chapter_num: str = attributes.get("chapter") or ""
-                chapter_vol: str = attributes.get("volume") or ""
-                chapter_uuid: str = chapter.get("id") or ""
-                chapter_name: str = attributes.get("title") or ""
-                chapter_external: str = attributes.get("externalUrl") or ""
-                chapter_pages: int = attributes.get("pages") or 0
-
-                # check for chapter title and fix it
-                if chapter_name:
-                    chapter_name = utils.fix_name(chapter_name)
-
-                # check if the chapter is external (can't download them)
-                if chapter_external:
-                    log.debug(f"Chapter is external. Skipping: {chapter_name}")
-                    continue
-
-                # check if its duplicate from the last entry
-                if last_volume == chapter_vol and last_chapter == chapter_num:
-                    continue
-
-                # export chapter data as a dict
-                chapter_index = chapter_num if not self.forcevol else f"{chapter_vol}:{chapter_num}"
-                chapter_data[chapter_index] = {
+        return [entry for feed_page in feed_pages for entry in feed_page]
+
+    # get a single page of the feed
+    def get_feed_page(self, offset: int, since: str = "") -> list[ChapterData]:
+        api_sorting = "order[chapter]=asc&order[volume]=asc"
+        api_since = f"&updatedAtSince={since}" if since else ""
+        response_body: dict[str, Any] = self.get_api_json(
+            f"{self.api_base_url}/manga/{self.manga_uuid}/feed?{api_sorting}&limit=500&offset={offset}&{self.api_additions}{api_since}"
+        )
+        feed_entries: list[ChapterData] = []
+        for chapter in response_body["data"]:
+            attributes: dict[str, Any] = chapter["attributes"]
+            # chapter infos from feed
+            chapter_num: str = attributes.get("chapter") or ""
+            chapter_vol: str = attributes.get("volume") or ""
+            chapter_uuid: str = chapter.get("id") or ""
+            chapter_name: str = attributes.get("title") or ""
+            chapter_external: str = attributes.get("externalUrl") or ""
+            chapter_pages: int = attributes.get("pages") or 0
+            chapter_publish: str = attributes.get("publishAt") or ""
+
+            # check for chapter title and fix it
+            if chapter_name:
+                chapter_name = utils.fix_name(chapter_name)
+
+            # check if the chapter is external (can't download them)
+            if chapter_external:
+                log.debug(f"Chapter is external. Skipping: {chapter_name}")
+                continue
+
+            feed_entries.append(
+                {
                     "uuid": chapter_uuid,
                     "volume": chapter_vol,
                     "chapter": chapter_num,
                     "name": chapter_name,
                     "pages": chapter_pages,
+                    "publish_at": chapter_publish,
                 }
-                # add last chapter to duplicate check
-                last_volume, last_chapter = (chapter_vol, chapter_num)
+            )
+
+        return feed_entries
 
-            # increase offset for mangas with more than 500 chapters
-            offset += 500
+    # create the chapter data index from the feed entries
+    def create_chapter_data(self, feed_entries: list[ChapterData]) -> dict[str, ChapterData]:
+        chapter_data: dict[str, ChapterData] = {}
+        last_volume, last_chapter = ("", "")
+        for entry in feed_entries:
+            chapter_vol = entry["volume"]
+            chapter_num = entry["chapter"]
+            # check if its duplicate from the last entry
+            if last_volume == chapter_vol and last_chapter == chapter_num:
+                continue
+
+            # export chapter data as a dict
+            chapter_index = chapter_num if not self.forcevol else f"{chapter_vol}:{chapter_num}"
+            chapter_data[chapter_index] = entry
+            # add last chapter to duplicate check
+            last_volume, last_chapter = (chapter_vol, chapter_num)
 
         return chapter_data
 
@@ -214,7 +319,7 @@ class Mangadex:
         counter = 1
         while counter <= 3:
             try:
-                r = requests.get(f"{athome_url}/{chapter_uuid}", timeout=10)
+                r = network.get(f"{athome_url}/{chapter_uuid}", self.session, timeout=10)
                 api_data = r.json()
                 if api_data["result"] != "ok":
                     log.error(f"No chapter with the id {chapter_uuid} found")
@@ -232,7 +337,7 @@ class Mangadex:
                     api_error = True
                 log.error("Retrying in a few seconds")
                 counter += 1
-                sleep(wait_time + 2)
+                sleep(network.fixed_wait(self.session, wait_time + 2))
         # check if result is ok
         else:
             if api_error:
@@ -240,16 +345,53 @@ class Mangadex:
 
         chapter_hash = api_data["chapter"]["hash"]
         chapter_img_data = api_data["chapter"]["data"]
+        # mangadex@home node for the chapter
+        base_url: str = api_data.get("baseUrl") or self.img_base_url
+        log.debug(f"Image server: {base_url}")
+        self.chapter_images[chapter] = (chapter_hash, chapter_img_data)
+
+        # compressed images of the data-saver tier
+        quality = self.quality
+        if quality == "data-saver":
+            chapter_img_data = api_data["chapter"].get("dataSaver") or []
+            if not chapter_img_data:
+                log.warning("No data-saver images available. Using the original images")
+                quality, chapter_img_data = ("data", api_data["chapter"]["data"])
 
         # get list of image urls
         image_urls: list[str] = []
         for image in chapter_img_data:
-            image_urls.append(f"{self.img_base_url}/data/{chapter_hash}/{image}")
+            image_urls.append(f"{base_url}/{quality}/{chapter_hash}/{image}")
 
-        sleep(wait_time)
+        sleep(network.fixed_wait(self.session, wait_time))
 
         return image_urls
 
+    # get the original images for the chapter from the mangadex servers. used if the nodes
+    # or the data-saver images fail
+    def get_fallback_images(self, chapter: str) -> list[str]:
+        if chapter not in self.chapter_images:
+            return []
+        chapter_hash, chapter_img_data = self.chapter_images[chapter]
+
+        return [f"{self.img_base_url}/data/{chapter_hash}/{image}" for image in chapter_img_data]
+
+    # report the result of an image download to mangadex@home
+    def report_image(
+        self, image: str, success: bool, size: int, duration: float, cached: bool
+    ) -> None:
+        # only the nodes are reported, not the mangadex servers
+        if image.startswith(self.img_base_url):
+            return
+        report = {
+            "url": image,
+            "success": success,
+            "bytes": size,
+            "duration": int(duration * 1000),
+            "cached": cached,
+        }
+        REPORT_QUEUE.put(self.athome_report_url, self.session, timeout=5, json=report)
+
     # create list of chapters
     def create_chapter_list(self) -> list[str]:
         log.debug(f"Creating chapter list for: {self.manga_uuid}")
@@ -286,3 +428,57 @@ class Mangadex:
         }
 
         return metadata
+
+
+# sort key like the feed sorting of the api. chapter first, then volume
+def feed_sort_key(entry: ChapterData) -> tuple[float, float]:
+    def to_float(number: str) -> float:
+        try:
+            return float(number)
+        except ValueError:
+            return float("inf")
+
+    return (to_float(entry["chapter"]), to_float(entry["volume"]))
+
+
+# merge updated feed entries into the cached ones
+def merge_feed_entries(
+    cached_entries: list[ChapterData], new_entries: list[ChapterData]
+) -> list[ChapterData]:
+    new_uuids = {entry["uuid"] for entry in new_entries}
+    merged_entries = [entry for entry in cached_entries if entry["uuid"] not in new_uuids]
+    merged_entries.extend(new_entries)
+
+    return sorted(merged_entries, key=feed_sort_key)
+
+
+# get the manga infos of multiple mangas with as few requests as possible
+def get_manga_data_batch(
+    url_uuids: list[str],
+    session: requests.Session | None = None,
+) -> dict[str, dict[str, Any]]:
+    uuids: list[str] = []
+    for url_uuid in url_uuids:
+        uuid_match = UUID_REGEX.search(url_uuid)
+        if uuid_match and uuid_match[0] not in uuids:
+            uuids.append(uuid_match[0])
+
+    content_ratings = "contentRating[]=safe&contentRating[]=suggestive&contentRating[]=erotica&contentRating[]=pornographic"
+    manga_data: dict[str, dict[str, Any]] = {}
+    for start in range(0, len(uuids), MANGA_BATCH_SIZE):
+        batch = uuids[start : start + MANGA_BATCH_SIZE]
+        log.debug(f"Getting manga data for {len(batch)} mangas")
+        api_ids = "&".join(f"ids[]={uuid}" for uuid in batch)
+        r = network.get(
+            f"{Mangadex.api_base_url}/manga?{api_ids}&limit={MANGA_BATCH_SIZE}&{content_ratings}",
+            session,
+            timeout=10,
+        )
+        response_body: dict[str, Any] = r.json()
+        if response_body.get("result") != "ok":
+            log.warning("Batched manga request failed. Mangas are requested one by one")
+            continue
+        for data in response_body["data"]:
+            manga_data[data["id"]] = data
+
+    return manga_data
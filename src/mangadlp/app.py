@@ -1,19 +1,35 @@
+import logging
+import multiprocessing
+import queue
 import re
 import shutil
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
+import requests
 from loguru import logger as log
 
-from mangadlp import downloader, utils
-from mangadlp.api.mangadex import Mangadex
-from mangadlp.cache import CacheDB
+from mangadlp import downloader, network, utils
+from mangadlp.api.mangadex import IMAGE_QUALITIES, Mangadex, get_manga_data_batch
+from mangadlp.cache import CacheDB, CacheSqliteDB, open_cache
 from mangadlp.hooks import run_hook
+from mangadlp.logger import prepare_logger
 from mangadlp.metadata import write_metadata
 from mangadlp.models import ChapterData
 from mangadlp.utils import get_file_format
 
 
+PRINT_DIVIDER = "========================================="
+
+# mangadex@home image urls are valid for 15 minutes. prefetched urls are renewed earlier
+IMAGE_URLS_TTL = 10 * 60
+
+
 def match_api(url_uuid: str) -> type:
     """Match the correct api class from a string.
 
@@ -51,6 +67,125 @@ def match_api(url_uuid: str) -> type:
     raise ValueError
 
 
+def prefetch_manga_data(
+    url_uuids: list[str], session: requests.Session | None = None
+) -> dict[str, dict[str, Any]]:
+    """Request the infos of multiple mangas in batches.
+
+    Only supported for mangadex. Mangas which are not included are requested one by one later.
+
+    Args:
+        url_uuids: urls/uuids of the mangas
+        session: Http session to use for the requests
+
+    Returns:
+        The manga infos by manga uuid
+    """
+    try:
+        manga_data: dict[str, dict[str, Any]] = get_manga_data_batch(url_uuids, session)
+    except Exception as exc:
+        log.warning(f"Can't prefetch manga data. Reason={exc}")
+        return {}
+
+    return manga_data
+
+
+def create_archive_pool(archive_workers: int) -> ProcessPoolExecutor:
+    """Create the process pool for the archives.
+
+    The workers are started from a fork server (spawned on windows/macOS), as the process
+    runs download threads while the pool starts. They don't inherit the logger, so it's
+    prepared with the log level of the run.
+
+    Args:
+        archive_workers: Amount of processes
+
+    Returns:
+        The process pool
+    """
+    start_method = (
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+    log.debug(f"Starting archive process pool with {archive_workers} workers ({start_method})")
+
+    return ProcessPoolExecutor(
+        max_workers=archive_workers,
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=prepare_logger,
+        initargs=(logging.root.level,),
+    )
+
+
+# report urls of the api. they don't count towards the rate limits of the image servers
+def get_report_urls(api_cls: type) -> list[str]:
+    report_url: str = getattr(api_cls, "athome_report_url", "")
+
+    return [report_url] if report_url else []
+
+
+def create_async_downloader(
+    session: requests.Session | None, host_connections: int = 0
+) -> downloader.AsyncDownloader:
+    """Create the downloader of the async engine.
+
+    Args:
+        session: Http session of the api. The page requests use its rate limiter
+        host_connections: Maximum concurrent connections per host. 0 means no limit
+
+    Returns:
+        The downloader
+    """
+    rate_limiter: network.RateLimiter | None = getattr(session, "rate_limiter", None)
+
+    return downloader.AsyncDownloader(host_connections, rate_limiter)
+
+
+def create_http_session(
+    api_base_url: str,
+    download_workers: int = 1,
+    download_wait: float = 0.5,
+    retries: int = 3,
+    backoff: float = 0.5,
+    host_connections: int = 0,
+    unlimited_urls: list[str] | None = None,
+) -> requests.Session:
+    """Create the rate limited http session for the api and the downloader.
+
+    Args:
+        api_base_url: Base url of the api. The api requests get their own limits
+        download_workers: Amount of pictures to download in parallel
+        download_wait: Time to wait for each picture to download in seconds
+        retries: Retries on connection errors and 429/5xx
+        backoff: Backoff factor between the retries in seconds
+        host_connections: Maximum concurrent requests per host. 0 means no limit
+        unlimited_urls: Url prefixes without rate and concurrency limits. E.g. report urls
+
+    Returns:
+        The prepared session
+    """
+    # mangadex allows 5 requests per second and 40 at-home requests per minute
+    rates: dict[str, float] = {}
+    concurrency: dict[str, int] = {}
+    if api_base_url:
+        rates = {api_base_url: 5, f"{api_base_url}/at-home": 40 / 60}
+        if host_connections > 0:
+            concurrency = {api_base_url: min(4, host_connections)}
+    # same image rate per host as waiting download_wait after every image in each worker
+    image_rate = download_workers / download_wait if download_wait > 0 else 0
+
+    session: requests.Session = network.create_session(
+        pool_sizes={api_base_url: 4} if api_base_url else None,
+        pool_size=max(10, download_workers, host_connections),
+        retries=retries,
+        backoff=backoff,
+        rate_limiter=network.RateLimiter(
+            rates, image_rate, concurrency, host_connections, unlimited_urls
+        ),
+    )
+
+    return session
+
+
 class MangaDLP:
     """Download Mangas from supported sites.
 
@@ -64,13 +199,43 @@ class MangaDLP:
         file_format: Archive format to create. An empty string means don't archive the folder
         forcevol: Force naming of volumes. Useful for mangas where chapters reset each volume
         download_path: Download path. Defaults to '<script_dir>/downloads'
-        download_wait: Time to wait for each picture to download in seconds
+        download_wait: Time to wait for each picture to download in seconds. Used for the
+            per-host rate limit of the image requests
+        download_workers: Amount of pictures to download in parallel. 1 means sequential
+        engine: Download engine. "sync" uses threads, "async" uses asyncio (needs aiohttp)
+        quality: Image quality. "data" for the originals, "data-saver" for compressed images.
+            Falls back to the originals if the data-saver images fail
         manga_pre_hook_cmd: Command(s) to before after each manga
         manga_post_hook_cmd: Command(s) to run after each manga
         chapter_pre_hook_cmd: Command(s) to run before each chapter
         chapter_post_hook_cmd: Command(s) to run after each chapter
-        cache_path: Path to the json cache. If emitted, no cache is used
+        cache_path: Path to the cache. .db/.sqlite/.sqlite3 use sqlite, everything else json.
+            If emitted, no cache is used
+        incremental: Only request chapters which were updated since the last sync and merge
+            them into the chapter feed from the cache. Needs cache_path
+        adaptive_polling: Estimate the next release from the publish times of the chapters
+            and skip the manga until then. Needs cache_path
+        api_cache_path: Path to the sqlite cache for api responses. If emitted, no cache is used
+        api_cache_ttl: Time in seconds, in which cached api responses are used without a request
+        api_cache_size: Maximum amount of cached api responses
         add_metadata: Flag to toggle creation & inclusion of metadata
+        pipeline_size: Amount of downloaded chapters which can wait for archiving, while the
+            next chapter downloads. 0 processes every chapter before the next download
+        stream_archive: Download images directly into the archive, without an image folder
+        compression: Zip compression. "stored", "deflate" or "auto" (deflate non-image files)
+        compression_level: Compression level for deflate (0-9). Defaults to the zlib default
+        archive_workers: Amount of processes to create archives with. 0 archives in the main
+            process. Enables the pipeline if pipeline_size is not set
+        prefetch_size: Amount of next chapters to request the image urls for in the background,
+            while the current chapter downloads
+        http_retries: Retries of the http connection pool on connection errors and 429/5xx
+        http_backoff: Backoff factor between the http retries in seconds
+        session: Http session to use. If emitted, a new one is created
+        prefetched_manga: Manga infos by uuid from prefetch_manga_data
+        archive_pool: Process pool for the archives from create_archive_pool, shared by
+            multiple mangas. If emitted and archive_workers is set, one is created per manga
+        async_downloader: Downloader of the async engine, shared by multiple mangas. If
+            emitted and the engine is "async", one is created per manga
     """
 
     def __init__(  # noqa
@@ -85,12 +250,32 @@ class MangaDLP:
         forcevol: bool = False,
         download_path: str | Path = "downloads",
         download_wait: float = 0.5,
+        download_workers: int = 1,
+        engine: str = "sync",
+        quality: str = "data",
         manga_pre_hook_cmd: str = "",
         manga_post_hook_cmd: str = "",
         chapter_pre_hook_cmd: str = "",
         chapter_post_hook_cmd: str = "",
         cache_path: str = "",
+        incremental: bool = False,
+        adaptive_polling: bool = False,
+        api_cache_path: str = "",
+        api_cache_ttl: float = 3600,
+        api_cache_size: int = 1000,
         add_metadata: bool = True,
+        pipeline_size: int = 0,
+        stream_archive: bool = False,
+        compression: str = "stored",
+        compression_level: int | None = None,
+        archive_workers: int = 0,
+        prefetch_size: int = 0,
+        http_retries: int = 3,
+        http_backoff: float = 0.5,
+        session: requests.Session | None = None,
+        prefetched_manga: dict[str, dict[str, Any]] | None = None,
+        archive_pool: ProcessPoolExecutor | None = None,
+        async_downloader: downloader.AsyncDownloader | None = None,
     ) -> None:
         # init parameters
         self.url_uuid = url_uuid
@@ -103,13 +288,43 @@ class MangaDLP:
         self.forcevol = forcevol
         self.download_path: Path = Path(download_path)
         self.download_wait = download_wait
+        self.download_workers = download_workers
+        self.engine = engine
+        self.quality = quality
         self.manga_pre_hook_cmd = manga_pre_hook_cmd
         self.manga_post_hook_cmd = manga_post_hook_cmd
         self.chapter_pre_hook_cmd = chapter_pre_hook_cmd
         self.chapter_post_hook_cmd = chapter_post_hook_cmd
         self.cache_path = cache_path
+        self.incremental = incremental
+        self.adaptive_polling = adaptive_polling
+        self.api_cache_path = api_cache_path
+        self.api_cache_ttl = api_cache_ttl
+        self.api_cache_size = api_cache_size
         self.add_metadata = add_metadata
+        self.pipeline_size = pipeline_size
+        self.stream_archive = stream_archive
+        self.compression = compression
+        self.compression_level = compression_level
+        self.archive_workers = archive_workers
+        # archive workers only run in parallel with the pipeline
+        if self.archive_workers > 0 and self.pipeline_size == 0:
+            self.pipeline_size = self.archive_workers
+        self.prefetch_size = prefetch_size
+        self.http_retries = http_retries
+        self.http_backoff = http_backoff
+        self.session = session
+        self.prefetched_manga = prefetched_manga
         self.hook_infos: dict[str, Any] = {}
+        self.cache: CacheDB | CacheSqliteDB | None = None
+        self.archive_pool = archive_pool
+        self.async_downloader = async_downloader
+        self.prefetch_pool: ThreadPoolExecutor | None = None
+        self.prefetched_images: dict[str, Future[tuple[float, list[str]]]] = {}
+        # chapter results of the last get_manga() call
+        self.downloaded_chapters: list[str] = []
+        self.skipped_chapters: list[str] = []
+        self.error_chapters: list[str] = []
 
         # prepare everything
         self._prepare()
@@ -121,26 +336,78 @@ class MangaDLP:
         self._pre_checks()
         # init api
         self.api_used = match_api(self.url_uuid)
+        # create a shared http session for the api and the downloader
+        if not self.session:
+            self.session = create_http_session(
+                getattr(self.api_used, "api_base_url", ""),
+                self.download_workers,
+                self.download_wait,
+                self.http_retries,
+                self.http_backoff,
+                unlimited_urls=get_report_urls(self.api_used),
+            )
         try:
             log.debug("Initializing api")
-            self.api = self.api_used(self.url_uuid, self.language, self.forcevol)
+            api_kwargs: dict[str, Any] = {"session": self.session}
+            if self.quality != "data":
+                api_kwargs["quality"] = self.quality
+            if self.prefetched_manga:
+                api_kwargs["prefetched_manga"] = self.prefetched_manga
+            if self.api_cache_path:
+                api_kwargs["response_cache"] = network.ResponseCache(
+                    self.api_cache_path, self.api_cache_ttl, self.api_cache_size
+                )
+            self.api = self.api_used(self.url_uuid, self.language, self.forcevol, **api_kwargs)
+            # get manga title and uuid
+            self.manga_uuid = self.api.manga_uuid
+            self.manga_title = self.api.manga_title
         except Exception as exc:
             log.error("Can't initialize api. Exiting")
             raise exc
-        # get manga title and uuid
-        self.manga_uuid = self.api.manga_uuid
-        self.manga_title = self.api.manga_title
-        # get chapter list
-        self.manga_chapter_list = self.api.chapter_list
-        self.manga_total_chapters = len(self.manga_chapter_list)
         self.manga_path = self.download_path / self.manga_title
 
+    # the chapter feed is only requested from the api on first access
+    @property
+    def manga_chapter_list(self) -> list[str]:
+        chapter_list: list[str] = self.api.chapter_list
+        return chapter_list
+
+    @property
+    def manga_total_chapters(self) -> int:
+        return len(self.manga_chapter_list)
+
     def _pre_checks(self) -> None:
         # prechecks userinput/options
         # no url and no readin list given
         if not self.url_uuid:
             log.error('You need to specify a manga url/uuid with "-u" or a list with "--read"')
             raise ValueError
+        # unknown download engine
+        if self.engine not in ("sync", "async"):
+            log.error(f"Invalid download engine: '{self.engine}'")
+            raise ValueError
+        # unknown image quality
+        if self.quality not in IMAGE_QUALITIES:
+            log.error(f"Invalid image quality: '{self.quality}'")
+            raise ValueError
+        # unknown zip compression
+        if self.compression not in utils.COMPRESSION_MODES:
+            log.error(f"Invalid compression: '{self.compression}'")
+            raise ValueError
+        # streaming only works for zip based formats and with the sync engine
+        if self.stream_archive and self.file_format in ("", ".pdf"):
+            log.error("You can't use --stream with the pdf format or without an archive")
+            raise ValueError
+        if self.stream_archive and self.engine == "async":
+            log.error("You can't use --stream with the async engine")
+            raise ValueError
+        # the chapter feed is stored in the cache-db
+        if self.incremental and not self.cache_path:
+            log.error("You need to specify a cache path with --cache-path to use --incremental")
+            raise ValueError
+        if self.adaptive_polling and not self.cache_path:
+            log.error("You need to specify a cache path with --cache-path to use --adaptive")
+            raise ValueError
         # checks if --list is not used
         if not self.list_chapters:
             if not self.chapters:
@@ -159,19 +426,131 @@ class MangaDLP:
                 raise ValueError
 
     # once called per manga
-    def get_manga(self) -> None:  # noqa
-        print_divider = "========================================="
+    def get_manga(self) -> None:
+        chapters_to_download = self.prepare_manga()
+        if chapters_to_download is None:
+            return
+
+        # post-process chapters in a separate thread, while the next chapter is downloading
+        chapter_queue: queue.Queue[tuple[str, Path, dict[str, Any]] | None] = queue.Queue(
+            maxsize=self.pipeline_size
+        )
+        workers: list[threading.Thread] = []
+        if self.pipeline_size > 0:
+            log.debug(f"Starting chapter pipeline with a queue size of {self.pipeline_size}")
+            # one post-processing thread per archive worker, so the archive processes are busy
+            for _ in range(max(1, self.archive_workers)):
+                worker = threading.Thread(
+                    target=self._process_worker,
+                    args=(chapter_queue, self.error_chapters),
+                    daemon=True,
+                )
+                worker.start()
+                workers.append(worker)
+        own_executors = self._start_executors()
+
+        try:
+            for chapter_num, chapter in enumerate(chapters_to_download, 1):
+                if self.cache and self.cache.has_chapter(chapter):
+                    log.info(f"Chapter '{chapter}' is in cache. Skipping download")
+                    continue
+                self.prefetch_images(
+                    chapters_to_download[chapter_num : chapter_num + self.prefetch_size]
+                )
+
+                # download chapter
+                fetched_chapter = self.fetch_chapter(chapter)
+                if not fetched_chapter:
+                    continue
+                chapter_path, hook_infos = fetched_chapter
+
+                # add metadata, pack downloaded folder and run the post hook
+                if workers:
+                    # blocks if the post-processing can't keep up with the downloads
+                    chapter_queue.put((chapter, chapter_path, hook_infos))
+                else:
+                    self.process_chapter(chapter, chapter_path, hook_infos, self.error_chapters)
+        finally:
+            # wait for the post-processing of the remaining chapters
+            for _ in workers:
+                chapter_queue.put(None)
+            for worker in workers:
+                worker.join()
+            self._stop_executors(*own_executors)
+
+        self.finish_manga()
+
+    # start the executors of the manga. shared executors are used if they were passed
+    # returns if the archive pool and the async downloader are owned by the manga
+    def _start_executors(self) -> tuple[bool, bool]:
+        # create archives in separate processes
+        own_archive_pool = bool(
+            not self.archive_pool and self.archive_workers > 0 and self.file_format
+        )
+        if own_archive_pool:
+            self.archive_pool = create_archive_pool(self.archive_workers)
+        # one event loop and http client for all chapters of the async engine
+        own_async_downloader = self.engine == "async" and not self.async_downloader
+        if own_async_downloader:
+            self.async_downloader = create_async_downloader(self.session)
+        # request the image urls of the next chapters in the background
+        if self.prefetch_size > 0:
+            self.prefetch_pool = ThreadPoolExecutor(max_workers=1)
+
+        return (own_archive_pool, own_async_downloader)
+
+    # stop the executors of the manga. shared executors are kept for the other mangas
+    def _stop_executors(self, own_archive_pool: bool, own_async_downloader: bool) -> None:
+        if own_archive_pool and self.archive_pool:
+            self.archive_pool.shutdown()
+            self.archive_pool = None
+        if own_async_downloader and self.async_downloader:
+            self.async_downloader.close()
+            self.async_downloader = None
+        if self.prefetch_pool:
+            self.prefetch_pool.shutdown(cancel_futures=True)
+            self.prefetch_pool = None
+            self.prefetched_images.clear()
+
+    # show the manga infos, select the chapters and run the pre hook
+    # returns None if there is nothing to download
+    def prepare_manga(self) -> list[str] | None:
         # show infos
-        log.info(f"{print_divider}")
+        log.info(f"{PRINT_DIVIDER}")
         log.info(f"Manga Name: {self.manga_title}")
         log.info(f"Manga UUID: {self.manga_uuid}")
+
+        # prepare cache if specified
+        if self.cache_path and not self.list_chapters:
+            self.cache = open_cache(
+                self.cache_path, self.manga_uuid, self.language, self.manga_title
+            )
+            log.info(f"Cached chapters: {self.cache.db_uuid_chapters}")
+            # the cached chapter feed is only used by apis which support it. the api writes
+            # to the same instance, so the writes of both don't overwrite each other
+            if self.incremental and hasattr(self.api, "feed_cache"):
+                self.api.feed_cache = self.cache
+            # the manga isn't expected to have new chapters yet
+            next_check = self.cache.get_next_check() if self.adaptive_polling else ""
+            if next_check > datetime.now(tz=timezone.utc).strftime(utils.SYNC_TIME_FORMAT):
+                log.info(f"Next check of the manga is due at {next_check} (UTC). Skipping manga")
+                log.info(f"{PRINT_DIVIDER}\n")
+                return None
+            # the chapter feed isn't needed if all selected chapters are cached
+            if not utils.needs_chapter_feed(self.chapters):
+                selected_chapters = utils.get_chapter_list(self.chapters, [])
+                if all(self.cache.has_chapter(chapter) for chapter in selected_chapters):
+                    log.info("All selected chapters are in cache. Skipping manga")
+                    log.info(f"{PRINT_DIVIDER}\n")
+                    return None
+
         log.info(f"Total chapters: {self.manga_total_chapters}")
 
         # list chapters if list_chapters is true
         if self.list_chapters:
             log.info(f"Available Chapters: {', '.join(self.manga_chapter_list)}")
-            log.info(f"{print_divider}\n")
-            return
+            log.info(f"{PRINT_DIVIDER}\n")
+            return None
 
         # check chapters to download if not all
         if self.chapters.lower() == "all":
@@ -181,17 +560,11 @@ class MangaDLP:
 
         # show chapters to download
         log.info(f"Chapters selected: {', '.join(chapters_to_download)}")
-        log.info(f"{print_divider}")
+        log.info(f"{PRINT_DIVIDER}")
 
         # create manga folder
         self.manga_path.mkdir(parents=True, exist_ok=True)
 
-        # prepare cache if specified
-        if self.cache_path:
-            cache = CacheDB(self.cache_path, self.manga_uuid, self.language, self.manga_title)
-            cached_chapters = cache.db_uuid_chapters
-            log.info(f"Cached chapters: {cached_chapters}")
-
         # create dict with all variables for the hooks
         self.hook_infos.update(
             {
@@ -217,79 +590,54 @@ class MangaDLP:
             **self.hook_infos,
         )
 
-        # get chapters
-        skipped_chapters: list[Any] = []
-        error_chapters: list[Any] = []
-        for chapter in chapters_to_download:
-            if self.cache_path and chapter in cached_chapters:
-                log.info(f"Chapter '{chapter}' is in cache. Skipping download")
-                continue
+        self.downloaded_chapters.clear()
+        self.skipped_chapters.clear()
+        self.error_chapters.clear()
 
-            # download chapter
-            try:
-                chapter_path = self.get_chapter(chapter)
-            except KeyboardInterrupt as exc:
-                raise exc
-            except FileExistsError:
-                # skipping chapter download as its already available
-                skipped_chapters.append(chapter)
-                # update cache
-                if self.cache_path:
-                    cache.add_chapter(chapter)
-                continue
-            except Exception:
-                # skip download/packing due to an error
-                error_chapters.append(chapter)
-                continue
-
-            # add metadata
-            if self.add_metadata:
-                try:
-                    metadata = self.api.create_metadata(chapter)
-                    write_metadata(
-                        chapter_path,
-                        {"Format": self.file_format[1:], **metadata},
-                    )
-                except Exception as exc:
-                    log.warning(f"Can't write metadata for chapter '{chapter}'. Reason={exc}")
-
-            # pack downloaded folder
-            if self.file_format:
-                try:
-                    self.archive_chapter(chapter_path)
-                except Exception:
-                    error_chapters.append(chapter)
-                    continue
-
-            # done with chapter
-            log.info(f"Done with chapter '{chapter}'")
+        return chapters_to_download
 
+    # download a chapter. returns None if it was skipped or had an error
+    def fetch_chapter(self, chapter: str) -> tuple[Path, dict[str, Any]] | None:
+        try:
+            chapter_path, hook_infos = self.get_chapter(chapter)
+        except KeyboardInterrupt as exc:
+            raise exc
+        except FileExistsError:
+            # skipping chapter download as its already available
+            self.skipped_chapters.append(chapter)
             # update cache
-            if self.cache_path:
-                cache.add_chapter(chapter)
+            if self.cache:
+                self.cache.add_chapter(chapter)
+            return None
+        except Exception:
+            # skip download/packing due to an error
+            self.error_chapters.append(chapter)
+            return None
 
-            # start chapter post hook
-            run_hook(
-                command=self.chapter_post_hook_cmd,
-                hook_type="chapter_post",
-                status="successful",
-                **self.hook_infos,
-            )
+        self.downloaded_chapters.append(chapter)
 
+        return (chapter_path, hook_infos)
+
+    # show the results and run the post hook
+    def finish_manga(self) -> None:
         # done with manga
-        log.info(f"{print_divider}")
+        log.info(f"{PRINT_DIVIDER}")
         log.info(f"Done with manga: {self.manga_title}")
 
         # filter skipped list
-        skipped_chapters = list(filter(None, skipped_chapters))
+        skipped_chapters = list(filter(None, self.skipped_chapters))
         if len(skipped_chapters) >= 1:
             log.info(f"Skipped chapters: {', '.join(skipped_chapters)}")
 
         # filter error list
-        error_chapters = list(filter(None, error_chapters))
+        error_chapters = list(filter(None, self.error_chapters))
         if len(error_chapters) >= 1:
             log.info(f"Chapters with errors: {', '.join(error_chapters)}")
 
+        # retry the chapters with errors on the next run
+        if self.adaptive_polling and self.cache and not error_chapters:
+            self.schedule_next_check()
+
         # start manga post hook
         run_hook(
             command=self.manga_post_hook_cmd,
@@ -298,17 +646,88 @@ class MangaDLP:
             **self.hook_infos,
         )
 
-        log.info(f"{print_divider}\n")
+        log.info(f"{PRINT_DIVIDER}\n")
+
+    # store the next check of the manga, from the release cadence of its chapters
+    def schedule_next_check(self) -> None:
+        chapter_data: dict[str, ChapterData] = self.api.manga_chapter_data
+        publish_times = [chapter.get("publish_at", "") for chapter in chapter_data.values()]
+        next_check = utils.get_next_check(publish_times, datetime.now(tz=timezone.utc))
+        log.info(f"Next check of the manga at {next_check:%Y-%m-%d %H:%M} (UTC)")
+        if self.cache:
+            self.cache.set_next_check(next_check.strftime(utils.SYNC_TIME_FORMAT))
+
+    # once called per downloaded chapter
+    def process_chapter(
+        self,
+        chapter: str,
+        chapter_path: Path,
+        hook_infos: dict[str, Any],
+        error_chapters: list[Any],
+    ) -> None:
+        # add metadata
+        if self.add_metadata:
+            try:
+                metadata = self.api.create_metadata(chapter)
+                write_metadata(
+                    chapter_path,
+                    {"Format": self.file_format[1:], **metadata},
+                    self.compression,
+                    self.compression_level,
+                )
+            except Exception as exc:
+                log.warning(f"Can't write metadata for chapter '{chapter}'. Reason={exc}")
+
+        # pack downloaded folder
+        if self.file_format:
+            try:
+                self.archive_chapter(chapter_path)
+            except Exception:
+                error_chapters.append(chapter)
+                return
+
+        # done with chapter
+        log.info(f"Done with chapter '{chapter}'")
+
+        # update cache
+        if self.cache:
+            self.cache.add_chapter(chapter)
+
+        # start chapter post hook
+        run_hook(
+            command=self.chapter_post_hook_cmd,
+            hook_type="chapter_post",
+            status="successful",
+            **hook_infos,
+        )
+
+    # post-processing stage of the chapter pipeline
+    def _process_worker(
+        self,
+        chapter_queue: queue.Queue[tuple[str, Path, dict[str, Any]] | None],
+        error_chapters: list[Any],
+    ) -> None:
+        while True:
+            item = chapter_queue.get()
+            # no more chapters to process
+            if item is None:
+                return
+            chapter, chapter_path, hook_infos = item
+            try:
+                self.process_chapter(chapter, chapter_path, hook_infos, error_chapters)
+            except Exception as exc:
+                log.error(f"Can't process chapter '{chapter}'. Reason={exc}")
+                error_chapters.append(chapter)
 
-    # once called per chapter
-    def get_chapter(self, chapter: str) -> Path:
+    # once called per chapter. returns the download target and the hook infos of the chapter
+    def get_chapter(self, chapter: str) -> tuple[Path, dict[str, Any]]:
         # get chapter infos
         chapter_infos: ChapterData = self.api.manga_chapter_data[chapter]
         log.debug(f"Chapter infos: {chapter_infos}")
 
         # get image urls for chapter
         try:
-            chapter_image_urls = self.api.get_chapter_images(chapter, self.download_wait)
+            chapter_image_urls = self.get_image_urls(chapter)
         except KeyboardInterrupt as exc:
             log.critical("Keyboard interrupt. Stopping")
             raise exc
@@ -348,8 +767,12 @@ class MangaDLP:
         chapter_archive_path = Path(f"{chapter_path}{self.file_format}")
 
         # check if chapter already exists
-        # check for folder, if file format is an empty string
-        if chapter_archive_path.exists():
+        # check for folder, if file format is an empty string. a folder with a page manifest
+        # is an incomplete download
+        if (
+            chapter_archive_path.exists()
+            and not downloader.get_manifest_path(chapter_path).exists()
+        ):
             log.info(f"'{chapter_archive_path}' already exists. Skipping")
 
             run_hook(
@@ -363,33 +786,38 @@ class MangaDLP:
             # skipped
             raise FileExistsError
 
-        # create chapter folder (skips it if it already exists)
-        chapter_path.mkdir(parents=True, exist_ok=True)
+        # set the download target. a folder for the images or a temporary archive
+        if self.stream_archive:
+            download_target = Path(f"{chapter_archive_path}.part")
+        else:
+            download_target = chapter_path
+            # create chapter folder (skips it if it already exists)
+            chapter_path.mkdir(parents=True, exist_ok=True)
 
         # verbose log
         log.debug(f"Chapter UUID: {chapter_infos['uuid']}")
         log.debug(f"File path: '{chapter_archive_path}'")
         log.debug(f"Image URLS:\n{chapter_image_urls}")
 
-        # create dict with all variables for the hooks
-        self.hook_infos.update(
-            {
-                "chapter_filename": chapter_filename,
-                "chapter_path": chapter_path,
-                "chapter_archive_path": chapter_archive_path,
-                "chapter_uuid": chapter_infos["uuid"],
-                "chapter_volume": chapter_infos["volume"],
-                "chapter_number": chapter_infos["chapter"],
-                "chapter_name": chapter_infos["name"],
-            }
-        )
+        # create dict with all variables for the hooks. a copy per chapter, as chapters of
+        # the same manga can be downloaded in parallel
+        hook_infos: dict[str, Any] = {
+            **self.hook_infos,
+            "chapter_filename": chapter_filename,
+            "chapter_path": chapter_path,
+            "chapter_archive_path": chapter_archive_path,
+            "chapter_uuid": chapter_infos["uuid"],
+            "chapter_volume": chapter_infos["volume"],
+            "chapter_number": chapter_infos["chapter"],
+            "chapter_name": chapter_infos["name"],
+        }
 
         # start chapter pre hook
         run_hook(
             command=self.chapter_pre_hook_cmd,
             hook_type="chapter_pre",
             status="starting",
-            **self.hook_infos,
+            **hook_infos,
         )
 
         # log
@@ -397,12 +825,15 @@ class MangaDLP:
 
         # download images
         try:
-            downloader.download_chapter(chapter_image_urls, chapter_path, self.download_wait)
+            self.download_images(chapter, chapter_image_urls, download_target)
         except KeyboardInterrupt as exc:
             log.critical("Keyboard interrupt. Stopping")
             raise exc
         except Exception as exc:
             log.error(f"Cant download: '{chapter_filename}'. Skipping")
+            # remove the incomplete archive
+            if self.stream_archive:
+                download_target.unlink(missing_ok=True)
 
             # run chapter post hook
             run_hook(
@@ -410,7 +841,7 @@ class MangaDLP:
                 hook_type="chapter_post",
                 status="starting",
                 reason="Download error",
-                **self.hook_infos,
+                **hook_infos,
             )
 
             # chapter error
@@ -420,10 +851,122 @@ class MangaDLP:
         log.info(f"Successfully downloaded: '{chapter_filename}'")
 
         # ok
-        return chapter_path
+        return (download_target, hook_infos)
+
+    # request the image urls of the chapters in the background
+    def prefetch_images(self, chapters: list[str]) -> None:
+        if not self.prefetch_pool:
+            return
+        for chapter in chapters:
+            if chapter in self.prefetched_images or (
+                self.cache and self.cache.has_chapter(chapter)
+            ):
+                continue
+            log.debug(f"Prefetching image urls of chapter: {chapter}")
+            self.prefetched_images[chapter] = self.prefetch_pool.submit(
+                self._request_images, chapter
+            )
+
+    def _request_images(self, chapter: str) -> tuple[float, list[str]]:
+        request_time = time.monotonic()
+        image_urls: list[str] = self.api.get_chapter_images(chapter, self.download_wait)
+
+        return (request_time, image_urls)
+
+    # get the image urls of a chapter. prefetched urls are used if they are not expired
+    def get_image_urls(self, chapter: str) -> list[str]:
+        prefetched = self.prefetched_images.pop(chapter, None)
+        if prefetched:
+            try:
+                request_time, image_urls = prefetched.result()
+            except Exception as exc:
+                log.warning(f"Prefetching the image urls failed. Reason={exc!r}")
+            else:
+                if image_urls and time.monotonic() - request_time < IMAGE_URLS_TTL:
+                    log.debug(f"Using prefetched image urls of chapter: {chapter}")
+                    return image_urls
+                log.debug(f"Prefetched image urls expired for chapter: {chapter}")
+
+        chapter_image_urls: list[str] = self.api.get_chapter_images(chapter, self.download_wait)
+        return chapter_image_urls
+
+    # download the images of a chapter. switches to another image server if one fails
+    def download_images(self, chapter: str, image_urls: list[str], download_target: Path) -> None:
+        # report the image downloads, if the api supports it (mangadex@home)
+        report: downloader.ReportCallback | None = getattr(self.api, "report_image", None)
+        download_error: Exception = ConnectionError()
+        # the pages of another quality tier are removed by the page manifest of the download
+        for image_urls_try in self.get_image_sources(chapter, image_urls):
+            try:
+                if self.stream_archive:
+                    downloader.download_chapter_archive(
+                        image_urls_try,
+                        download_target,
+                        self.download_wait,
+                        self.download_workers,
+                        self.session,
+                        self.compression,
+                        self.compression_level,
+                        report,
+                    )
+                elif self.engine == "async":
+                    # completed pages of the failed server are kept
+                    downloader.download_chapter_async(
+                        image_urls_try,
+                        download_target,
+                        self.download_wait,
+                        self.download_workers,
+                        report,
+                        self.async_downloader,
+                    )
+                else:
+                    # completed pages of the failed server are kept
+                    downloader.download_chapter(
+                        image_urls_try,
+                        download_target,
+                        self.download_wait,
+                        self.download_workers,
+                        self.session,
+                        report,
+                    )
+            except KeyboardInterrupt as exc:
+                raise exc
+            except Exception as exc:
+                log.warning(f"Image download failed. Reason={exc!r}")
+                download_error = exc
+                continue
+            return
+
+        raise download_error
+
+    # image urls to try. the initial server, a new server and the main server of the api
+    def get_image_sources(self, chapter: str, image_urls: list[str]) -> Iterator[list[str]]:
+        yield image_urls
+        log.info("Requesting a new image server")
+        new_image_urls: list[str] = self.api.get_chapter_images(chapter, self.download_wait)
+        if new_image_urls and new_image_urls != image_urls:
+            yield new_image_urls
+        get_fallback_images = getattr(self.api, "get_fallback_images", None)
+        if not get_fallback_images:
+            return
+        log.info("Falling back to the main image server")
+        fallback_image_urls: list[str] = get_fallback_images(chapter)
+        if fallback_image_urls and fallback_image_urls not in (image_urls, new_image_urls):
+            yield fallback_image_urls
 
     # create an archive of the chapter if needed
     def archive_chapter(self, chapter_path: Path) -> None:
+        # chapter was downloaded directly into an archive. move it in place
+        if self.stream_archive:
+            archive_path = chapter_path.with_suffix("")
+            log.info(f"Finishing archive '{archive_path}'")
+            try:
+                chapter_path.replace(archive_path)
+            except Exception as exc:
+                log.error("Archive error. Skipping chapter")
+                raise exc
+            return
+
         log.info(f"Creating archive '{chapter_path}{self.file_format}'")
         try:
             # check if image folder is existing
@@ -431,9 +974,20 @@ class MangaDLP:
                 log.error(f"Image folder: {chapter_path} does not exist")
                 raise OSError
             if self.file_format == ".pdf":
-                utils.make_pdf(chapter_path)
+                archive_args: tuple[Any, ...] = (utils.make_pdf, chapter_path)
+            else:
+                archive_args = (
+                    utils.make_archive,
+                    chapter_path,
+                    self.file_format,
+                    self.compression,
+                    self.compression_level,
+                )
+            # the process pool re-raises the errors of the worker process
+            if self.archive_pool:
+                self.archive_pool.submit(*archive_args).result()
             else:
-                utils.make_archive(chapter_path, self.file_format)
+                archive_args[0](*archive_args[1:])
         except Exception as exc:
             log.error("Archive error. Skipping chapter")
             raise exc
@@ -1,9 +1,50 @@
 import json
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
 from loguru import logger as log
 
-from mangadlp.models import CacheData, CacheKeyData
+from mangadlp.models import CacheData, CacheKeyData, ChapterData
+
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None  # type: ignore
+
+
+# file suffixes which use the sqlite cache-db
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mangas (
+    manga_uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (manga_uuid, language)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    manga_uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    PRIMARY KEY (manga_uuid, language, chapter)
+);
+CREATE TABLE IF NOT EXISTS feeds (
+    manga_uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    last_sync TEXT NOT NULL,
+    feed TEXT NOT NULL,
+    PRIMARY KEY (manga_uuid, language)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    manga_uuid TEXT NOT NULL,
+    language TEXT NOT NULL,
+    next_check TEXT NOT NULL,
+    PRIMARY KEY (manga_uuid, language)
+);
+"""
 
 
 class CacheDB:  # noqa: D101
@@ -19,34 +60,36 @@ class CacheDB:  # noqa: D101
         self.lang = manga_lang
         self.name = manga_name
         self.db_key = f"{manga_uuid}__{manga_lang}"
+        # chapters can be added from multiple threads (pipeline)
+        self.lock = threading.Lock()
 
         self._prepare_db()
 
+        log.info(f"Reading cache-db: {self.db_path}")
         self.db_data = self._read_db()
         # create db key entry if not found
         if not self.db_data.get(self.db_key):
             self.db_data[self.db_key] = {}
 
         self.db_uuid_data: CacheKeyData = self.db_data[self.db_key]
-        if not self.db_uuid_data.get("name"):
-            self.db_uuid_data.update({"name": self.name})
-            self._write_db()
-
         self.db_uuid_chapters: list[str] = self.db_uuid_data.get("chapters") or []
+        self.db_chapter_set: set[str] = set(self.db_uuid_chapters)
+        if not self.db_uuid_data.get("name"):
+            self._write_db({"name": self.name})
 
     def _prepare_db(self) -> None:
         if self.db_path.exists():
             return
-        # create empty cache
+        # create empty cache. another process could create it at the same time
         try:
-            self.db_path.touch()
-            self.db_path.write_text(json.dumps({}), encoding="utf8")
+            with lock_file(self.db_path):
+                if not self.db_path.exists():
+                    self._replace_db(json.dumps({}))
         except Exception as exc:
             log.error("Can't create db-file")
             raise exc
 
     def _read_db(self) -> CacheData:
-        log.info(f"Reading cache-db: {self.db_path}")
         try:
             db_txt = self.db_path.read_text(encoding="utf8")
             db_dict: CacheData = json.loads(db_txt)
@@ -56,23 +99,263 @@ class CacheDB:  # noqa: D101
 
         return db_dict
 
-    def _write_db(self) -> None:
-        db_dump = json.dumps(self.db_data, indent=4, sort_keys=True)
-        self.db_path.write_text(db_dump, encoding="utf8")
+    def _write_db(self, changes: CacheKeyData) -> None:
+        # other processes could have written to the cache in the meantime. only the changed
+        # fields of this manga are written, everything else is kept from the file
+        with lock_file(self.db_path):
+            log.debug(f"Merging changes into cache-db: {self.db_path}")
+            self.db_data = merge_cache_data(self._read_db(), self.db_key, changes)
+            self.db_uuid_data = self.db_data[self.db_key]
+            # chapters downloaded by other processes
+            self.db_uuid_chapters = self.db_uuid_data.get("chapters") or []
+            self.db_chapter_set.update(self.db_uuid_chapters)
+
+            db_dump = json.dumps(self.db_data, indent=4, sort_keys=True)
+            self._replace_db(db_dump)
+
+    def _replace_db(self, db_dump: str) -> None:
+        # write to a temporary file first, so readers never see a partial file
+        tmp_path = self.db_path.with_name(f"{self.db_path.name}.tmp")
+        tmp_path.write_text(db_dump, encoding="utf8")
+        tmp_path.replace(self.db_path)
+
+    def has_chapter(self, chapter: str) -> bool:
+        return chapter in self.db_chapter_set
 
     def add_chapter(self, chapter: str) -> None:
-        log.info(f"Adding chapter to cache-db: {chapter}")
-        self.db_uuid_chapters.append(chapter)
-        # dedup entries
-        updated_chapters = list({*self.db_uuid_chapters})
-        sorted_chapters = sort_chapters(updated_chapters)
+        self.add_chapters([chapter])
+
+    def add_chapters(self, chapters: list[str]) -> None:
+        log.info(f"Adding chapters to cache-db: {chapters}")
+        with self.lock:
+            self.db_chapter_set.update(chapters)
+            try:
+                # merged with the cached chapters
+                self._write_db({"chapters": chapters})
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+    def get_feed(self) -> tuple[str, list[ChapterData]]:
+        return (self.db_uuid_data.get("last_sync") or "", self.db_uuid_data.get("feed") or [])
+
+    def set_feed(self, last_sync: str, feed: list[ChapterData]) -> None:
+        log.debug(f"Updating chapter feed in cache-db. Last sync: {last_sync}")
+        with self.lock:
+            try:
+                self._write_db({"last_sync": last_sync, "feed": feed})
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+    def get_next_check(self) -> str:
+        return self.db_uuid_data.get("next_check") or ""
+
+    def set_next_check(self, next_check: str) -> None:
+        log.debug(f"Next check of the manga: {next_check}")
+        with self.lock:
+            try:
+                self._write_db({"next_check": next_check})
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+
+class CacheSqliteDB:
+    """Cache-db backed by sqlite.
+
+    Same interface as CacheDB, but chapters are stored as indexed rows, so adding a chapter
+    doesn't rewrite the whole cache. A json cache with the same name is imported on creation.
+
+    Args:
+        db_path: Path to the sqlite file. E.g. cache.db
+        manga_uuid: UUID of the manga
+        manga_lang: Language of the manga
+        manga_name: Name of the manga
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        db_path: str | Path,
+        manga_uuid: str,
+        manga_lang: str,
+        manga_name: str,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.uuid = manga_uuid
+        self.lang = manga_lang
+        self.name = manga_name
+        self.lock = threading.Lock()
+
+        self.db = self._prepare_db()
+
+        # create manga entry if not found
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO mangas (manga_uuid, language, name) VALUES (?, ?, ?)",
+                (self.uuid, self.lang, self.name),
+            )
+
+        self.db_uuid_chapters: list[str] = self._read_chapters()
+        self.db_chapter_set: set[str] = set(self.db_uuid_chapters)
+
+    def _prepare_db(self) -> sqlite3.Connection:
+        log.info(f"Reading cache-db: {self.db_path}")
+        is_new = not self.db_path.exists()
         try:
-            self.db_data[self.db_key]["chapters"] = sorted_chapters
-            self._write_db()
+            db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            with db:
+                db.executescript(SQLITE_SCHEMA)
         except Exception as exc:
-            log.error("Can't write cache-db")
+            log.error("Can't load cache-db")
             raise exc
 
+        # import an existing json cache
+        json_path = self.db_path.with_suffix(".json")
+        if is_new and json_path.exists():
+            migrate_json_cache(json_path, db)
+
+        return db
+
+    def _read_chapters(self) -> list[str]:
+        rows = self.db.execute(
+            "SELECT chapter FROM chapters WHERE manga_uuid = ? AND language = ?",
+            (self.uuid, self.lang),
+        ).fetchall()
+
+        return sort_chapters([row[0] for row in rows])
+
+    def has_chapter(self, chapter: str) -> bool:
+        return chapter in self.db_chapter_set
+
+    def add_chapter(self, chapter: str) -> None:
+        self.add_chapters([chapter])
+
+    def add_chapters(self, chapters: list[str]) -> None:
+        log.info(f"Adding chapters to cache-db: {chapters}")
+        with self.lock:
+            new_chapters = [chapter for chapter in chapters if chapter not in self.db_chapter_set]
+            self.db_uuid_chapters.extend(new_chapters)
+            self.db_chapter_set.update(new_chapters)
+            try:
+                # all chapters in one transaction
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO chapters (manga_uuid, language, chapter) VALUES (?, ?, ?)",
+                        [(self.uuid, self.lang, chapter) for chapter in new_chapters],
+                    )
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+    def get_feed(self) -> tuple[str, list[ChapterData]]:
+        row = self.db.execute(
+            "SELECT last_sync, feed FROM feeds WHERE manga_uuid = ? AND language = ?",
+            (self.uuid, self.lang),
+        ).fetchone()
+        if not row:
+            return ("", [])
+
+        return (row[0], json.loads(row[1]))
+
+    def set_feed(self, last_sync: str, feed: list[ChapterData]) -> None:
+        log.debug(f"Updating chapter feed in cache-db. Last sync: {last_sync}")
+        with self.lock:
+            try:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO feeds (manga_uuid, language, last_sync, feed) VALUES (?, ?, ?, ?)",
+                        (self.uuid, self.lang, last_sync, json.dumps(feed)),
+                    )
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+    def get_next_check(self) -> str:
+        row = self.db.execute(
+            "SELECT next_check FROM schedules WHERE manga_uuid = ? AND language = ?",
+            (self.uuid, self.lang),
+        ).fetchone()
+
+        return row[0] if row else ""
+
+    def set_next_check(self, next_check: str) -> None:
+        log.debug(f"Next check of the manga: {next_check}")
+        with self.lock:
+            try:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO schedules (manga_uuid, language, next_check) VALUES (?, ?, ?)",
+                        (self.uuid, self.lang, next_check),
+                    )
+            except Exception as exc:
+                log.error("Can't write cache-db")
+                raise exc
+
+
+# lock a file exclusively for all processes. only works on unix
+@contextmanager
+def lock_file(file_path: Path) -> Iterator[None]:
+    lock_path = file_path.with_name(f"{file_path.name}.lock")
+    with lock_path.open("a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# apply the changed fields of a manga to the cache entries from the file
+def merge_cache_data(disk_data: CacheData, db_key: str, changes: CacheKeyData) -> CacheData:
+    disk_entry: CacheKeyData = disk_data.get(db_key) or {}
+    merged_entry: CacheKeyData = {**disk_entry, **changes}
+    # chapters are only added, never removed
+    if "chapters" in changes:
+        chapters = {*(disk_entry.get("chapters") or []), *(changes.get("chapters") or [])}
+        merged_entry["chapters"] = sort_chapters(list(chapters))
+
+    return {**disk_data, db_key: merged_entry}
+
+
+# cache-db class to use for the file
+def open_cache(
+    db_path: str | Path,
+    manga_uuid: str,
+    manga_lang: str,
+    manga_name: str,
+) -> CacheDB | CacheSqliteDB:
+    if Path(db_path).suffix.lower() in SQLITE_SUFFIXES:
+        return CacheSqliteDB(db_path, manga_uuid, manga_lang, manga_name)
+
+    return CacheDB(db_path, manga_uuid, manga_lang, manga_name)
+
+
+# import all entries of a json cache into a sqlite cache
+def migrate_json_cache(json_path: str | Path, db: sqlite3.Connection) -> None:
+    log.info(f"Importing json cache-db: {json_path}")
+    try:
+        json_data: dict[str, CacheKeyData] = json.loads(Path(json_path).read_text(encoding="utf8"))
+    except Exception as exc:
+        log.error("Can't load json cache-db")
+        raise exc
+
+    with db:
+        for db_key, db_uuid_data in json_data.items():
+            manga_uuid, manga_lang = db_key.split("__", 1)
+            db.execute(
+                "INSERT OR IGNORE INTO mangas (manga_uuid, language, name) VALUES (?, ?, ?)",
+                (manga_uuid, manga_lang, db_uuid_data.get("name") or ""),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO chapters (manga_uuid, language, chapter) VALUES (?, ?, ?)",
+                [
+                    (manga_uuid, manga_lang, chapter)
+                    for chapter in db_uuid_data.get("chapters") or []
+                ],
+            )
+
 
 def sort_chapters(chapters: list[str]) -> list[str]:
     try:
@@ -10,15 +10,19 @@ from click_option_group import (
 )
 from loguru import logger as log
 
-from mangadlp import app
 from mangadlp.__about__ import __version__
+from mangadlp.cache import SQLITE_SUFFIXES
 from mangadlp.logger import prepare_logger
+from mangadlp.scheduler import MangaDaemon, MangaScheduler
 
 
 # read in the list of links from a file
-def readin_list(_ctx: click.Context, _param: str, value: str) -> list[str]:
+def readin_list(ctx: click.Context | None, _param: str, value: str) -> list[str]:
     if not value:
         return []
+    # the daemon reads in the file again if it changes
+    if ctx:
+        ctx.meta["read_path"] = value
 
     list_file = Path(value)
     click.echo(f"Reading in file '{list_file}'")
@@ -173,6 +177,114 @@ def readin_list(_ctx: click.Context, _param: str, value: str) -> list[str]:
     show_default=True,
     help="Time to wait for each picture to download in seconds(float)",
 )
+@click.option(
+    "--workers",
+    "download_workers",
+    type=click.IntRange(min=1),
+    default=1,
+    required=False,
+    show_default=True,
+    help="Amount of pictures to download in parallel",
+)
+@click.option(
+    "--engine",
+    "engine",
+    type=click.Choice(["sync", "async"], case_sensitive=False),
+    default="sync",
+    required=False,
+    show_default=True,
+    help="Download engine. 'async' needs aiohttp and downloads with asyncio instead of threads",
+)
+@click.option(
+    "--quality",
+    "quality",
+    type=click.Choice(["data", "data-saver"], case_sensitive=False),
+    default="data",
+    required=False,
+    show_default=True,
+    help="Image quality. 'data-saver' downloads compressed images and falls back to the originals",
+)
+@click.option(
+    "--http-retries",
+    "http_retries",
+    type=click.IntRange(min=0),
+    default=3,
+    required=False,
+    show_default=True,
+    help="Retries of http requests on connection errors and server errors",
+)
+@click.option(
+    "--http-backoff",
+    "http_backoff",
+    type=float,
+    default=0.5,
+    required=False,
+    show_default=True,
+    help="Backoff factor between the http retries in seconds(float)",
+)
+@click.option(
+    "--parallel",
+    "parallel",
+    type=click.IntRange(min=1),
+    default=1,
+    required=False,
+    show_default=True,
+    help="Amount of mangas to download at the same time",
+)
+@click.option(
+    "--daemon",
+    "daemon",
+    is_flag=True,
+    default=False,
+    required=False,
+    show_default=True,
+    help="Keep running and check the mangas of the --read list for new chapters every --interval",
+)
+@click.option(
+    "--interval",
+    "interval",
+    type=click.FloatRange(min=60),
+    default=86400,
+    required=False,
+    show_default=True,
+    help="Time in seconds(float) between the checks of a manga in daemon mode",
+)
+@click.option(
+    "--jitter",
+    "jitter",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    required=False,
+    show_default=True,
+    help="Random deviation of the interval in daemon mode, as fraction of it",
+)
+@click.option(
+    "--global-queue",
+    "global_queue",
+    is_flag=True,
+    default=False,
+    required=False,
+    show_default=True,
+    help="Download the chapters of all mangas from one queue with --parallel workers. The newest chapters of every manga first",
+)
+@click.option(
+    "--max-per-manga",
+    "max_per_manga",
+    type=click.IntRange(min=1),
+    default=1,
+    required=False,
+    show_default=True,
+    help="Maximum chapters of a manga which download at the same time with --global-queue",
+)
+@click.option(
+    "--host-connections",
+    "host_connections",
+    type=click.IntRange(min=1),
+    default=10,
+    required=False,
+    show_default=True,
+    help="Maximum concurrent requests per host, shared between all mangas",
+)
 # hook options
 @click.option(
     "--hook-manga-pre",
@@ -217,7 +329,52 @@ def readin_list(_ctx: click.Context, _param: str, value: str) -> list[str]:
     default=None,
     required=False,
     show_default=True,
-    help="Where to store the cache-db. If no path is given, cache is disabled",
+    help="Where to store the cache-db. Use a .db file for sqlite. If no path is given, cache is disabled",
+)
+@click.option(
+    "--incremental",
+    "incremental",
+    is_flag=True,
+    default=False,
+    required=False,
+    show_default=True,
+    help="Only request chapters updated since the last run. The chapter feed is stored in the cache-db. Use a .db cache-db for big libraries",
+)
+@click.option(
+    "--adaptive",
+    "adaptive_polling",
+    is_flag=True,
+    default=False,
+    required=False,
+    show_default=True,
+    help="Skip mangas until their next release is expected. The release cadence is stored in the cache-db",
+)
+@click.option(
+    "--api-cache",
+    "api_cache_path",
+    type=click.Path(exists=False, writable=True, path_type=str),
+    default=None,
+    required=False,
+    show_default=True,
+    help="Where to store the sqlite cache for api responses. If no path is given, responses are not cached",
+)
+@click.option(
+    "--api-cache-ttl",
+    "api_cache_ttl",
+    type=click.FloatRange(min=0),
+    default=3600,
+    required=False,
+    show_default=True,
+    help="Time in seconds(float), in which cached api responses are used without revalidation",
+)
+@click.option(
+    "--api-cache-size",
+    "api_cache_size",
+    type=click.IntRange(min=1),
+    default=1000,
+    required=False,
+    show_default=True,
+    help="Maximum amount of cached api responses",
 )
 @click.option(
     "--add-metadata/--no-metadata",
@@ -228,6 +385,60 @@ def readin_list(_ctx: click.Context, _param: str, value: str) -> list[str]:
     show_default=True,
     help="Enable/disable creation of metadata via ComicInfo.xml",
 )
+@click.option(
+    "--pipeline",
+    "pipeline_size",
+    type=click.IntRange(min=0),
+    default=0,
+    required=False,
+    show_default=True,
+    help="Archive chapters while the next ones download. Amount of chapters which can wait for archiving",
+)
+@click.option(
+    "--prefetch",
+    "prefetch_size",
+    type=click.IntRange(min=0),
+    default=0,
+    required=False,
+    show_default=True,
+    help="Request the image urls of the next chapters in the background. Amount of chapters",
+)
+@click.option(
+    "--stream",
+    "stream_archive",
+    is_flag=True,
+    default=False,
+    required=False,
+    show_default=True,
+    help="Download images directly into the archive. Only for zip based formats",
+)
+@click.option(
+    "--compression",
+    "compression",
+    type=click.Choice(["stored", "deflate", "auto"], case_sensitive=False),
+    default="stored",
+    required=False,
+    show_default=True,
+    help="Zip compression of the archives. 'auto' only compresses files which are not images",
+)
+@click.option(
+    "--compression-level",
+    "compression_level",
+    type=click.IntRange(min=0, max=9),
+    default=None,
+    required=False,
+    show_default=True,
+    help="Compression level for deflate. Defaults to the zlib default",
+)
+@click.option(
+    "--archive-workers",
+    "archive_workers",
+    type=click.IntRange(min=0),
+    default=0,
+    required=False,
+    show_default=True,
+    help="Amount of processes to create archives with. 0 archives in the main process",
+)
 @click.pass_context
 def main(ctx: click.Context, **kwargs: Any) -> None:
     """Script to download mangas from various sites."""
@@ -245,20 +456,37 @@ def main(ctx: click.Context, **kwargs: Any) -> None:
     # list all params
     log.debug(ctx.params)
 
+    # the json cache-db is rewritten for every chapter, which gets slow with the chapter feeds
+    cache_path: str | None = kwargs.get("cache_path")
+    if (
+        kwargs.get("incremental")
+        and cache_path
+        and Path(cache_path).suffix.lower() not in SQLITE_SUFFIXES
+    ):
+        log.warning(
+            "--incremental stores the chapter feed of every manga in the cache-db. "
+            "Use a sqlite cache-db (.db) for big libraries"
+        )
+
+    # keep running and check the mangas of the list regularly
+    daemon: bool = kwargs.pop("daemon")
+    interval: float = kwargs.pop("interval")
+    jitter: float = kwargs.pop("jitter")
+    if daemon:
+        if "read_path" not in ctx.meta:
+            log.error("You need to specify a list with --read to use --daemon")
+            sys.exit(1)
+        MangaDaemon(ctx.meta["read_path"], interval, jitter, **kwargs).run()
+        return
+
     # all request mangas
     requested_mangas = [url_uuid] if url_uuid else read_mangas
 
-    for manga in requested_mangas:
-        try:
-            mdlp = app.MangaDLP(url_uuid=manga, **kwargs)
-            mdlp.get_manga()
-        except (KeyboardInterrupt, Exception) as exc:
-            # if only a single manga is requested and had an error, then exit
-            if len(requested_mangas) == 1:
-                log.error(f"Error with manga: {manga}")
-                sys.exit(1)
-            # else continue with the other ones
-            log.error(f"Skipping: {manga}. Reason={exc}")
+    scheduler = MangaScheduler(requested_mangas, **kwargs)
+    failed_mangas = scheduler.run()
+    # if only a single manga is requested and had an error, then exit
+    if failed_mangas and len(requested_mangas) == 1:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
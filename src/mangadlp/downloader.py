@@ -1,12 +1,423 @@
+import asyncio
+import hashlib
+import json
 import logging
-import shutil
+import re
+import threading
+import time
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from time import sleep
+from typing import IO, TYPE_CHECKING
+from urllib.parse import urlsplit
+from zipfile import ZipFile
 
 import requests
 from loguru import logger as log
 
-from mangadlp import utils
+from mangadlp import network, utils
+from mangadlp.models import PageData
+
+
+if TYPE_CHECKING:
+    import aiohttp
+    from urllib3 import HTTPResponse
+
+
+# suffix of the manifest of the completed pages. stored next to the chapter folder
+MANIFEST_SUFFIX = ".pages.json"
+
+
+def get_manifest_path(chapter_path: str | Path) -> Path:
+    return Path(f"{chapter_path}{MANIFEST_SUFFIX}")
+
+
+# file name of a page on the image server. the same on every mangadex@home node, but other
+# for another quality tier or a re-uploaded chapter
+def get_page_source(image: str) -> str:
+    return Path(urlsplit(image).path).name
+
+
+# pages and partially written pages in a chapter folder. e.g. '001.png' or '001.png.part'
+PAGE_FILE_REGEX = re.compile(r"\d{3,}\.\w+(\.part)?")
+
+
+class PageManifest:
+    """Completed pages of a chapter download.
+
+    Pages are added with their size, sha256 hash and source page name after they are
+    written, so a failed chapter download can be resumed without downloading the completed
+    pages again. Pages of another source are never resumed.
+
+    Args:
+        manifest_path: Path to the manifest file. E.g. '<chapter folder>.pages.json'
+    """
+
+    def __init__(self, manifest_path: Path) -> None:  # noqa: D107
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.pages: dict[str, PageData] = self._read()
+
+    def _read(self) -> dict[str, PageData]:
+        try:
+            pages: dict[str, PageData] = json.loads(self.manifest_path.read_text(encoding="utf8"))
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning(f"Invalid page manifest: {self.manifest_path}. Downloading all pages")
+            return {}
+
+        log.info(f"Resuming chapter download. Completed pages: {len(pages)}")
+        return pages
+
+    def is_complete(self, image_path: Path, image: str) -> bool:
+        page = self.pages.get(image_path.name)
+        if not page or not image_path.is_file() or image_path.stat().st_size != page["size"]:
+            return False
+        # page of another source, e.g. the data-saver image of a previous run
+        if page.get("source") != get_page_source(image):
+            return False
+        url_hash = get_page_hash(image)
+        if url_hash and page["sha256"] != url_hash:
+            return False
+
+        page_hash: str = page["sha256"]
+        file_hash: str = utils.file_sha256(image_path)
+        return file_hash == page_hash
+
+    def add(self, image_path: Path, image: str, sha256: str = "") -> None:
+        page: PageData = {
+            "size": image_path.stat().st_size,
+            "sha256": sha256 or utils.file_sha256(image_path),
+            "source": get_page_source(image),
+        }
+        with self.lock:
+            self.pages[image_path.name] = page
+            self._write()
+
+    def prepare(self, images: list[tuple[str, Path]], chapter_path: str | Path) -> None:
+        """Remove the pages of other sources from the chapter folder before a download.
+
+        Pages which the current urls don't produce, or which were downloaded from another
+        source (e.g. another quality tier), are removed with their manifest entries.
+        Partially written pages are only continued if all completed pages are from the
+        current urls, as their source is unknown.
+
+        Args:
+            images: URLs and paths of the pages of the chapter
+            chapter_path: Folder of the pages
+        """
+        sources = {image_path.name: get_page_source(image) for image, image_path in images}
+        other_pages = {
+            name for name, page in self.pages.items() if page.get("source") != sources.get(name)
+        }
+        keep_parts = bool(self.pages) and not other_pages
+        for file_path in Path(chapter_path).glob("*"):
+            if not PAGE_FILE_REGEX.fullmatch(file_path.name):
+                continue
+            if file_path.suffix == ".part":
+                is_current = keep_parts and file_path.stem in sources
+            else:
+                is_current = file_path.name in sources and file_path.name not in other_pages
+            if not is_current:
+                log.debug(f"Removing page of another source: {file_path.name}")
+                file_path.unlink()
+
+        if other_pages:
+            log.info(f"Pages of another image source: {len(other_pages)}. Downloading them again")
+            with self.lock:
+                for name in other_pages:
+                    del self.pages[name]
+                self._write()
+
+    def _write(self) -> None:
+        tmp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.tmp")
+        tmp_path.write_text(json.dumps(self.pages, indent=4), encoding="utf8")
+        tmp_path.replace(self.manifest_path)
+
+    def remove(self) -> None:
+        self.manifest_path.unlink(missing_ok=True)
+
+
+# set image paths beforehand, so the names are the same for every download mode
+def get_image_paths(image_urls: list[str], chapter_path: str | Path) -> list[tuple[str, Path]]:
+    images: list[tuple[str, Path]] = []
+    for image_num, image in enumerate(image_urls, 1):
+        # get image suffix
+        image_suffix = str(Path(image).suffix) or ".png"
+        # set image path
+        images.append((image, Path(f"{chapter_path}/{image_num:03d}{image_suffix}")))
+
+    return images
+
+
+# mangadex@home page names contain the sha256 hash of the image. e.g. 'A1-<sha256>.png'
+PAGE_HASH_REGEX = re.compile(r"-([0-9a-f]{64})\.\w+$")
+
+
+# expected sha256 hash of an image from its url
+def get_page_hash(image: str) -> str:
+    page_hash = PAGE_HASH_REGEX.search(image)
+    return page_hash[1] if page_hash else ""
+
+
+# size of the response body. unknown if the body is encoded, as it's decoded while reading
+def get_content_length(headers: Mapping[str, str]) -> int | None:
+    if "Content-Length" not in headers or headers.get("Content-Encoding"):
+        return None
+    try:
+        return int(headers["Content-Length"])
+    except ValueError:
+        return None
+
+
+# copy the image data and update the hash of the image
+def copy_image(source: "HTTPResponse", target: IO[bytes], sha256: "hashlib._Hash") -> int:
+    size = 0
+    for block in iter(lambda: source.read(1024 * 64), b""):
+        sha256.update(block)
+        target.write(block)
+        size += len(block)
+
+    return size
+
+
+# check a downloaded image for completeness and corruption
+def verify_image(image: str, size: int, content_length: int | None, sha256: str) -> None:
+    if content_length is not None and size != content_length:
+        log.error(f"Incomplete image {image}: {size}/{content_length} bytes")
+        raise ConnectionError
+    page_hash = get_page_hash(image)
+    if page_hash and sha256 != page_hash:
+        log.error(f"Corrupt image {image}: sha256 is {sha256}")
+        raise ValueError
+
+
+# request a single image with retries
+def get_image(
+    image: str,
+    download_wait: float,
+    session: requests.Session | None = None,
+    offset: int = 0,
+) -> requests.Response:
+    # request only the missing part of the image
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    # 416: the requested range is not available
+    status_codes = (200, 206, 416) if offset else (200,)
+    counter = 1
+    while counter <= 3:
+        try:
+            r: requests.Response = network.get(
+                image, session, timeout=10, stream=True, headers=headers
+            )
+            if r.status_code not in status_codes:
+                log.error(f"Request for image {image} failed, retrying")
+                raise ConnectionError
+        except KeyboardInterrupt as exc:
+            raise exc
+        except Exception as exc:
+            if counter >= 3:
+                log.error("Maybe the MangaDex Servers are down?")
+                raise exc
+            sleep(network.fixed_wait(session, download_wait))
+            counter += 1
+        else:
+            break
+
+    return r
+
+
+# report the result of an image download. e.g. to the mangadex@home network
+# args: image url, success, bytes, duration in seconds, served from the cache of the server
+ReportCallback = Callable[[str, bool, int, float, bool], None]
+
+
+# check if the image server had the image cached
+def is_cached(headers: Mapping[str, str]) -> bool:
+    return headers.get("X-Cache", "").startswith("HIT")
+
+
+# run a download and report its result
+def run_reported(
+    download: Callable[[], tuple[int, bool]],
+    image: str,
+    report: ReportCallback | None,
+) -> None:
+    start_time = time.perf_counter()
+    try:
+        size, cached = download()
+    except Exception as exc:
+        if report:
+            report(image, False, 0, time.perf_counter() - start_time, False)
+        raise exc
+    duration = time.perf_counter() - start_time
+    log.debug(
+        f"Downloaded {image} in {duration:.2f}s ({size / max(duration, 0.001) / 1024:.0f} KiB/s)"
+    )
+    if report:
+        report(image, True, size, duration, cached)
+
+
+# download a single image to a file
+def download_image(
+    image: str,
+    image_path: Path,
+    download_wait: float,
+    session: requests.Session | None = None,
+    manifest: PageManifest | None = None,
+    report: ReportCallback | None = None,
+) -> None:
+    if manifest and manifest.is_complete(image_path, image):
+        log.debug(f"Page is already downloaded: {image_path.name}")
+        return
+
+    run_reported(
+        partial(write_image, image, image_path, download_wait, session, manifest), image, report
+    )
+
+    sleep(network.fixed_wait(session, download_wait))
+
+
+# write an image to a temporary file and rename it after it's verified
+def write_image(
+    image: str,
+    image_path: Path,
+    download_wait: float,
+    session: requests.Session | None = None,
+    manifest: PageManifest | None = None,
+) -> tuple[int, bool]:
+    # continue a partially written image
+    part_path = Path(f"{image_path}.part")
+    offset = part_path.stat().st_size if manifest and part_path.is_file() else 0
+    r = get_image(image, download_wait, session, offset)
+    if offset and (
+        r.status_code != 206
+        or not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+    ):
+        log.debug(f"Can't continue the image download. Downloading it again: {image_path.name}")
+        offset = 0
+        if r.status_code != 200:
+            r = get_image(image, download_wait, session)
+
+    # write image
+    try:
+        # the hash covers the already written part
+        sha256 = hashlib.sha256(part_path.read_bytes() if offset else b"")
+        with part_path.open("ab" if offset else "wb") as file:
+            r.raw.decode_content = True
+            size = copy_image(r.raw, file, sha256)
+    except Exception as exc:
+        log.error("Can't write file")
+        raise exc
+    try:
+        verify_image(image, size, get_content_length(r.headers), sha256.hexdigest())
+    except ValueError as exc:
+        # corrupt data can't be continued
+        part_path.unlink(missing_ok=True)
+        raise exc
+    part_path.replace(image_path)
+    if manifest:
+        manifest.add(image_path, image, sha256.hexdigest())
+
+    return (size, is_cached(r.headers))
+
+
+# download a single image directly into an archive
+def download_image_archive(
+    image: str,
+    image_name: str,
+    download_wait: float,
+    archive: ZipFile,
+    archive_lock: threading.Lock,
+    session: requests.Session | None = None,
+    buffered: bool = False,
+    report: ReportCallback | None = None,
+) -> None:
+    run_reported(
+        partial(
+            write_image_archive,
+            image,
+            image_name,
+            download_wait,
+            archive,
+            archive_lock,
+            session,
+            buffered,
+        ),
+        image,
+        report,
+    )
+
+    sleep(network.fixed_wait(session, download_wait))
+
+
+# write an image to the archive
+def write_image_archive(
+    image: str,
+    image_name: str,
+    download_wait: float,
+    archive: ZipFile,
+    archive_lock: threading.Lock,
+    session: requests.Session | None = None,
+    buffered: bool = False,
+) -> tuple[int, bool]:
+    r = get_image(image, download_wait, session)
+
+    # write image to the archive
+    try:
+        r.raw.decode_content = True
+        # read the image first if other threads write to the archive, as only one entry
+        # can be written at a time
+        image_data = r.raw.read() if buffered else None
+        sha256 = hashlib.sha256()
+        with archive_lock, archive.open(image_name, "w") as entry:
+            if image_data is None:
+                size = copy_image(r.raw, entry, sha256)
+            else:
+                sha256.update(image_data)
+                size = entry.write(image_data)
+    except Exception as exc:
+        log.error("Can't write image to archive")
+        raise exc
+    # the incomplete archive is removed on errors
+    verify_image(image, size, get_content_length(r.headers), sha256.hexdigest())
+
+    return (size, is_cached(r.headers))
+
+
+# run the image downloads sequentially or in a thread pool
+def run_downloads(downloads: list[Callable[[], None]], download_workers: int) -> None:
+    total_img = len(downloads)
+
+    # download images one after another
+    if download_workers <= 1:
+        for image_num, download in enumerate(downloads, 1):
+            # show progress bar for default log level
+            if logging.root.level == logging.INFO:
+                utils.progress_bar(image_num, total_img)
+            log.debug(f"Downloading image {image_num}/{total_img}")
+            download()
+        return
+
+    # download images in parallel
+    log.debug(f"Downloading {total_img} images with {download_workers} workers")
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        futures = [executor.submit(download) for download in downloads]
+        try:
+            for image_num, future in enumerate(futures, 1):
+                # raises the exception of the worker if the download failed
+                future.result()
+                # show progress bar for default log level
+                if logging.root.level == logging.INFO:
+                    utils.progress_bar(image_num, total_img)
+                log.debug(f"Downloaded image {image_num}/{total_img}")
+        except BaseException as exc:
+            # don't start downloads which are still queued
+            for future in futures:
+                future.cancel()
+            raise exc
 
 
 # download images
@@ -14,43 +425,278 @@ def download_chapter(
     image_urls: list[str],
     chapter_path: str | Path,
     download_wait: float,
+    download_workers: int = 1,
+    session: requests.Session | None = None,
+    report: ReportCallback | None = None,
 ) -> None:
-    total_img = len(image_urls)
-    for image_num, image in enumerate(image_urls, 1):
-        # get image suffix
-        image_suffix = str(Path(image).suffix) or ".png"
-        # set image path
-        image_path = Path(f"{chapter_path}/{image_num:03d}{image_suffix}")
-        # show progress bar for default log level
-        if logging.root.level == logging.INFO:
-            utils.progress_bar(image_num, total_img)
-        log.debug(f"Downloading image {image_num}/{total_img}")
+    # completed pages of a previous download from the same source are skipped
+    images = get_image_paths(image_urls, chapter_path)
+    manifest = PageManifest(get_manifest_path(chapter_path))
+    manifest.prepare(images, chapter_path)
+    downloads: list[Callable[[], None]] = [
+        partial(download_image, image, image_path, download_wait, session, manifest, report)
+        for image, image_path in images
+    ]
+    run_downloads(downloads, download_workers)
+    # chapter is complete. remove leftovers of failed image servers
+    manifest.remove()
+    for part_path in Path(chapter_path).glob("*.part"):
+        part_path.unlink()
+
+
+# download images directly into a zip archive, without an image folder
+def download_chapter_archive(
+    image_urls: list[str],
+    archive_path: str | Path,
+    download_wait: float,
+    download_workers: int = 1,
+    session: requests.Session | None = None,
+    compression: str = "stored",
+    compression_level: int | None = None,
+    report: ReportCallback | None = None,
+) -> None:
+    archive_lock = threading.Lock()
+    images = get_image_paths(image_urls, "")
+    # all pages have an image suffix, so "auto" stores them
+    compress_type = utils.get_compression(images[0][1].name if images else "", compression)
+    start_time = time.perf_counter()
+    with ZipFile(
+        archive_path, "w", compression=compress_type, compresslevel=compression_level
+    ) as archive:
+        downloads: list[Callable[[], None]] = [
+            partial(
+                download_image_archive,
+                image,
+                image_path.name,
+                download_wait,
+                archive,
+                archive_lock,
+                session,
+                download_workers > 1,
+                report,
+            )
+            for image, image_path in images
+        ]
+        run_downloads(downloads, download_workers)
+    utils.log_archive_stats(Path(archive_path), start_time)
+
+
+class AsyncDownloader:
+    """Download chapters with asyncio, with one event loop and http client for the whole run.
+
+    The loop runs in a background thread. Chapters are submitted from the download threads,
+    so the pages of multiple chapters and mangas are in flight at the same time and share
+    the connections of the client. Completed pages are stored in the page manifest.
+
+    Args:
+        connections: Maximum concurrent connections per host. 0 means no limit
+        rate_limiter: Rate limiter for the page requests, e.g. of the shared session. Optional
+    """
 
+    def __init__(  # noqa: D107
+        self, connections: int = 0, rate_limiter: network.RateLimiter | None = None
+    ) -> None:
+        try:
+            import aiohttp  # noqa
+        except Exception as exc:
+            log.error("Cant import aiohttp. Please install it first")
+            raise exc
+
+        self.connections = connections
+        self.rate_limiter = rate_limiter
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="async-downloader", daemon=True
+        )
+        self.thread.start()
+        # the client has to be created in the loop
+        self.client = asyncio.run_coroutine_threadsafe(self._create_client(), self.loop).result()
+
+    async def _create_client(self) -> "aiohttp.ClientSession":
+        import aiohttp  # noqa
+
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.connections)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def close(self) -> None:
+        """Close the http client and stop the event loop."""
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def download_chapter(
+        self,
+        image_urls: list[str],
+        chapter_path: str | Path,
+        download_wait: float,
+        download_workers: int = 1,
+        report: ReportCallback | None = None,
+    ) -> None:
+        """Download the images of a chapter on the event loop and wait for them.
+
+        Args:
+            image_urls: URLs of the images
+            chapter_path: Folder for the images
+            download_wait: Time to wait after every image in seconds, if there is no rate
+                limiter. Also the wait time between retries
+            download_workers: Amount of images of the chapter to download at the same time
+            report: Callback to report the result of every image download. Optional
+        """
+        # completed pages of a previous download from the same source are skipped
+        images = get_image_paths(image_urls, chapter_path)
+        manifest = PageManifest(get_manifest_path(chapter_path))
+        manifest.prepare(images, chapter_path)
+        log.debug(f"Downloading {len(images)} images with {download_workers} async requests")
+        future = asyncio.run_coroutine_threadsafe(
+            self._download_chapter(images, download_wait, download_workers, manifest, report),
+            self.loop,
+        )
+        try:
+            future.result()
+        except BaseException as exc:
+            # stop the other downloads of the chapter
+            future.cancel()
+            raise exc
+        # chapter is complete. remove leftovers of failed image servers
+        manifest.remove()
+        for part_path in Path(chapter_path).glob("*.part"):
+            part_path.unlink()
+
+    async def _download_chapter(
+        self,
+        images: list[tuple[str, Path]],
+        download_wait: float,
+        download_workers: int,
+        manifest: PageManifest,
+        report: ReportCallback | None,
+    ) -> None:
+        total_img = len(images)
+        semaphore = asyncio.Semaphore(max(1, download_workers))
+        tasks = [
+            asyncio.create_task(
+                self._download_image(image, image_path, download_wait, manifest, report, semaphore)
+            )
+            for image, image_path in images
+        ]
+        try:
+            for image_num, task in enumerate(asyncio.as_completed(tasks), 1):
+                # raises the exception of the task if the download failed
+                await task
+                # show progress bar for default log level
+                if logging.root.level == logging.INFO:
+                    utils.progress_bar(image_num, total_img)
+                log.debug(f"Downloaded image {image_num}/{total_img}")
+        finally:
+            # stop the other downloads if one failed
+            for task in tasks:
+                task.cancel()
+
+    # download a single image and report its result
+    async def _download_image(
+        self,
+        image: str,
+        image_path: Path,
+        download_wait: float,
+        manifest: PageManifest,
+        report: ReportCallback | None,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        # hashing and file io run in threads, so they don't block the other downloads of the loop
+        if await asyncio.to_thread(manifest.is_complete, image_path, image):
+            log.debug(f"Page is already downloaded: {image_path.name}")
+            return
+
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                size, cached = await self._write_image(image, image_path, download_wait, manifest)
+            except Exception as exc:
+                if report:
+                    report(image, False, 0, time.perf_counter() - start_time, False)
+                raise exc
+            if report:
+                report(image, True, size, time.perf_counter() - start_time, cached)
+
+            # the rate limiter replaces the fixed wait
+            if not self.rate_limiter:
+                await asyncio.sleep(download_wait)
+
+    # request a single image with retries and write it after it's verified
+    async def _write_image(
+        self, image: str, image_path: Path, download_wait: float, manifest: PageManifest
+    ) -> tuple[int, bool]:
         counter = 1
         while counter <= 3:
+            if self.rate_limiter:
+                await asyncio.sleep(self.rate_limiter.reserve(image))
             try:
-                r = requests.get(image, timeout=10, stream=True)
-                if r.status_code != 200:
-                    log.error(f"Request for image {image} failed, retrying")
-                    raise ConnectionError
-            except KeyboardInterrupt as exc:
-                raise exc
+                async with self.client.get(image) as r:
+                    if self.rate_limiter:
+                        self.rate_limiter.update_status(image, r.status, r.headers)
+                    if r.status != 200:
+                        log.error(f"Request for image {image} failed, retrying")
+                        raise ConnectionError
+                    image_data = await r.read()
+                    content_length = get_content_length(r.headers)
+                    cached = is_cached(r.headers)
             except Exception as exc:
                 if counter >= 3:
                     log.error("Maybe the MangaDex Servers are down?")
                     raise exc
-                sleep(download_wait)
+                await asyncio.sleep(download_wait)
                 counter += 1
             else:
                 break
 
-        # write image
-        try:
-            with image_path.open("wb") as file:
-                r.raw.decode_content = True
-                shutil.copyfileobj(r.raw, file)
-        except Exception as exc:
-            log.error("Can't write file")
-            raise exc
+        await asyncio.to_thread(save_image, image, image_path, image_data, content_length, manifest)
+
+        return (len(image_data), cached)
+
+
+# verify a downloaded image and write it with a temporary file. used by the async engine
+# in a thread
+def save_image(
+    image: str,
+    image_path: Path,
+    image_data: bytes,
+    content_length: int | None,
+    manifest: PageManifest,
+) -> None:
+    sha256 = hashlib.sha256(image_data).hexdigest()
+    verify_image(image, len(image_data), content_length, sha256)
+    # write image
+    try:
+        part_path = Path(f"{image_path}.part")
+        part_path.write_bytes(image_data)
+        part_path.replace(image_path)
+    except Exception as exc:
+        log.error("Can't write file")
+        raise exc
+    manifest.add(image_path, image, sha256)
+
+
+# download images with asyncio. a shared AsyncDownloader keeps its loop and connections,
+# else a new one is used for the chapter
+def download_chapter_async(
+    image_urls: list[str],
+    chapter_path: str | Path,
+    download_wait: float,
+    download_workers: int = 1,
+    report: ReportCallback | None = None,
+    async_downloader: AsyncDownloader | None = None,
+) -> None:
+    if async_downloader:
+        async_downloader.download_chapter(
+            image_urls, chapter_path, download_wait, download_workers, report
+        )
+        return
 
-        sleep(download_wait)
+    async_downloader = AsyncDownloader()
+    try:
+        async_downloader.download_chapter(
+            image_urls, chapter_path, download_wait, download_workers, report
+        )
+    finally:
+        async_downloader.close()
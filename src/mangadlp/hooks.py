@@ -25,13 +25,14 @@ def run_hook(command: str, hook_type: str, **kwargs: Any) -> int:
 
     command_list = command.split(" ")
 
-    # setting env vars
-    for key, value in kwargs.items():
-        os.environ[f"MDLP_{key.upper()}"] = str(value)
+    # env vars of the hook. only set for the hook process, so hooks can run in parallel
+    hook_env = {f"MDLP_{key.upper()}": str(value) for key, value in kwargs.items()}
 
     # running command
     log.info(f"Hook '{hook_type}' - running command: '{command}'")
-    proc = subprocess.run(command_list, check=False, timeout=15, encoding="utf8")  # noqa
+    proc = subprocess.run(  # noqa
+        command_list, check=False, timeout=15, encoding="utf8", env={**os.environ, **hook_env}
+    )
     exit_code = proc.returncode
 
     if exit_code == 0:
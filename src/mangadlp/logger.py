@@ -28,12 +28,21 @@ class InterceptHandler(logging.Handler):
         logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
 
+# prefix the messages with the manga, if multiple mangas are downloaded at the same time
+def format_record(record: Any) -> str:
+    log_format = LOGURU_FMT
+    if record["extra"].get("manga"):
+        log_format = log_format.replace("{message}", "[{extra[manga]}] {message}")
+
+    return f"{log_format}\n{{exception}}"
+
+
 # init logger with format and log level
 def prepare_logger(loglevel: int = 20) -> None:
     stdout_handler: dict[str, Any] = {
         "sink": sys.stdout,
         "level": loglevel,
-        "format": LOGURU_FMT,
+        "format": format_record,
     }
 
     logging.basicConfig(handlers=[InterceptHandler()], level=loglevel)
@@ -1,9 +1,11 @@
 from pathlib import Path
 from typing import Any
+from zipfile import ZipFile
 
 import xmltodict
 from loguru import logger as log
 
+from mangadlp import utils
 from mangadlp.models import ComicInfo
 
 
@@ -101,19 +103,50 @@ def validate_metadata(metadata_in: ComicInfo) -> dict[str, ComicInfo]:
     return metadata_valid
 
 
-def write_metadata(chapter_path: Path, metadata: ComicInfo) -> None:
+def create_metadata_xml(metadata: ComicInfo) -> str:
+    log.debug(f"Metadata items: {metadata}")
+    metadata_valid = validate_metadata(metadata)
+
+    return xmltodict.unparse(  # type: ignore
+        metadata_valid, pretty=True, indent=" " * 4, short_empty_elements=True
+    )
+
+
+def write_metadata(
+    chapter_path: Path,
+    metadata: ComicInfo,
+    compression: str = "stored",
+    compression_level: int | None = None,
+) -> None:
     if metadata["Format"] == "pdf":
         log.warning("Can't add metadata for pdf format. Skipping")
         return
 
-    metadata_file = chapter_path / METADATA_FILENAME
+    # chapter was downloaded directly into an archive
+    if chapter_path.is_file():
+        write_metadata_archive(chapter_path, metadata, compression, compression_level)
+        return
 
-    log.debug(f"Metadata items: {metadata}")
-    metadata_valid = validate_metadata(metadata)
+    metadata_file = chapter_path / METADATA_FILENAME
 
+    metadata_export = create_metadata_xml(metadata)
     log.info(f"Writing metadata to: '{metadata_file}'")
-    metadata_export = xmltodict.unparse(
-        metadata_valid, pretty=True, indent=" " * 4, short_empty_elements=True
-    )
     metadata_file.touch(exist_ok=True)
     metadata_file.write_text(metadata_export, encoding="utf8")
+
+
+def write_metadata_archive(
+    archive_path: Path,
+    metadata: ComicInfo,
+    compression: str = "stored",
+    compression_level: int | None = None,
+) -> None:
+    metadata_export = create_metadata_xml(metadata)
+    log.info(f"Writing metadata to: '{archive_path}/{METADATA_FILENAME}'")
+    with ZipFile(archive_path, "a") as archive:
+        archive.writestr(
+            METADATA_FILENAME,
+            metadata_export,
+            compress_type=utils.get_compression(METADATA_FILENAME, compression),
+            compresslevel=compression_level,
+        )
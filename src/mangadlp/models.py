@@ -48,12 +48,24 @@ class ChapterData(TypedDict):
     chapter: str
     name: str
     pages: int
+    publish_at: str
 
 
-class CacheKeyData(TypedDict):  # noqa
+class CacheKeyData(TypedDict, total=False):  # noqa
     chapters: list[str]
     name: str
+    last_sync: str
+    feed: list[ChapterData]
+    next_check: str
 
 
 class CacheData(TypedDict):  # noqa
     __root__: CacheKeyData
+
+
+class PageData(TypedDict):
+    """Completed page of a chapter download."""
+
+    size: int
+    sha256: str
+    source: str
@@ -0,0 +1,565 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger as log
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# status codes which are retried by the connection pool. rate limited sessions retry 429
+# themselves, after the rate limiter adapted to the response
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+RESPONSE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    last_modified TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+class TokenBucket:
+    """Token bucket for the requests to a host.
+
+    Args:
+        rate: Requests per second. The bucket holds up to max(1, rate) tokens
+    """
+
+    def __init__(self, rate: float) -> None:  # noqa: D107
+        self.base_rate = rate
+        self.rate = rate
+        self.tokens = max(1.0, rate)
+        self.updated_at = time.monotonic()
+        # no requests until this time. set by Retry-After/X-RateLimit headers
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Take a token.
+
+        Returns:
+            Time in seconds to wait before the request can be made
+        """
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        # negative tokens are requests waiting for a refill
+        wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        return max(wait_time, self.blocked_until - now)
+
+
+class RateLimiter:
+    """Rate limiter with a token bucket per url prefix and per host.
+
+    Adapts to the rate limit headers of the responses. Retry-After and exhausted
+    X-RateLimit-Remaining block the bucket until the given time, 429 responses halve the
+    rate. Every successful response restores 10% of the initial rate.
+    Optionally limits the amount of concurrent requests per url prefix and per host.
+
+    Args:
+        rates: Requests per second per url prefix. E.g. {"https://api.mangadex.org": 5}
+        default_rate: Requests per second for every other host. 0 means no limit
+        concurrency: Concurrent requests per url prefix. E.g. {"https://api.mangadex.org": 4}
+        default_concurrency: Concurrent requests for every other host. 0 means no limit
+        unlimited: Url prefixes without rate and concurrency limits. E.g. report endpoints
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        rates: dict[str, float] | None = None,
+        default_rate: float = 0,
+        concurrency: dict[str, int] | None = None,
+        default_concurrency: int = 0,
+        unlimited: list[str] | None = None,
+    ) -> None:
+        # longest prefix first, so more specific prefixes match first
+        self.rates = dict(sorted((rates or {}).items(), key=lambda rate: -len(rate[0])))
+        self.default_rate = default_rate
+        self.concurrency = dict(
+            sorted((concurrency or {}).items(), key=lambda limit: -len(limit[0]))
+        )
+        self.default_concurrency = default_concurrency
+        self.unlimited = tuple(unlimited or [])
+        self.buckets: dict[str, TokenBucket] = {}
+        self.semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    def _get_bucket(self, url: str) -> TokenBucket | None:
+        if url.startswith(self.unlimited):
+            return None
+        key = next((prefix for prefix in self.rates if url.startswith(prefix)), "")
+        if key:
+            rate = self.rates[key]
+        elif self.default_rate > 0:
+            key, rate = (urlsplit(url).netloc, self.default_rate)
+        else:
+            return None
+
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(rate)
+
+        return self.buckets[key]
+
+    def has_bucket(self, url: str) -> bool:
+        """Check if the requests to the url are rate limited.
+
+        Args:
+            url: URL to check
+
+        Returns:
+            True if a token bucket applies to the url
+        """
+        with self.lock:
+            return self._get_bucket(url) is not None
+
+    def _get_semaphore(self, url: str) -> threading.BoundedSemaphore | None:
+        if url.startswith(self.unlimited):
+            return None
+        key = next((prefix for prefix in self.concurrency if url.startswith(prefix)), "")
+        if key:
+            limit = self.concurrency[key]
+        elif self.default_concurrency > 0:
+            key, limit = (urlsplit(url).netloc, self.default_concurrency)
+        else:
+            return None
+
+        if key not in self.semaphores:
+            self.semaphores[key] = threading.BoundedSemaphore(limit)
+
+        return self.semaphores[key]
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Wait until less than the allowed concurrent requests to the url are running.
+
+        Args:
+            url: URL which will be requested
+        """
+        with self.lock:
+            semaphore = self._get_semaphore(url)
+        if not semaphore:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def reserve(self, url: str) -> float:
+        """Take a token for a request to the url, without waiting.
+
+        Args:
+            url: URL which will be requested
+
+        Returns:
+            Time in seconds to wait before the request can be made
+        """
+        with self.lock:
+            bucket = self._get_bucket(url)
+            wait_time = bucket.reserve() if bucket else 0
+        if wait_time > 0:
+            log.debug(f"Rate limit reached. Waiting {wait_time:.2f}s for: {url}")
+
+        return wait_time
+
+    def acquire(self, url: str) -> None:
+        """Wait until a request to the url is allowed.
+
+        Args:
+            url: URL which will be requested
+        """
+        wait_time = self.reserve(url)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def update(self, url: str, response: requests.Response) -> None:
+        """Adapt the rate limit of the url to the response.
+
+        Args:
+            url: URL which was requested
+            response: Response of the request
+        """
+        self.update_status(url, response.status_code, response.headers)
+
+    def update_status(self, url: str, status_code: int, headers: Mapping[str, str]) -> None:
+        """Adapt the rate limit of the url to the status code and headers of a response.
+
+        Args:
+            url: URL which was requested
+            status_code: Status code of the response
+            headers: Headers of the response
+        """
+        now = time.monotonic()
+        block_time = 0.0
+        if status_code in (429, 503) and "Retry-After" in headers:
+            block_time = parse_retry_after(headers["Retry-After"])
+        elif headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Retry-After" in headers:
+            # unix time when the limit resets
+            try:
+                block_time = float(headers["X-RateLimit-Retry-After"]) - time.time()
+            except ValueError:
+                block_time = 0
+
+        with self.lock:
+            bucket = self._get_bucket(url)
+            if not bucket:
+                return
+            if block_time > 0:
+                log.debug(f"Rate limited by the server for {block_time:.2f}s: {url}")
+                bucket.blocked_until = max(bucket.blocked_until, now + block_time)
+            if status_code == 429:
+                bucket.rate = max(bucket.base_rate / 8, bucket.rate / 2)
+            elif status_code < 400:
+                bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate / 10)
+
+
+class LimiterRetry(Retry):
+    """Retry of the connection pool, which leaves 429 responses to RateLimitedSession."""
+
+    # urllib3 retries these status codes if the response has a Retry-After header
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+
+class RateLimitedSession(requests.Session):
+    """Http session, which waits for the rate limiter before every request.
+
+    429 responses are retried here instead of in the connection pool, so the rate limiter
+    sees them and slows down all threads.
+
+    Args:
+        rate_limiter: Rate limiter for all requests of the session
+        retries: Retries of 429 responses
+        backoff: Backoff factor between the retries in seconds, if the url has no bucket
+    """
+
+    def __init__(  # noqa: D107
+        self, rate_limiter: RateLimiter, retries: int = 3, backoff: float = 0.5
+    ) -> None:
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+
+    def request(
+        self, method: str | bytes, url: str | bytes, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        """Make a request after the rate limiter allows it."""
+        url_str = url.decode() if isinstance(url, bytes) else url
+        attempt = 0
+        while True:
+            # streamed bodies are read after the slot is released
+            with self.rate_limiter.slot(url_str):
+                self.rate_limiter.acquire(url_str)
+                response = super().request(method, url, *args, **kwargs)
+            self.rate_limiter.update(url_str, response)
+            if response.status_code != 429 or attempt >= self.retries:
+                return response
+
+            attempt += 1
+            log.debug(f"Rate limited (429). Retry {attempt}/{self.retries}: {url_str}")
+            response.close()
+            # the bucket of the url is blocked/slowed down by the response. else wait here
+            if not self.rate_limiter.has_bucket(url_str):
+                retry_after = parse_retry_after(response.headers.get("Retry-After", ""))
+                time.sleep(retry_after if retry_after > 0 else self.backoff * 2**attempt)
+
+
+# parse the Retry-After header. seconds or a http date
+def parse_retry_after(retry_after: str) -> float:
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(retry_after).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return 0
+
+
+# fixed wait time between requests. not needed if the session limits the requests
+def fixed_wait(session: requests.Session | None, wait_time: float) -> float:
+    if isinstance(session, RateLimitedSession):
+        return 0
+
+    return wait_time
+
+
+def create_session(
+    pool_sizes: dict[str, int] | None = None,
+    pool_size: int = 10,
+    retries: int = 3,
+    backoff: float = 0.5,
+    rate_limiter: RateLimiter | None = None,
+) -> requests.Session:
+    """Create a http session with keep-alive connection pools.
+
+    The session is shared between the api and the downloader, so the tcp/tls connections
+    are reused for all requests to the same host.
+
+    Args:
+        pool_sizes: Connection pool sizes per url prefix. E.g. {"https://api.mangadex.org": 4}
+        pool_size: Connection pool size for all other hosts (image servers)
+        retries: Retries on connection errors and on the status codes in RETRY_STATUS_CODES
+        backoff: Backoff factor between the retries in seconds
+        rate_limiter: Rate limiter for all requests of the session. Optional
+
+    Returns:
+        The prepared session
+    """
+    log.debug(f"Creating http session: pools={pool_sizes}, default pool={pool_size}")
+    retry_cls = LimiterRetry if rate_limiter else Retry
+    retry = retry_cls(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[
+            code for code in RETRY_STATUS_CODES if not (rate_limiter and code == 429)
+        ],
+        allowed_methods=["GET", "HEAD"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+    session = (
+        RateLimitedSession(rate_limiter, retries, backoff) if rate_limiter else requests.Session()
+    )
+    # default pool for all hosts. mostly mangadex@home nodes
+    default_adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+    # separately sized pools for specific hosts
+    for prefix, size in (pool_sizes or {}).items():
+        session.mount(prefix, HTTPAdapter(pool_maxsize=size, max_retries=retry))
+
+    return session
+
+
+def get(
+    url: str,
+    session: requests.Session | None = None,
+    timeout: float = 10,
+    **kwargs: Any,
+) -> requests.Response:
+    """Make a GET request with the session. Without a session a one-off request is made.
+
+    Args:
+        url: URL to request
+        session: Session to use for the request
+        timeout: Timeout of the request in seconds
+        kwargs: Arguments for requests.get
+
+    Returns:
+        The response of the request
+    """
+    if session is None:
+        return requests.get(url, timeout=timeout, **kwargs)
+
+    return session.get(url, timeout=timeout, **kwargs)
+
+
+def post(
+    url: str,
+    session: requests.Session | None = None,
+    timeout: float = 10,
+    **kwargs: Any,
+) -> requests.Response:
+    """Make a POST request with the session. Without a session a one-off request is made.
+
+    Args:
+        url: URL to request
+        session: Session to use for the request
+        timeout: Timeout of the request in seconds
+        kwargs: Arguments for requests.post
+
+    Returns:
+        The response of the request
+    """
+    if session is None:
+        return requests.post(url, timeout=timeout, **kwargs)
+
+    return session.post(url, timeout=timeout, **kwargs)
+
+
+class PostQueue:
+    """Send POST requests from background threads, without waiting for the responses.
+
+    The responses are ignored. Requests are dropped if the queue is full.
+
+    Args:
+        workers: Amount of threads which send the requests
+        max_size: Maximum amount of queued requests
+    """
+
+    def __init__(self, workers: int = 4, max_size: int = 1000) -> None:  # noqa: D107
+        self.workers = workers
+        self.queue: queue.Queue[tuple[str, requests.Session | None, dict[str, Any]]] = queue.Queue(
+            maxsize=max_size
+        )
+        self.threads: list[threading.Thread] = []
+        self.lock = threading.Lock()
+
+    def put(self, url: str, session: requests.Session | None = None, **kwargs: Any) -> None:
+        """Queue a POST request.
+
+        Args:
+            url: URL to request
+            session: Session to use for the request
+            kwargs: Arguments for post
+        """
+        # threads are started on the first request
+        with self.lock:
+            if not self.threads:
+                self.threads = [
+                    threading.Thread(target=self._worker, name="post", daemon=True)
+                    for _ in range(self.workers)
+                ]
+                for thread in self.threads:
+                    thread.start()
+        try:
+            self.queue.put_nowait((url, session, kwargs))
+        except queue.Full:
+            log.debug(f"Too many queued requests. Dropping request to: {url}")
+
+    def _worker(self) -> None:
+        while True:
+            url, session, kwargs = self.queue.get()
+            try:
+                post(url, session, **kwargs)
+            except Exception as exc:
+                log.debug(f"Request to {url} failed. Reason={exc}")
+            finally:
+                self.queue.task_done()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until the queued requests are sent.
+
+        Args:
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            True if all requests were sent
+        """
+        end_time = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < end_time:
+            time.sleep(0.05)
+
+        return not self.queue.unfinished_tasks
+
+
+class ResponseCache:
+    """Persistent cache for json responses of the api.
+
+    Responses younger than the ttl are used without a request. Older responses are
+    revalidated with a conditional request (ETag/Last-Modified), if the server sent the
+    headers. The least recently used responses are removed if max_entries is exceeded.
+
+    Args:
+        cache_path: Path to the sqlite file. E.g. api_cache.db
+        ttl: Time in seconds, in which a cached response is used without revalidation
+        max_entries: Maximum amount of cached responses
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        cache_path: str | Path,
+        ttl: float = 3600,
+        max_entries: int = 1000,
+    ) -> None:
+        self.cache_path = Path(cache_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        log.debug(f"Reading api response cache: {self.cache_path}")
+        try:
+            self.db = sqlite3.connect(self.cache_path, timeout=30, check_same_thread=False)
+            with self.db:
+                self.db.executescript(RESPONSE_CACHE_SCHEMA)
+        except Exception as exc:
+            log.error("Can't load api response cache")
+            raise exc
+
+    def get_json(
+        self,
+        url: str,
+        session: requests.Session | None = None,
+        timeout: float = 10,
+    ) -> Any:
+        """Get the json body of an url from the cache or the api.
+
+        Args:
+            url: URL to request
+            session: Session to use for the request
+            timeout: Timeout of the request in seconds
+
+        Returns:
+            The parsed json body
+        """
+        with self.lock:
+            entry: tuple[str, str, float, str] | None = self.db.execute(
+                "SELECT etag, last_modified, stored_at, body FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+        # fresh response
+        if entry and time.time() - entry[2] < self.ttl:
+            log.debug(f"Using cached response for: {url}")
+            self._touch(url, refresh=False)
+            return json.loads(entry[3])
+
+        # revalidate the stale response
+        headers: dict[str, str] = {}
+        if entry and entry[0]:
+            headers["If-None-Match"] = entry[0]
+        if entry and entry[1]:
+            headers["If-Modified-Since"] = entry[1]
+        r = get(url, session, timeout=timeout, headers=headers)
+        if entry and r.status_code == 304:
+            log.debug(f"Cached response is still valid for: {url}")
+            self._touch(url, refresh=True)
+            return json.loads(entry[3])
+
+        body = r.json()
+        if r.status_code == 200:
+            self._store(
+                url, r.headers.get("ETag") or "", r.headers.get("Last-Modified") or "", body
+            )
+
+        return body
+
+    def _touch(self, url: str, refresh: bool) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            if refresh:
+                self.db.execute(
+                    "UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?",
+                    (now, now, url),
+                )
+            else:
+                self.db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url))
+
+    def _store(self, url: str, etag: str, last_modified: str, body: Any) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, stored_at, accessed_at, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, now, now, json.dumps(body)),
+            )
+            # remove the least recently used responses
+            self.db.execute(
+                "DELETE FROM responses WHERE url NOT IN (SELECT url FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
@@ -0,0 +1,449 @@
+import bisect
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from loguru import logger as log
+
+from mangadlp import app, downloader, utils
+from mangadlp.api.mangadex import REPORT_QUEUE, Mangadex
+
+
+# the daemon checks the list file for changes at least this often (in seconds)
+LIST_CHECK_INTERVAL = 60
+
+
+# publish time of a chapter as unix time. 0 if the api doesn't provide it
+def get_publish_time(mdlp: app.MangaDLP, chapter: str) -> float:
+    chapter_data: dict[str, Any] = getattr(mdlp.api, "manga_chapter_data", {}).get(chapter) or {}
+    publish_time = utils.parse_publish_time(chapter_data.get("publish_at") or "")
+
+    return publish_time.timestamp() if publish_time else 0
+
+
+class ChapterQueue:
+    """Queue of the chapters of all mangas, which alternates between the mangas.
+
+    The newest chapter of every manga comes first, then the second newest and so on.
+    Chapters of the same rank are ordered by their publish time, the newest first. So a
+    manga with many missing chapters doesn't delay the new chapters of the other mangas.
+
+    Args:
+        max_per_manga: Maximum chapters of a manga which are downloaded at the same time
+    """
+
+    def __init__(self, max_per_manga: int = 1) -> None:  # noqa: D107
+        self.max_per_manga = max_per_manga
+        # (rank, negative publish time, insertion counter), manga, chapter
+        self.chapters: list[tuple[tuple[int, float, int], str, str]] = []
+        self.running: dict[str, int] = {}
+        self.counter = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, manga: str, chapters: list[tuple[str, float]]) -> None:
+        """Add the chapters of a manga.
+
+        Args:
+            manga: Manga of the chapters
+            chapters: Chapters with their publish time (unix time), the newest first
+        """
+        with self.condition:
+            for rank, (chapter, publish_time) in enumerate(chapters):
+                self.counter += 1
+                bisect.insort(self.chapters, ((rank, -publish_time, self.counter), manga, chapter))
+            self.condition.notify_all()
+
+    def get(self) -> tuple[str, str] | None:
+        """Take the next chapter of a manga with less than max_per_manga running chapters.
+
+        Blocks until such a chapter is available.
+
+        Returns:
+            The manga and the chapter. None if the queue is closed and empty
+        """
+        with self.condition:
+            while True:
+                for index, (_, manga, chapter) in enumerate(self.chapters):
+                    if self.running.get(manga, 0) < self.max_per_manga:
+                        del self.chapters[index]
+                        self.running[manga] = self.running.get(manga, 0) + 1
+                        return (manga, chapter)
+                if self.closed and not self.chapters:
+                    return None
+                self.condition.wait()
+
+    def task_done(self, manga: str) -> None:
+        """Mark a chapter of the manga as done.
+
+        Args:
+            manga: Manga of the chapter
+        """
+        with self.condition:
+            self.running[manga] -= 1
+            self.condition.notify_all()
+
+    def close(self, clear: bool = False) -> None:
+        """Stop the waiting workers once the queue is empty.
+
+        Args:
+            clear: Remove the remaining chapters
+        """
+        with self.condition:
+            if clear:
+                self.chapters.clear()
+            self.closed = True
+            self.condition.notify_all()
+
+
+class MangaScheduler:
+    """Download multiple mangas, optionally in parallel.
+
+    All mangas share one http session, so the connection pools, the rate limits and the
+    concurrent requests per host are shared between them. An error of a manga is logged
+    and doesn't stop the other mangas.
+
+    Args:
+        url_uuids: URLs or UUIDs of the mangas
+        parallel: Amount of mangas to download at the same time
+        host_connections: Maximum concurrent requests per host, shared by all mangas.
+            The api is limited to 4 concurrent requests
+        global_queue: Download the chapters of all mangas from one ChapterQueue, with
+            parallel workers. Else every manga downloads its own chapters
+        max_per_manga: Maximum chapters of a manga which are downloaded at the same time
+            with the global queue
+        kwargs: Arguments for MangaDLP
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        url_uuids: list[str],
+        parallel: int = 1,
+        host_connections: int = 10,
+        global_queue: bool = False,
+        max_per_manga: int = 1,
+        **kwargs: Any,
+    ) -> None:
+        self.url_uuids = url_uuids
+        self.parallel = parallel
+        self.host_connections = host_connections
+        self.global_queue = global_queue
+        self.max_per_manga = max_per_manga
+        self.kwargs = kwargs
+        self.session = app.create_http_session(
+            Mangadex.api_base_url,
+            kwargs.get("download_workers", 1),
+            kwargs.get("download_wait", 0.5),
+            kwargs.get("http_retries", 3),
+            kwargs.get("http_backoff", 0.5),
+            host_connections,
+            app.get_report_urls(Mangadex),
+        )
+        self.prefetched_manga: dict[str, dict[str, Any]] = {}
+        # unix time of the last run, in which new chapters of a manga were downloaded
+        self.updated_at: dict[str, float] = {}
+        # one archive process pool and async downloader for all mangas of a run
+        self.archive_pool: ProcessPoolExecutor | None = None
+        self.async_downloader: downloader.AsyncDownloader | None = None
+        # state of the global queue
+        self.queued_mangas: dict[str, app.MangaDLP] = {}
+        self.remaining_chapters: dict[str, int] = {}
+        self.failed_mangas: set[str] = set()
+        self.lock = threading.Lock()
+
+    def run(self) -> list[str]:
+        """Download all mangas.
+
+        Returns:
+            The mangas which had an error
+        """
+        # request the infos of all mangas in a few batched requests
+        if len(self.url_uuids) > 1:
+            self.prefetched_manga = app.prefetch_manga_data(self.url_uuids, self.session)
+
+        archive_workers: int = self.kwargs.get("archive_workers", 0)
+        if archive_workers > 0 and self.kwargs.get("file_format", "cbz"):
+            self.archive_pool = app.create_archive_pool(archive_workers)
+        if self.kwargs.get("engine") == "async":
+            self.async_downloader = app.create_async_downloader(self.session, self.host_connections)
+        try:
+            if self.global_queue:
+                self.run_queue()
+                results = [manga not in self.failed_mangas for manga in self.url_uuids]
+            elif self.parallel <= 1:
+                results = [self.download_manga(manga) for manga in self.url_uuids]
+            else:
+                results = self.run_parallel()
+        finally:
+            if self.archive_pool:
+                self.archive_pool.shutdown()
+                self.archive_pool = None
+            if self.async_downloader:
+                self.async_downloader.close()
+                self.async_downloader = None
+            # send the remaining reports of the image downloads
+            REPORT_QUEUE.wait(timeout=5)
+
+        return [
+            manga for manga, success in zip(self.url_uuids, results, strict=True) if not success
+        ]
+
+    def run_parallel(self) -> list[bool]:
+        """Download the mangas in parallel.
+
+        Returns:
+            The success of every manga
+        """
+        log.info(f"Downloading {len(self.url_uuids)} mangas, {self.parallel} in parallel")
+        executor = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="manga")
+        try:
+            results = list(executor.map(self.download_manga, self.url_uuids))
+        except KeyboardInterrupt as exc:
+            log.warning("Stopping after the running mangas")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise exc
+        executor.shutdown()
+
+        return results
+
+    def download_manga(self, url_uuid: str) -> bool:
+        """Download a single manga and log its errors.
+
+        Args:
+            url_uuid: URL or UUID of the manga
+
+        Returns:
+            True if the manga was downloaded without an error
+        """
+        with self.log_context(url_uuid):
+            try:
+                mdlp = self.create_manga(url_uuid)
+                mdlp.get_manga()
+                if mdlp.downloaded_chapters:
+                    self.updated_at[url_uuid] = time.time()
+            except (KeyboardInterrupt, Exception) as exc:
+                self.log_error(url_uuid, exc)
+                return False
+
+        return True
+
+    def run_queue(self) -> None:
+        """Download the chapters of all mangas from one queue.
+
+        The mangas are prepared (chapter feed, pre hook) in parallel, while the workers
+        already download the queued chapters. The mangas which had an error are stored
+        in failed_mangas.
+        """
+        log.info(f"Downloading {len(self.url_uuids)} mangas with {self.parallel} chapter workers")
+        chapter_queue = ChapterQueue(self.max_per_manga)
+        self.failed_mangas.clear()
+        preparers = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="manga")
+        downloaders = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="chapter")
+        try:
+            workers = [
+                downloaders.submit(self.chapter_worker, chapter_queue) for _ in range(self.parallel)
+            ]
+            list(preparers.map(partial(self.queue_manga, chapter_queue), self.url_uuids))
+            chapter_queue.close()
+            for worker in workers:
+                worker.result()
+        except KeyboardInterrupt as exc:
+            log.warning("Stopping after the running chapters")
+            chapter_queue.close(clear=True)
+            preparers.shutdown(wait=False, cancel_futures=True)
+            downloaders.shutdown(wait=False, cancel_futures=True)
+            raise exc
+        preparers.shutdown()
+        downloaders.shutdown()
+        self.queued_mangas.clear()
+
+    def queue_manga(self, chapter_queue: ChapterQueue, url_uuid: str) -> None:
+        """Prepare a manga and add its missing chapters to the queue, the newest first.
+
+        Args:
+            chapter_queue: Queue of the chapter workers
+            url_uuid: URL or UUID of the manga
+        """
+        with self.log_context(url_uuid):
+            try:
+                mdlp = self.create_manga(url_uuid)
+                chapters = mdlp.prepare_manga()
+                if chapters is None:
+                    return
+                missing_chapters = [
+                    chapter
+                    for chapter in reversed(chapters)
+                    if not (mdlp.cache and mdlp.cache.has_chapter(chapter))
+                ]
+                if not missing_chapters:
+                    mdlp.finish_manga()
+                    return
+                with self.lock:
+                    self.queued_mangas[url_uuid] = mdlp
+                    self.remaining_chapters[url_uuid] = len(missing_chapters)
+                chapter_queue.put(
+                    url_uuid,
+                    [(chapter, get_publish_time(mdlp, chapter)) for chapter in missing_chapters],
+                )
+            except Exception as exc:
+                self.log_error(url_uuid, exc)
+                self.failed_mangas.add(url_uuid)
+
+    def chapter_worker(self, chapter_queue: ChapterQueue) -> None:
+        """Download the chapters of the queue until it's closed and empty.
+
+        Args:
+            chapter_queue: Queue with the chapters of all mangas
+        """
+        while job := chapter_queue.get():
+            url_uuid, chapter = job
+            mdlp = self.queued_mangas[url_uuid]
+            with self.log_context(url_uuid):
+                try:
+                    # each chapter has its own hook infos, as other workers can download chapters
+                    # of the same manga
+                    fetched_chapter = mdlp.fetch_chapter(chapter)
+                    if fetched_chapter:
+                        chapter_path, hook_infos = fetched_chapter
+                        mdlp.process_chapter(chapter, chapter_path, hook_infos, mdlp.error_chapters)
+                except Exception as exc:
+                    log.error(f"Can't download chapter '{chapter}'. Reason={exc}")
+                    mdlp.error_chapters.append(chapter)
+                finally:
+                    chapter_queue.task_done(url_uuid)
+                self.finish_chapter(url_uuid)
+
+    def finish_chapter(self, url_uuid: str) -> None:
+        """Finish the manga after its last chapter.
+
+        Args:
+            url_uuid: URL or UUID of the manga
+        """
+        with self.lock:
+            self.remaining_chapters[url_uuid] -= 1
+            if self.remaining_chapters[url_uuid] > 0:
+                return
+        mdlp = self.queued_mangas[url_uuid]
+        try:
+            mdlp.finish_manga()
+            if mdlp.downloaded_chapters:
+                self.updated_at[url_uuid] = time.time()
+        except Exception as exc:
+            self.log_error(url_uuid, exc)
+            self.failed_mangas.add(url_uuid)
+
+    def create_manga(self, url_uuid: str) -> app.MangaDLP:
+        mdlp: app.MangaDLP = app.MangaDLP(
+            url_uuid=url_uuid,
+            session=self.session,
+            prefetched_manga=self.prefetched_manga,
+            archive_pool=self.archive_pool,
+            async_downloader=self.async_downloader,
+            **self.kwargs,
+        )
+
+        return mdlp
+
+    # prefix the log messages with the manga, if multiple mangas run at the same time
+    def log_context(self, url_uuid: str) -> AbstractContextManager[Any]:
+        if self.parallel > 1:
+            return log.contextualize(manga=url_uuid)
+
+        return nullcontext()
+
+    def log_error(self, url_uuid: str, exc: BaseException) -> None:
+        if len(self.url_uuids) == 1:
+            log.error(f"Error with manga: {url_uuid}")
+        else:
+            log.error(f"Skipping: {url_uuid}. Reason={exc}")
+
+
+class MangaDaemon:
+    """Keep checking the mangas of a list for new chapters in a long-running process.
+
+    Every manga is checked again after the interval. The http session with its connection
+    pools and rate limits stays alive between the checks and the list file is read again
+    if it changed. Mangas which had new chapters recently are checked first.
+
+    Args:
+        list_file: Path of the file with manga links. One per line
+        interval: Time in seconds between the checks of a manga
+        jitter: Random deviation of the interval as fraction of it. Spreads the checks
+        kwargs: Arguments for MangaScheduler
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        list_file: str | Path,
+        interval: float = 86400,
+        jitter: float = 0.1,
+        **kwargs: Any,
+    ) -> None:
+        self.list_file = Path(list_file)
+        self.interval = interval
+        self.jitter = jitter
+        self.scheduler = MangaScheduler([], **kwargs)
+        self.list_mtime: float | None = None
+        # unix time of the next check by manga
+        self.next_check: dict[str, float] = {}
+
+    def reload_list(self) -> None:
+        """Read the list file again if it changed."""
+        try:
+            mtime = self.list_file.stat().st_mtime
+            if mtime == self.list_mtime:
+                return
+            url_list = self.list_file.read_text(encoding="utf-8").splitlines()
+        except Exception as exc:
+            log.warning(f"Can't read file '{self.list_file}'. Reason={exc}")
+            return
+
+        self.list_mtime = mtime
+        mangas = list(filter(len, url_list))
+        log.info(f"Mangas from list: {mangas}")
+        # new mangas are checked right away, removed mangas are dropped
+        self.next_check = {manga: self.next_check.get(manga, 0) for manga in mangas}
+
+    def due_mangas(self) -> list[str]:
+        """Get the mangas which should be checked now.
+
+        Returns:
+            The due mangas, the most recently updated ones first
+        """
+        now = time.time()
+        due = [manga for manga, next_check in self.next_check.items() if next_check <= now]
+
+        return sorted(due, key=lambda manga: -self.scheduler.updated_at.get(manga, 0))
+
+    def check(self) -> list[str]:
+        """Check all due mangas for new chapters and schedule their next check.
+
+        Returns:
+            The checked mangas
+        """
+        self.reload_list()
+        mangas = self.due_mangas()
+        if not mangas:
+            return []
+
+        self.scheduler.url_uuids = mangas
+        self.scheduler.run()
+        for manga in mangas:
+            deviation = random.uniform(-self.jitter, self.jitter)  # noqa: S311
+            self.next_check[manga] = time.time() + self.interval * (1 + deviation)
+
+        return mangas
+
+    def run(self) -> None:
+        """Check the mangas until the process is stopped."""
+        log.info(f"Starting daemon. Checking mangas every {self.interval}s")
+        while True:
+            self.check()
+            # wake up for the next due manga, and regularly to check the list file
+            next_check = min(self.next_check.values(), default=time.time() + LIST_CHECK_INTERVAL)
+            time.sleep(max(0, min(next_check - time.time(), LIST_CHECK_INTERVAL)))
@@ -1,21 +1,70 @@
+import hashlib
 import re
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import pairwise
 from pathlib import Path
 from typing import Any
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import pytz
 from loguru import logger as log
 
 
+# file types which are already compressed. deflate only costs cpu time for them
+COMPRESSED_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif", ".jxl")
+COMPRESSION_MODES = ("stored", "deflate", "auto")
+# bounds of the time between two checks of a manga with adaptive polling
+MIN_CHECK_INTERVAL = timedelta(hours=12)
+MAX_CHECK_INTERVAL = timedelta(days=30)
+# format of the stored sync/check times (utc)
+SYNC_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+# get the zip compression for a file in the archive
+def get_compression(file_name: str, compression: str) -> int:
+    if compression == "deflate":
+        return ZIP_DEFLATED
+    # only compress files which are not already compressed
+    if compression == "auto" and not file_name.lower().endswith(COMPRESSED_SUFFIXES):
+        return ZIP_DEFLATED
+
+    return ZIP_STORED
+
+
+# log the size of an archive and the time it took to create it
+def log_archive_stats(archive_path: Path, start_time: float) -> None:
+    with ZipFile(archive_path, "r") as zipfile:
+        infos = zipfile.infolist()
+    size_raw = sum(info.file_size for info in infos)
+    size_archive = archive_path.stat().st_size
+    ratio = size_archive / size_raw if size_raw else 1
+    log.info(
+        f"Archive '{archive_path.name}': files={len(infos)}, size={size_archive} bytes, "
+        f"uncompressed={size_raw} bytes, ratio={ratio:.2f}, time={time.perf_counter() - start_time:.2f}s"
+    )
+
+
 # create an archive of the chapter images
-def make_archive(chapter_path: Path, file_format: str) -> None:
+def make_archive(
+    chapter_path: Path,
+    file_format: str,
+    compression: str = "stored",
+    compression_level: int | None = None,
+) -> None:
     zip_path = Path(f"{chapter_path}.zip")
+    start_time = time.perf_counter()
     try:
         # create zip
         with ZipFile(zip_path, "w") as zipfile:
             for file in chapter_path.iterdir():
-                zipfile.write(file, file.name)
+                zipfile.write(
+                    file,
+                    file.name,
+                    compress_type=get_compression(file.name, compression),
+                    compresslevel=compression_level,
+                )
+        log_archive_stats(zip_path, start_time)
         # rename zip to file format requested
         zip_path.replace(zip_path.with_suffix(file_format))
     except Exception as exc:
@@ -41,6 +90,16 @@ def make_pdf(chapter_path: Path) -> None:
         raise exc
 
 
+# sha256 hash of a file
+def file_sha256(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with file_path.open("rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
 # create a list of chapters
 def get_chapter_list(chapters: str, available_chapters: list[str]) -> list[str]:
     # check if there are available chapter
@@ -82,6 +141,46 @@ def get_chapter_list(chapters: str, available_chapters: list[str]) -> list[str]:
     return chapter_list
 
 
+# check if the chapter selection can only be resolved with the available chapters
+def needs_chapter_feed(chapters: str) -> bool:
+    if chapters.lower() == "all":
+        return True
+    # full volumes --> 1:
+    return any(chapter.endswith(":") for chapter in chapters.split(","))
+
+
+# parse the publish time of a chapter. None if it's missing or invalid
+def parse_publish_time(publish_time: str) -> datetime | None:
+    try:
+        release = datetime.fromisoformat(publish_time.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    # times without an offset are utc
+    return release if release.tzinfo else release.replace(tzinfo=timezone.utc)
+
+
+# estimate when a manga should be checked for new chapters, from the publish times of its chapters
+def get_next_check(publish_times: list[str], now: datetime) -> datetime:
+    releases = sorted(filter(None, map(parse_publish_time, publish_times)))
+    # chapters released within an hour count as one release
+    gaps = [new - old for old, new in pairwise(releases[-21:]) if new - old >= timedelta(hours=1)]
+    if not gaps:
+        return now + MIN_CHECK_INTERVAL
+
+    # the typical (median) time between the last releases
+    last_gaps = sorted(gaps[-10:])
+    expected_release = releases[-1] + last_gaps[len(last_gaps) // 2]
+    if expected_release > now:
+        wait_time = expected_release - now
+    else:
+        # overdue. the longer there was no release, the less often the manga is checked
+        wait_time = (now - releases[-1]) / 4
+    log.debug(f"Last release: {releases[-1]}, expected release: {expected_release}")
+
+    return now + min(max(wait_time, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL)
+
+
 # remove illegal characters etc
 def fix_name(filename: str) -> str:
     filename = filename.encode(encoding="utf8", errors="ignore").decode(encoding="utf8")
@@ -1,7 +1,19 @@
+import io
+import logging
+import threading
+from pathlib import Path
+from typing import Any
+from zipfile import ZipFile
+
 import pytest
+from loguru import logger as log
+from pytest import MonkeyPatch
 
+from mangadlp import app, downloader, network
 from mangadlp.api.mangadex import Mangadex
 from mangadlp.app import MangaDLP
+from mangadlp.cache import open_cache
+from mangadlp.models import ChapterData, ComicInfo
 
 
 def test_check_api_mangadex():
@@ -18,3 +30,354 @@ def test_check_api_none():
     with pytest.raises(ValueError) as e:
         MangaDLP(url_uuid=url, list_chapters=True, download_wait=2)
     assert e.type is ValueError
+
+
+def test_check_engine_invalid():
+    url = "a96676e5-8ae2-425e-b549-7f15dd34a6d8"
+    with pytest.raises(ValueError) as e:
+        MangaDLP(url_uuid=url, list_chapters=True, engine="abc")
+    assert e.type is ValueError
+
+
+class FakeApi:
+    """Offline api with three chapters of two pages each."""
+
+    api_name = "Fake"
+    api_base_url = "https://api.fake.test"
+
+    def __init__(self, url_uuid: str, language: str, forcevol: bool, session: Any = None):  # noqa: D107
+        self.url_uuid = url_uuid
+        self.language = language
+        self.forcevol = forcevol
+        self.session = session
+        self.manga_uuid = "abc"
+        self.manga_title = "Fake Manga"
+        self.manga_chapter_data: dict[str, ChapterData] = {
+            str(n): {"uuid": f"c{n}", "volume": "1", "chapter": str(n), "name": "", "pages": 2}
+            for n in range(1, 4)
+        }
+        self.chapter_list = list(self.manga_chapter_data)
+
+    def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+        return [f"https://img.fake.test/{chapter}/{n}.png" for n in range(1, 3)]
+
+    def create_metadata(self, chapter: str) -> ComicInfo:
+        return {"Series": self.manga_title, "Number": chapter}
+
+
+class FeedlessApi(FakeApi):
+    """Offline api which fails if the chapter feed is requested."""
+
+    @property
+    def chapter_list(self) -> list[str]:
+        raise AssertionError
+
+    @chapter_list.setter
+    def chapter_list(self, _value: list[str]) -> None:
+        pass
+
+
+def fake_download(image_urls: list[str], chapter_path: str | Path, *_args: Any) -> None:
+    for num, image in enumerate(image_urls, 1):
+        Path(f"{chapter_path}/{num:03d}.png").write_text(image, encoding="utf8")
+
+
+def test_get_manga_cached_skips_feed(monkeypatch: MonkeyPatch, tmp_path: Path):
+    monkeypatch.setattr(app, "match_api", lambda _: FeedlessApi)
+    cache_path = tmp_path / "cache.json"
+    open_cache(cache_path, "abc", "en", "Fake Manga").add_chapters(["1", "2"])
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="1-2",
+        download_path=tmp_path,
+        download_wait=0,
+        cache_path=str(cache_path),
+    )
+    mdlp.get_manga()
+
+    assert not (tmp_path / "Fake Manga").exists()
+
+
+def test_get_manga_incremental_shared_cache(monkeypatch: MonkeyPatch, tmp_path: Path):
+    class FeedApi(FakeApi):
+        feed_cache: Any = None
+
+        @property
+        def chapter_list(self) -> list[str]:
+            # the incremental sync of the api
+            self.feed_cache.set_feed("2026-10-18T00:00:00", [])
+            return list(self.manga_chapter_data)
+
+        @chapter_list.setter
+        def chapter_list(self, _value: list[str]) -> None:
+            pass
+
+    monkeypatch.setattr(app, "match_api", lambda _: FeedApi)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    cache_path = tmp_path / "cache.json"
+    open_cache(cache_path, "abc", "en", "Fake Manga").set_feed("2026-10-01T00:00:00", [])
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="all",
+        download_path=tmp_path,
+        download_wait=0,
+        cache_path=str(cache_path),
+        incremental=True,
+    )
+    mdlp.get_manga()
+
+    # the chapters downloaded after the sync don't roll back the feed
+    assert mdlp.api.feed_cache is mdlp.cache
+    cache = open_cache(cache_path, "abc", "en", "Fake Manga")
+    assert cache.get_feed()[0] == "2026-10-18T00:00:00"
+    assert cache.db_uuid_chapters == ["1", "2", "3"]
+
+
+@pytest.mark.parametrize("pipeline_size", [0, 1, 2])
+def test_get_manga_pipeline(monkeypatch: MonkeyPatch, tmp_path: Path, pipeline_size: int):
+    manga_path = tmp_path / "Fake Manga"
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="all",
+        download_path=tmp_path,
+        download_wait=0,
+        pipeline_size=pipeline_size,
+    )
+    mdlp.get_manga()
+
+    archives = sorted(file.name for file in manga_path.iterdir())
+    assert archives == ["Ch. 1.cbz", "Ch. 2.cbz", "Ch. 3.cbz"]
+    with ZipFile(manga_path / "Ch. 2.cbz") as archive:
+        assert sorted(archive.namelist()) == ["001.png", "002.png", "ComicInfo.xml"]
+
+
+def test_get_manga_archive_workers(monkeypatch: MonkeyPatch, tmp_path: Path):
+    manga_path = tmp_path / "Fake Manga"
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="all",
+        download_path=tmp_path,
+        download_wait=0,
+        archive_workers=2,
+    )
+    assert mdlp.pipeline_size == 2
+    mdlp.get_manga()
+
+    archives = sorted(file.name for file in manga_path.iterdir())
+    assert archives == ["Ch. 1.cbz", "Ch. 2.cbz", "Ch. 3.cbz"]
+    assert mdlp.archive_pool is None
+
+
+def test_get_manga_archive_workers_error(monkeypatch: MonkeyPatch, tmp_path: Path):
+    manga_path = tmp_path / "Fake Manga"
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="1,2",
+        file_format="pdf",
+        download_path=tmp_path,
+        download_wait=0,
+        archive_workers=2,
+    )
+    # the fake images are not valid, so img2pdf fails in the worker processes
+    messages: list[str] = []
+    handler_id = log.add(messages.append, format="{message}")
+    mdlp.get_manga()
+    log.remove(handler_id)
+
+    assert any(
+        msg.strip() in ["Chapters with errors: 1, 2", "Chapters with errors: 2, 1"]
+        for msg in messages
+    )
+    assert sorted(file.name for file in manga_path.iterdir()) == ["Ch. 1", "Ch. 2"]
+
+
+def test_archive_pool_loglevel(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(logging.root, "level", logging.ERROR)
+    archive_pool = app.create_archive_pool(1)
+    try:
+        # the workers log with the level of the run
+        assert archive_pool.submit(logging.root.getEffectiveLevel).result() == logging.ERROR
+    finally:
+        archive_pool.shutdown()
+
+
+class FakeResponse:  # noqa: D101
+    def __init__(self, content: bytes):  # noqa: D107
+        self.status_code = 200
+        self.headers: dict[str, str] = {}
+        self.raw = io.BytesIO(content)
+
+
+def test_get_manga_stream(monkeypatch: MonkeyPatch, tmp_path: Path):
+    manga_path = tmp_path / "Fake Manga"
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(network, "get", lambda url, *_args, **_kwargs: FakeResponse(url.encode()))
+    mdlp = MangaDLP(
+        url_uuid="abc",
+        chapters="1,2",
+        download_path=tmp_path,
+        download_wait=0,
+        stream_archive=True,
+    )
+    mdlp.get_manga()
+
+    # no image folders are created
+    assert sorted(file.name for file in manga_path.iterdir()) == ["Ch. 1.cbz", "Ch. 2.cbz"]
+    with ZipFile(manga_path / "Ch. 2.cbz") as archive:
+        assert sorted(archive.namelist()) == ["001.png", "002.png", "ComicInfo.xml"]
+        assert archive.read("002.png") == b"https://img.fake.test/2/2.png"
+
+
+def test_stream_pdf_invalid():
+    with pytest.raises(ValueError) as e:
+        MangaDLP(url_uuid="abc", chapters="1", file_format="pdf", stream_archive=True)
+    assert e.type is ValueError
+
+
+def test_get_manga_image_failover(monkeypatch: MonkeyPatch, tmp_path: Path):
+    reports: list[tuple[str, bool]] = []
+
+    class NodeApi(FakeApi):
+        def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+            return [f"https://node.fake.test/{chapter}/{n}.png" for n in range(1, 3)]
+
+        def get_fallback_images(self, chapter: str) -> list[str]:
+            return super().get_chapter_images(chapter, 0)
+
+        def report_image(self, image: str, success: bool, *_args: Any) -> None:
+            reports.append((image, success))
+
+    def fake_get(url: str, *_args: Any, **_kwargs: Any) -> FakeResponse:
+        # the node is down
+        if url.startswith("https://node.fake.test"):
+            raise ConnectionError
+        return FakeResponse(url.encode())
+
+    monkeypatch.setattr(app, "match_api", lambda _: NodeApi)
+    monkeypatch.setattr(network, "get", fake_get)
+    mdlp = MangaDLP(url_uuid="abc", chapters="1", download_path=tmp_path, download_wait=0)
+    mdlp.get_manga()
+
+    with ZipFile(tmp_path / "Fake Manga" / "Ch. 1.cbz") as archive:
+        assert archive.read("002.png") == b"https://img.fake.test/1/2.png"
+    assert ("https://node.fake.test/1/1.png", False) in reports
+    assert ("https://img.fake.test/1/1.png", True) in reports
+
+
+@pytest.mark.parametrize("suffix", [".png", ".jpg"])
+def test_get_manga_image_tier_failover(monkeypatch: MonkeyPatch, tmp_path: Path, suffix: str):
+    class DataSaverApi(FakeApi):
+        def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+            return [f"https://node.fake.test/{chapter}/{n}-saver{suffix}" for n in range(1, 3)]
+
+        def get_fallback_images(self, chapter: str) -> list[str]:
+            return super().get_chapter_images(chapter, 0)
+
+    def fake_get(url: str, *_args: Any, **_kwargs: Any) -> FakeResponse:
+        # the second data-saver page fails
+        if url.endswith(f"2-saver{suffix}"):
+            raise ConnectionError
+        return FakeResponse(url.encode())
+
+    monkeypatch.setattr(app, "match_api", lambda _: DataSaverApi)
+    monkeypatch.setattr(network, "get", fake_get)
+    mdlp = MangaDLP(url_uuid="abc", chapters="1", download_path=tmp_path, download_wait=0)
+    mdlp.get_manga()
+
+    # only the original images are in the archive
+    with ZipFile(tmp_path / "Fake Manga" / "Ch. 1.cbz") as archive:
+        assert sorted(archive.namelist()) == ["001.png", "002.png", "ComicInfo.xml"]
+        assert archive.read("001.png") == b"https://img.fake.test/1/1.png"
+
+
+@pytest.mark.parametrize("suffix", [".png", ".jpg"])
+def test_get_manga_image_tier_resume(monkeypatch: MonkeyPatch, tmp_path: Path, suffix: str):
+    class DataSaverApi(FakeApi):
+        def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+            return [f"https://img.fake.test/{chapter}/{n}-saver{suffix}" for n in range(1, 3)]
+
+    def fake_get(url: str, *_args: Any, **_kwargs: Any) -> FakeResponse:
+        # the run is interrupted after the first data-saver page
+        if url.endswith(f"2-saver{suffix}"):
+            raise ConnectionError
+        return FakeResponse(url.encode())
+
+    monkeypatch.setattr(network, "get", fake_get)
+    monkeypatch.setattr(app, "match_api", lambda _: DataSaverApi)
+    MangaDLP(url_uuid="abc", chapters="1", download_path=tmp_path, download_wait=0).get_manga()
+    assert (tmp_path / "Fake Manga" / f"Ch. 1/001{suffix}").exists()
+
+    # the next run downloads the originals
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    MangaDLP(url_uuid="abc", chapters="1", download_path=tmp_path, download_wait=0).get_manga()
+
+    with ZipFile(tmp_path / "Fake Manga" / "Ch. 1.cbz") as archive:
+        assert sorted(archive.namelist()) == ["001.png", "002.png", "ComicInfo.xml"]
+        assert archive.read("001.png") == b"https://img.fake.test/1/1.png"
+
+
+@pytest.mark.parametrize("ttl", [600, 0])
+def test_get_manga_prefetch(monkeypatch: MonkeyPatch, tmp_path: Path, ttl: int):
+    requests_made: list[tuple[str, bool]] = []
+
+    class PrefetchApi(FakeApi):
+        def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+            requests_made.append((chapter, threading.current_thread() is threading.main_thread()))
+            return super().get_chapter_images(chapter, _wait_time)
+
+    monkeypatch.setattr(app, "match_api", lambda _: PrefetchApi)
+    monkeypatch.setattr(app, "IMAGE_URLS_TTL", ttl)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    mdlp = MangaDLP(
+        url_uuid="abc", chapters="all", download_path=tmp_path, download_wait=0, prefetch_size=2
+    )
+    mdlp.get_manga()
+
+    assert sorted(file.name for file in (tmp_path / "Fake Manga").iterdir()) == [
+        "Ch. 1.cbz",
+        "Ch. 2.cbz",
+        "Ch. 3.cbz",
+    ]
+    # the first chapter is requested directly, the next ones in the background
+    assert ("1", True) in requests_made
+    assert ("2", False) in requests_made
+    assert ("3", False) in requests_made
+    # expired urls are requested again
+    assert len(requests_made) == (3 if ttl else 5)
+
+
+def test_get_manga_adaptive_polling(monkeypatch: MonkeyPatch, tmp_path: Path):
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    cache_path = tmp_path / "cache.json"
+    kwargs: dict[str, Any] = {
+        "url_uuid": "abc",
+        "chapters": "all",
+        "download_path": tmp_path,
+        "download_wait": 0,
+        "cache_path": str(cache_path),
+        "adaptive_polling": True,
+    }
+    MangaDLP(**kwargs).get_manga()
+    cache = open_cache(cache_path, "abc", "en", "Fake Manga")
+    assert cache.get_next_check()
+
+    # the manga isn't due yet, so the chapter feed isn't requested
+    monkeypatch.setattr(app, "match_api", lambda _: FeedlessApi)
+    MangaDLP(**kwargs).get_manga()
+
+    # due mangas are checked
+    cache.set_next_check("2000-01-01T00:00:00")
+    with pytest.raises(AssertionError):
+        MangaDLP(**kwargs).get_manga()
+
+
+def test_adaptive_polling_no_cache():
+    with pytest.raises(ValueError):
+        MangaDLP(url_uuid="abc", chapters="1", adaptive_polling=True)
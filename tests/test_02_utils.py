@@ -1,5 +1,7 @@
 import shutil
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import pytest
 
@@ -298,3 +300,51 @@ def test_get_filename_custom_format_none():
         )
         == filename
     )
+
+
+@pytest.mark.parametrize(
+    ("compression", "image_type", "text_type"),
+    [
+        ("stored", ZIP_STORED, ZIP_STORED),
+        ("deflate", ZIP_DEFLATED, ZIP_DEFLATED),
+        ("auto", ZIP_STORED, ZIP_DEFLATED),
+    ],
+)
+def test_make_archive_compression(compression: str, image_type: int, text_type: int):
+    img_path = Path("tests/test_dir3")
+    archive_path = Path("tests/test_dir3.cbz")
+    img_path.mkdir(parents=True, exist_ok=True)
+    (img_path / "001.jpg").write_bytes(b"0" * 1000)
+    (img_path / "ComicInfo.xml").write_text("<ComicInfo>" * 100, encoding="utf8")
+    utils.make_archive(img_path, ".cbz", compression, 9)
+
+    with ZipFile(archive_path) as archive:
+        assert archive.getinfo("001.jpg").compress_type == image_type
+        assert archive.getinfo("ComicInfo.xml").compress_type == text_type
+    # cleanup
+    archive_path.unlink(missing_ok=True)
+    shutil.rmtree(img_path, ignore_errors=True)
+
+
+@pytest.mark.parametrize(
+    ("release_days", "wait_days"),
+    [
+        # weekly releases, the last one two days ago
+        ([-30, -23, -16, -9, -2], 5),
+        # multiple chapters at once count as one release
+        ([-20, -20, -13, -13, -6, -6], 1),
+        # overdue by a few days, check again soon
+        ([-40, -30, -20, -12], 3),
+        # no release in years
+        ([-1500, -1400, -1000], 30),
+        # not enough releases
+        ([-3], 0.5),
+        ([], 0.5),
+    ],
+)
+def test_get_next_check(release_days: list[float], wait_days: float):
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    publish_times = [(now + timedelta(days=days)).isoformat() for days in release_days]
+    publish_times.append("invalid")
+
+    assert utils.get_next_check(publish_times, now) == now + timedelta(days=wait_days)
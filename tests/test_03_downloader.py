@@ -1,11 +1,19 @@
+import hashlib
+import io
 import shutil
+import threading
+from collections.abc import Generator
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Any
+from zipfile import ZipFile
 
 import pytest
 import requests
 from pytest import MonkeyPatch
 
-from mangadlp import downloader
+from mangadlp import downloader, network
 
 
 def test_downloader():
@@ -49,3 +57,251 @@ def test_downloader_fail(monkeypatch: MonkeyPatch):
     assert e.type is TypeError
     # cleanup
     shutil.rmtree(chapter_path, ignore_errors=True)
+
+
+class FakeResponse:  # noqa: D101
+    def __init__(self, content: bytes):  # noqa: D107
+        self.status_code = 200
+        self.headers: dict[str, str] = {}
+        self.raw = io.BytesIO(content)
+
+
+def test_downloader_workers(monkeypatch: MonkeyPatch):
+    urls = [f"https://uploads.mangadex.org/data/abc/A{n}-abc.png" for n in range(1, 11)]
+
+    def fake_get(url: str, **_kwargs: Any) -> FakeResponse:
+        return FakeResponse(url.encode("utf8"))
+
+    chapter_path = Path("tests/test_folder2")
+    chapter_path.mkdir(parents=True, exist_ok=True)
+    monkeypatch.setattr(requests, "get", fake_get)
+    downloader.download_chapter(urls, str(chapter_path), 0, 4)
+
+    images = sorted(file.name for file in chapter_path.iterdir())
+    assert images == [f"{n:03d}.png" for n in range(1, 11)]
+    # check that every page is written to the correct name
+    for num, url in enumerate(urls, 1):
+        assert (chapter_path / f"{num:03d}.png").read_text(encoding="utf8") == url
+    # cleanup
+    shutil.rmtree(chapter_path, ignore_errors=True)
+
+
+class FakeRangeResponse:  # noqa: D101
+    def __init__(self, content: bytes, offset: int = 0):  # noqa: D107
+        self.status_code = 206 if offset else 200
+        self.headers = {"Content-Range": f"bytes {offset}-{len(content) - 1}/{len(content)}"}
+        self.raw = io.BytesIO(content[offset:])
+
+
+def test_downloader_resume(monkeypatch: MonkeyPatch, tmp_path: Path):
+    urls = [f"https://uploads.mangadex.org/data/abc/A{n}-abc.png" for n in range(1, 6)]
+    requests_made: list[tuple[str, dict[str, str]]] = []
+    failing_urls = {urls[3]}
+
+    def fake_get(url: str, *_args: Any, headers: dict[str, str], **_kwargs: Any) -> Any:
+        requests_made.append((url, headers))
+        if url in failing_urls:
+            raise ConnectionError
+        offset = int(headers["Range"][6:-1]) if "Range" in headers else 0
+        return FakeRangeResponse(url.encode("utf8") * 10, offset)
+
+    monkeypatch.setattr(downloader.network, "get", fake_get)
+    chapter_path = tmp_path / "chapter"
+    chapter_path.mkdir()
+    with pytest.raises(ConnectionError):
+        downloader.download_chapter(urls, chapter_path, 0)
+    manifest_path = downloader.get_manifest_path(chapter_path)
+    assert manifest_path.exists()
+
+    # partially written page
+    (chapter_path / "004.png.part").write_bytes((urls[3].encode("utf8") * 10)[:20])
+    failing_urls.clear()
+    requests_made.clear()
+    downloader.download_chapter(urls, chapter_path, 0)
+
+    assert requests_made == [(urls[3], {"Range": "bytes=20-"}), (urls[4], {})]
+    for num, url in enumerate(urls, 1):
+        assert (chapter_path / f"{num:03d}.png").read_bytes() == url.encode("utf8") * 10
+    assert not manifest_path.exists()
+
+
+def test_downloader_resume_other_source(monkeypatch: MonkeyPatch, tmp_path: Path):
+    saver_urls = [f"https://uploads.mangadex.org/data-saver/abc/A{n}-saver.jpg" for n in (1, 2)]
+    urls = [f"https://uploads.mangadex.org/data/abc/A{n}-abc.jpg" for n in (1, 2)]
+    requests_made: list[str] = []
+
+    def fake_get(url: str, *_args: Any, headers: dict[str, str], **_kwargs: Any) -> Any:
+        requests_made.append(url)
+        if url == saver_urls[1]:
+            raise ConnectionError
+        offset = int(headers["Range"][6:-1]) if "Range" in headers else 0
+        return FakeRangeResponse(url.encode("utf8"), offset)
+
+    monkeypatch.setattr(downloader.network, "get", fake_get)
+    chapter_path = tmp_path / "chapter"
+    chapter_path.mkdir()
+    # a previous run of the data-saver images was interrupted
+    with pytest.raises(ConnectionError):
+        downloader.download_chapter(saver_urls, chapter_path, 0)
+    (chapter_path / "002.jpg.part").write_bytes(saver_urls[1].encode("utf8")[:20])
+    (chapter_path / "003.jpg").write_bytes(b"page of a longer chapter")
+
+    requests_made.clear()
+    downloader.download_chapter(urls, chapter_path, 0)
+
+    # no page of the data-saver images is resumed
+    assert requests_made == urls
+    assert sorted(file.name for file in chapter_path.iterdir()) == ["001.jpg", "002.jpg"]
+    for num, url in enumerate(urls, 1):
+        assert (chapter_path / f"{num:03d}.jpg").read_bytes() == url.encode("utf8")
+
+
+def test_downloader_verify(monkeypatch: MonkeyPatch, tmp_path: Path):
+    content = b"image-1"
+    url = f"https://uploads.mangadex.org/data/abc/A1-{hashlib.sha256(content).hexdigest()}.png"
+    responses: list[FakeResponse] = []
+    monkeypatch.setattr(downloader.network, "get", lambda *_args, **_kwargs: responses.pop())
+    image_path = tmp_path / "001.png"
+
+    # corrupt image
+    responses.append(FakeResponse(b"image-2"))
+    with pytest.raises(ValueError):
+        downloader.download_image(url, image_path, 0)
+    assert not image_path.exists()
+    assert not Path(f"{image_path}.part").exists()
+
+    # transfer stopped early
+    response = FakeResponse(content)
+    response.headers["Content-Length"] = "100"
+    responses.append(response)
+    with pytest.raises(ConnectionError):
+        downloader.download_image(url, image_path, 0)
+    assert not image_path.exists()
+
+    responses.append(FakeResponse(content))
+    downloader.download_image(url, image_path, 0)
+    assert image_path.read_bytes() == content
+    assert not Path(f"{image_path}.part").exists()
+
+
+@pytest.fixture
+def image_server() -> Generator[str, None, None]:
+    # serve some fake images from a local http server
+    image_dir = Path("tests/test_images")
+    image_dir.mkdir(parents=True, exist_ok=True)
+    for n in range(1, 11):
+        (image_dir / f"A{n}-abc.png").write_bytes(f"image-{n}".encode())
+    handler = partial(SimpleHTTPRequestHandler, directory=str(image_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    shutil.rmtree(image_dir, ignore_errors=True)
+
+
+def test_downloader_async(image_server: str):
+    urls = [f"{image_server}/A{n}-abc.png" for n in range(1, 11)]
+    chapter_path = Path("tests/test_folder3")
+    chapter_path.mkdir(parents=True, exist_ok=True)
+    downloader.download_chapter_async(urls, str(chapter_path), 0, 4)
+
+    images = sorted(file.name for file in chapter_path.iterdir())
+    assert images == [f"{n:03d}.png" for n in range(1, 11)]
+    for n in range(1, 11):
+        assert (chapter_path / f"{n:03d}.png").read_bytes() == f"image-{n}".encode()
+    # cleanup
+    shutil.rmtree(chapter_path, ignore_errors=True)
+
+
+def test_downloader_async_fail(image_server: str):
+    urls = [f"{image_server}/A1-abc.png", f"{image_server}/missing.png"]
+    chapter_path = Path("tests/test_folder4")
+    chapter_path.mkdir(parents=True, exist_ok=True)
+    with pytest.raises(ConnectionError) as e:
+        downloader.download_chapter_async(urls, str(chapter_path), 0, 2)
+
+    assert e.type is ConnectionError
+    # cleanup
+    shutil.rmtree(chapter_path, ignore_errors=True)
+    downloader.get_manifest_path(chapter_path).unlink(missing_ok=True)
+
+
+def test_downloader_async_shared(image_server: str):
+    reports: list[tuple[str, bool]] = []
+    rate_limiter = network.RateLimiter(default_rate=1000)
+    async_downloader = downloader.AsyncDownloader(connections=4, rate_limiter=rate_limiter)
+    chapter_paths = [Path(f"tests/test_folder_async{n}") for n in range(3)]
+    for chapter_path in chapter_paths:
+        chapter_path.mkdir(parents=True, exist_ok=True)
+    # the first page of the first chapter was downloaded by a previous run
+    (chapter_paths[0] / "001.png").write_bytes(b"image-1")
+    downloader.PageManifest(downloader.get_manifest_path(chapter_paths[0])).add(
+        chapter_paths[0] / "001.png", f"{image_server}/A1-abc.png"
+    )
+
+    # chapters of multiple threads run on the same loop and client
+    urls = [f"{image_server}/A{n}-abc.png" for n in range(1, 11)]
+    threads = [
+        threading.Thread(
+            target=downloader.download_chapter_async,
+            args=(urls, chapter_path, 0, 4, lambda *args: reports.append(args[:2])),
+            kwargs={"async_downloader": async_downloader},
+        )
+        for chapter_path in chapter_paths
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    async_downloader.close()
+
+    for chapter_path in chapter_paths:
+        assert sorted(file.name for file in chapter_path.iterdir()) == [
+            f"{n:03d}.png" for n in range(1, 11)
+        ]
+        assert not downloader.get_manifest_path(chapter_path).exists()
+        shutil.rmtree(chapter_path, ignore_errors=True)
+    # the completed page was not downloaded again
+    assert len(reports) == 29
+    assert all(success for _, success in reports)
+    # the page requests took their tokens from the shared rate limiter
+    assert list(rate_limiter.buckets) == [image_server.removeprefix("http://")]
+
+
+def test_downloader_async_file_io(monkeypatch: MonkeyPatch, image_server: str, tmp_path: Path):
+    threads: set[str] = set()
+    is_complete = downloader.PageManifest.is_complete
+    add = downloader.PageManifest.add
+
+    def fake_is_complete(*args: Any) -> bool:
+        threads.add(threading.current_thread().name)
+        return is_complete(*args)
+
+    def fake_add(*args: Any) -> None:
+        threads.add(threading.current_thread().name)
+        add(*args)
+
+    monkeypatch.setattr(downloader.PageManifest, "is_complete", fake_is_complete)
+    monkeypatch.setattr(downloader.PageManifest, "add", fake_add)
+    urls = [f"{image_server}/A{n}-abc.png" for n in range(1, 4)]
+    downloader.download_chapter_async(urls, tmp_path, 0, 2)
+
+    # the manifest and the pages are written outside of the event loop
+    assert len(list(tmp_path.iterdir())) == 3
+    assert threads
+    assert "async-downloader" not in threads
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_downloader_archive(image_server: str, workers: int):
+    urls = [f"{image_server}/A{n}-abc.png" for n in range(1, 11)]
+    archive_path = Path("tests/test_archive.cbz.part")
+    downloader.download_chapter_archive(urls, archive_path, 0, workers)
+
+    with ZipFile(archive_path) as archive:
+        assert sorted(archive.namelist()) == [f"{n:03d}.png" for n in range(1, 11)]
+        for n in range(1, 11):
+            assert archive.read(f"{n:03d}.png") == f"image-{n}".encode()
+    # cleanup
+    archive_path.unlink()
@@ -59,3 +59,10 @@ def test_readin_list():
         "https://mangadex.org/title/bd6d0982-0091-4945-ad70-c028ed3c0917/mushoku-tensei-isekai-ittara-honki-dasu",
         "37f5cce0-8070-4ada-96e5-fa24b1bd4ff9",
     ]
+
+
+def test_daemon_no_read():
+    url_uuid = "https://mangadex.org/title/7b0fbb36-7e17-4709-b616-742005b7e0e3/yona-yona-yona"
+    command_args = f"-u {url_uuid} -c 1 --path tests --daemon --debug"
+    script_path = "manga-dlp.py"
+    assert os.system(f"python3 {script_path} {command_args}") != 0
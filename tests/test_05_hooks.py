@@ -1,11 +1,15 @@
+import os
 import shutil
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
 from pytest import MonkeyPatch
 
+from mangadlp.hooks import run_hook
+
 
 TESTDIR = Path("tests/testdir")
 HOOKDIR = TESTDIR / "hooks"
@@ -172,3 +176,24 @@ def test_all_hooks(wait_10s: MonkeyPatch):
     assert (HOOKDIR / "manga-post2.txt").is_file()
     assert (HOOKDIR / "chapter-pre2.txt").is_file()
     assert (HOOKDIR / "chapter-post2.txt").is_file()
+
+
+def test_hook_env_parallel():
+    # every hook writes its chapter number to its own file
+    script = HOOKDIR / "hook.sh"
+    script.write_text('sleep 0.2\necho "$MDLP_CHAPTER_NUMBER" > "$MDLP_OUT_FILE"\n')
+    outputs = [HOOKDIR / f"chapter-{num}.txt" for num in range(4)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        exit_codes = list(
+            executor.map(
+                lambda num: run_hook(
+                    f"sh {script}", "chapter_post", chapter_number=num, out_file=outputs[num]
+                ),
+                range(4),
+            )
+        )
+
+    assert exit_codes == [0, 0, 0, 0]
+    assert [output.read_text().strip() for output in outputs] == ["0", "1", "2", "3"]
+    # the env vars are only set for the hook process
+    assert "MDLP_CHAPTER_NUMBER" not in os.environ
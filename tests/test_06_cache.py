@@ -1,7 +1,18 @@
 import json
+from collections.abc import Generator
+from multiprocessing import Pool
 from pathlib import Path
 
-from mangadlp.cache import CacheDB
+import pytest
+from loguru import logger as log
+
+from mangadlp.cache import CacheDB, CacheSqliteDB, open_cache
+
+
+@pytest.fixture(autouse=True)
+def cleanup_lock() -> Generator[None, None, None]:
+    yield
+    Path("cache.json.lock").unlink(missing_ok=True)
 
 
 def test_cache_creation():
@@ -78,3 +89,140 @@ def test_cache_lang():
     assert cache_data["abc__de"]["chapters"] == ["8", "9"]
 
     cache_file.unlink()
+
+
+def test_cache_sqlite_insert():
+    cache_file = Path("cache.db")
+    cache = open_cache(cache_file, "abc", "en", "test")
+    assert isinstance(cache, CacheSqliteDB)
+    cache.add_chapter("2")
+    cache.add_chapters(["1", "3", "2"])
+
+    cache2 = open_cache(cache_file, "abc", "en", "test")
+    assert cache2.db_uuid_chapters == ["1", "2", "3"]
+    assert cache2.has_chapter("3")
+    assert not cache2.has_chapter("4")
+
+    cache3 = open_cache(cache_file, "abc", "de", "test")
+    assert cache3.db_uuid_chapters == []
+    cache_file.unlink()
+
+
+def test_cache_sqlite_migration():
+    json_file = Path("cache.json")
+    cache_file = Path("cache.db")
+    cache_json = CacheDB(json_file, "abc", "en", "test")
+    cache_json.add_chapter("1")
+    cache_json.add_chapter("2")
+
+    cache = open_cache(cache_file, "abc", "en", "test")
+    assert cache.db_uuid_chapters == ["1", "2"]
+
+    json_file.unlink()
+    cache_file.unlink()
+
+
+def test_cache_feed():
+    feed = [
+        {"uuid": "u1", "volume": "1", "chapter": "1", "name": "", "pages": 10},
+        {"uuid": "u2", "volume": "1", "chapter": "2", "name": "test", "pages": 12},
+    ]
+    for cache_file in (Path("cache.json"), Path("cache.db")):
+        cache = open_cache(cache_file, "abc", "en", "test")
+        assert cache.get_feed() == ("", [])
+        cache.set_feed("2024-01-01T00:00:00", feed)
+        cache.add_chapter("1")
+
+        cache2 = open_cache(cache_file, "abc", "en", "test")
+        assert cache2.get_feed() == ("2024-01-01T00:00:00", feed)
+        assert cache2.has_chapter("1")
+        assert open_cache(cache_file, "abc", "de", "test").get_feed() == ("", [])
+        cache_file.unlink()
+
+
+def test_cache_next_check():
+    for cache_file in (Path("cache.json"), Path("cache.db")):
+        cache = open_cache(cache_file, "abc", "en", "test")
+        assert cache.get_next_check() == ""
+        cache.set_next_check("2024-01-08T00:00:00")
+
+        assert open_cache(cache_file, "abc", "en", "test").get_next_check() == "2024-01-08T00:00:00"
+        assert open_cache(cache_file, "abc", "de", "test").get_next_check() == ""
+        cache_file.unlink()
+
+
+def test_cache_read_log():
+    cache_file = Path("cache.json")
+    messages: list[str] = []
+    handler_id = log.add(messages.append, level="INFO", format="{message}")
+    cache = CacheDB(cache_file, "abc", "en", "test")
+    cache.add_chapter("1")
+    cache.set_feed("2026-10-18T00:00:00", [])
+    cache.set_next_check("2026-10-20T00:00:00")
+    log.remove(handler_id)
+
+    # the re-reads of the writes are not logged
+    assert [msg.strip() for msg in messages].count("Reading cache-db: cache.json") == 1
+    cache_file.unlink()
+
+
+def test_cache_merge():
+    cache_file = Path("cache.json")
+    # both instances read the cache before the other one writes
+    cache1 = CacheDB(cache_file, "abc", "en", "test")
+    cache2 = CacheDB(cache_file, "abc", "en", "test")
+    cache3 = CacheDB(cache_file, "def", "en", "test2")
+    cache1.add_chapter("1")
+    cache2.add_chapter("2")
+    cache3.add_chapter("8")
+    cache1.add_chapter("3")
+
+    cache_data = json.loads(cache_file.read_text(encoding="utf8"))
+    assert cache_data["abc__en"]["chapters"] == ["1", "2", "3"]
+    assert cache_data["def__en"]["chapters"] == ["8"]
+    assert cache1.has_chapter("2")
+
+    cache_file.unlink()
+
+
+def test_cache_merge_stale_fields():
+    cache_file = Path("cache.json")
+    feed = [{"uuid": "u1", "volume": "1", "chapter": "1", "name": "", "pages": 10}]
+    CacheDB(cache_file, "abc", "en", "test").set_feed("2026-10-01T00:00:00", [])
+    # both instances read the cache before the other ones write
+    cache1 = CacheDB(cache_file, "abc", "en", "test")
+    cache2 = CacheDB(cache_file, "abc", "en", "test")
+    cache3 = CacheDB(cache_file, "def", "en", "test2")
+    cache2.set_feed("2026-10-18T00:00:00", feed)
+    cache3.set_next_check("2030-01-01T00:00:00")
+    # stale snapshots don't roll back the fields of the other instances
+    cache1.add_chapter("5")
+    cache1.set_next_check("2026-10-20T00:00:00")
+
+    cache_data = json.loads(cache_file.read_text(encoding="utf8"))
+    assert cache_data["abc__en"]["last_sync"] == "2026-10-18T00:00:00"
+    assert cache_data["abc__en"]["feed"] == feed
+    assert cache_data["abc__en"]["chapters"] == ["5"]
+    assert cache_data["abc__en"]["next_check"] == "2026-10-20T00:00:00"
+    assert cache_data["def__en"]["next_check"] == "2030-01-01T00:00:00"
+    assert cache1.get_feed() == ("2026-10-18T00:00:00", feed)
+
+    cache_file.unlink()
+
+
+def add_chapters_process(chapters: list[str]) -> None:
+    cache = CacheDB("cache.json", "abc", "en", "test")
+    for chapter in chapters:
+        cache.add_chapter(chapter)
+
+
+def test_cache_multiprocess():
+    cache_file = Path("cache.json")
+    chapter_lists = [[str(n) for n in range(i, 40, 4)] for i in range(4)]
+    with Pool(4) as pool:
+        pool.map(add_chapters_process, chapter_lists)
+
+    cache_data = json.loads(cache_file.read_text(encoding="utf8"))
+    assert cache_data["abc__en"]["chapters"] == [str(n) for n in range(40)]
+
+    cache_file.unlink()
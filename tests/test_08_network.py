@@ -0,0 +1,193 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pytest import MonkeyPatch
+from requests.adapters import HTTPAdapter
+
+from mangadlp import network
+
+
+def test_session_pools():
+    session = network.create_session(
+        pool_sizes={"https://api.mangadex.org": 4}, pool_size=20, retries=5, backoff=1
+    )
+    api_adapter = session.get_adapter("https://api.mangadex.org/manga/abc")
+    img_adapter = session.get_adapter("https://abc.mangadex.network/data/abc/1.png")
+
+    assert isinstance(api_adapter, HTTPAdapter)
+    assert isinstance(img_adapter, HTTPAdapter)
+    assert api_adapter is not img_adapter
+    assert api_adapter._pool_maxsize == 4  # type: ignore
+    assert img_adapter._pool_maxsize == 20  # type: ignore
+    assert img_adapter.max_retries.total == 5
+    assert img_adapter.max_retries.backoff_factor == 1
+
+
+class FakeJsonResponse:  # noqa: D101
+    def __init__(self, status_code: int, body: dict, etag: str = ""):  # noqa: D107
+        self.status_code = status_code
+        self.body = body
+        self.headers = {"ETag": etag} if etag else {}
+
+    def json(self) -> dict:
+        return self.body
+
+
+def test_response_cache(monkeypatch: MonkeyPatch, tmp_path):
+    requests_made: list[tuple[str, dict]] = []
+
+    def fake_get(url: str, *_args, headers: dict, **_kwargs) -> FakeJsonResponse:
+        requests_made.append((url, headers))
+        if headers.get("If-None-Match") == "v1":
+            return FakeJsonResponse(304, {})
+        return FakeJsonResponse(200, {"url": url}, etag="v1")
+
+    monkeypatch.setattr(network, "get", fake_get)
+    cache = network.ResponseCache(tmp_path / "api.db", ttl=3600)
+
+    assert cache.get_json("https://api/a") == {"url": "https://api/a"}
+    # fresh response, no request
+    assert cache.get_json("https://api/a") == {"url": "https://api/a"}
+    assert len(requests_made) == 1
+
+    # stale response is revalidated with the etag
+    cache.ttl = 0
+    assert cache.get_json("https://api/a") == {"url": "https://api/a"}
+    assert requests_made[-1] == ("https://api/a", {"If-None-Match": "v1"})
+
+    # cache persists on disk
+    cache2 = network.ResponseCache(tmp_path / "api.db", ttl=3600)
+    assert cache2.get_json("https://api/a") == {"url": "https://api/a"}
+    assert len(requests_made) == 2
+
+
+def test_response_cache_lru(monkeypatch: MonkeyPatch, tmp_path):
+    monkeypatch.setattr(
+        network, "get", lambda url, *_args, **_kwargs: FakeJsonResponse(200, {"url": url})
+    )
+    cache = network.ResponseCache(tmp_path / "api.db", max_entries=2)
+    for url in ("https://api/a", "https://api/b", "https://api/c"):
+        cache.get_json(url)
+
+    urls = [row[0] for row in cache.db.execute("SELECT url FROM responses ORDER BY url")]
+    assert urls == ["https://api/b", "https://api/c"]
+
+
+def test_rate_limiter(monkeypatch: MonkeyPatch):
+    waits: list[float] = []
+    monkeypatch.setattr(network.time, "sleep", waits.append)
+    limiter = network.RateLimiter(
+        {"https://api.mangadex.org": 2, "https://api.mangadex.org/at-home": 0.5}, default_rate=0
+    )
+
+    # bucket holds two tokens, the third request has to wait
+    for _ in range(3):
+        limiter.acquire("https://api.mangadex.org/manga/abc")
+    assert len(waits) == 1
+    assert 0.4 < waits[0] <= 0.5
+
+    # separate bucket for the at-home server
+    limiter.acquire("https://api.mangadex.org/at-home/server/abc")
+    assert len(waits) == 1
+    # no limit for other hosts
+    for _ in range(10):
+        limiter.acquire("https://abc.mangadex.network/data/1.png")
+    assert len(waits) == 1
+
+
+def test_rate_limiter_headers(monkeypatch: MonkeyPatch):
+    waits: list[float] = []
+    monkeypatch.setattr(network.time, "sleep", waits.append)
+    limiter = network.RateLimiter(default_rate=100)
+    url = "https://abc.mangadex.network/data/1.png"
+
+    limiter.update(url, FakeJsonResponse(429, {}))
+    assert limiter.buckets["abc.mangadex.network"].rate == 50
+
+    response = FakeJsonResponse(429, {})
+    response.headers = {"Retry-After": "3"}
+    limiter.update(url, response)
+    limiter.acquire(url)
+    assert 2.9 < waits[-1] <= 3
+
+    # successful responses restore the rate
+    for _ in range(10):
+        limiter.update(url, FakeJsonResponse(200, {}))
+    assert limiter.buckets["abc.mangadex.network"].rate == 100
+
+
+def test_rate_limited_session_429():
+    responses = [429, 200]
+
+    class RateLimitHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.send_response(responses.pop(0))
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *_args) -> None:
+            pass
+
+    # local server, which rate limits the first request
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    limiter = network.RateLimiter({url: 5})
+    session = network.create_session(rate_limiter=limiter, retries=3, backoff=0)
+    start_time = time.monotonic()
+    response = session.get(f"{url}/manga")
+    server.shutdown()
+
+    # the limiter saw the 429, blocked the bucket and retried after it
+    assert response.status_code == 200
+    assert responses == []
+    assert time.monotonic() - start_time >= 0.9
+    assert limiter.buckets[url].rate < 5
+    # the connection pool doesn't retry 429 itself
+    assert 429 not in session.get_adapter(url).max_retries.status_forcelist  # type: ignore
+
+
+def test_fixed_wait():
+    session = network.create_session(rate_limiter=network.RateLimiter())
+    assert isinstance(session, network.RateLimitedSession)
+    assert network.fixed_wait(session, 2) == 0
+    assert network.fixed_wait(network.create_session(), 2) == 2
+    assert network.fixed_wait(None, 2) == 2
+
+
+def test_rate_limiter_concurrency():
+    limiter = network.RateLimiter(
+        concurrency={"https://api.mangadex.org": 1}, default_concurrency=2
+    )
+    api_url = "https://api.mangadex.org/manga/abc"
+    img_url = "https://abc.mangadex.network/data/1.png"
+
+    with limiter.slot(api_url):
+        # the api slot is taken, other hosts have their own limit
+        assert not limiter.semaphores["https://api.mangadex.org"].acquire(blocking=False)
+        with limiter.slot(img_url), limiter.slot(img_url):
+            assert not limiter.semaphores["abc.mangadex.network"].acquire(blocking=False)
+    # released slots can be taken again
+    assert limiter.semaphores["https://api.mangadex.org"].acquire(blocking=False)
+    # no limit without a concurrency
+    with network.RateLimiter().slot(api_url):
+        pass
+
+
+def test_rate_limiter_unlimited(monkeypatch: MonkeyPatch):
+    waits: list[float] = []
+    monkeypatch.setattr(network.time, "sleep", waits.append)
+    report_url = "https://api.mangadex.network/report"
+    limiter = network.RateLimiter(default_rate=1, default_concurrency=1, unlimited=[report_url])
+
+    # reports neither take tokens nor slots
+    with limiter.slot(report_url), limiter.slot(report_url):
+        for _ in range(5):
+            limiter.acquire(report_url)
+    assert waits == []
+    assert not limiter.buckets
+    assert not limiter.semaphores
+    assert not limiter.has_bucket(report_url)
+    assert limiter.has_bucket("https://abc.mangadex.network/data/1.png")
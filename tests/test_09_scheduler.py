@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from pytest import MonkeyPatch
+
+from mangadlp import app, downloader, network
+from mangadlp.models import ChapterData
+from mangadlp.scheduler import ChapterQueue, MangaDaemon, MangaScheduler
+
+
+class FakeMangaDLP:
+    """Records the mangas and the sessions, fails for mangas named 'error'."""
+
+    def __init__(self, url_uuid: str, **kwargs: Any):  # noqa: D107
+        self.url_uuid = url_uuid
+        self.kwargs = kwargs
+        self.downloaded_chapters = ["1"] if url_uuid.startswith("new") else []
+
+    def get_manga(self) -> None:
+        if self.url_uuid == "error":
+            raise ValueError
+        started.append((self.url_uuid, self.kwargs["session"], threading.current_thread().name))
+        # wait for the other manga, so both have to run at the same time
+        barrier.wait(timeout=5)
+
+
+started: list[tuple[str, Any, str]] = []
+barrier = threading.Barrier(2)
+
+
+def test_scheduler_parallel(monkeypatch: MonkeyPatch):
+    started.clear()
+    barrier.reset()
+    monkeypatch.setattr(app, "MangaDLP", FakeMangaDLP)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    scheduler = MangaScheduler(["first", "error", "second"], parallel=2, download_wait=0)
+
+    assert scheduler.run() == ["error"]
+    assert sorted(manga for manga, _, _ in started) == ["first", "second"]
+    # all mangas share the session
+    assert all(session is scheduler.session for _, session, _ in started)
+    assert all(thread.startswith("manga") for _, _, thread in started)
+
+
+def test_scheduler_serial(monkeypatch: MonkeyPatch):
+    started.clear()
+    monkeypatch.setattr(app, "MangaDLP", FakeMangaDLP)
+    monkeypatch.setattr(barrier, "wait", lambda **_kwargs: 0)
+    scheduler = MangaScheduler(["error"], host_connections=3)
+
+    assert scheduler.run() == ["error"]
+    assert isinstance(scheduler.session, network.RateLimitedSession)
+    limiter = scheduler.session.rate_limiter
+    assert limiter.default_concurrency == 3
+    assert limiter.concurrency == {"https://api.mangadex.org": 3}
+    assert limiter.unlimited == ("https://api.mangadex.network/report",)
+
+
+def test_scheduler_shared_session(monkeypatch: MonkeyPatch, tmp_path: Path):
+    sessions: list[Any] = []
+
+    class FakeApi:
+        def __init__(self, url_uuid: str, *_args: Any, session: Any = None):
+            sessions.append(session)
+            self.manga_uuid = url_uuid
+            self.manga_title = url_uuid
+
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(app.MangaDLP, "get_manga", lambda _self: None)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    scheduler = MangaScheduler(["a", "b", "c"], parallel=3, chapters="1", download_path=tmp_path)
+
+    assert scheduler.run() == []
+    assert sessions == [scheduler.session] * 3
+
+
+def test_scheduler_shared_executors(monkeypatch: MonkeyPatch, tmp_path: Path):
+    pools: list[Any] = []
+    async_downloaders: list[Any] = []
+
+    class FakeApi:
+        def __init__(self, url_uuid: str, *_args: Any, **_kwargs: Any):
+            self.manga_uuid = url_uuid
+            self.manga_title = url_uuid
+
+    def fake_get_manga(self: app.MangaDLP) -> None:
+        pools.append(self.archive_pool)
+        async_downloaders.append(self.async_downloader)
+
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(app.MangaDLP, "get_manga", fake_get_manga)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    scheduler = MangaScheduler(
+        ["a", "b", "c"],
+        parallel=3,
+        chapters="1",
+        download_path=tmp_path,
+        archive_workers=2,
+        engine="async",
+    )
+
+    assert scheduler.run() == []
+    # one pool and async downloader for all mangas, which are closed after the run
+    for executors in (pools, async_downloaders):
+        assert len(executors) == 3
+        assert executors[0] is not None
+        assert all(executor is executors[0] for executor in executors)
+    assert async_downloaders[0].loop.is_closed()
+    assert scheduler.archive_pool is None
+    assert scheduler.async_downloader is None
+
+
+def test_daemon(monkeypatch: MonkeyPatch, tmp_path: Path):
+    started.clear()
+    monkeypatch.setattr(app, "MangaDLP", FakeMangaDLP)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    monkeypatch.setattr(barrier, "wait", lambda **_kwargs: 0)
+    list_file = tmp_path / "mangas.txt"
+    list_file.write_text("first\n\nnew1\n", encoding="utf8")
+    daemon = MangaDaemon(list_file, interval=100, jitter=0.1)
+
+    assert daemon.check() == ["first", "new1"]
+    assert all(90 < next_check - time.time() <= 110 for next_check in daemon.next_check.values())
+    # nothing is due
+    assert daemon.check() == []
+
+    # new mangas are checked right away, removed ones are dropped
+    list_file.write_text("new1\nnew2\nnew3\n", encoding="utf8")
+    os.utime(list_file, (0, 0))
+    assert daemon.check() == ["new2", "new3"]
+    assert list(daemon.next_check) == ["new1", "new2", "new3"]
+
+    # recently updated mangas first
+    daemon.next_check = dict.fromkeys(daemon.next_check, 0)
+    daemon.scheduler.updated_at["new1"] = daemon.scheduler.updated_at["new3"] + 1
+    daemon.scheduler.updated_at["new2"] = 0
+    assert daemon.due_mangas() == ["new1", "new3", "new2"]
+
+
+def test_chapter_queue():
+    chapter_queue = ChapterQueue(max_per_manga=1)
+    chapter_queue.put("backfill", [("3", 30), ("2", 20), ("1", 10)])
+    chapter_queue.put("new", [("1", 40)])
+
+    # newest chapter of every manga first
+    assert chapter_queue.get() == ("new", "1")
+    assert chapter_queue.get() == ("backfill", "3")
+    # only one chapter per manga at the same time
+    chapter_queue.task_done("backfill")
+    assert chapter_queue.get() == ("backfill", "2")
+    chapter_queue.task_done("backfill")
+    chapter_queue.task_done("new")
+    chapter_queue.close()
+    assert chapter_queue.get() == ("backfill", "1")
+    chapter_queue.task_done("backfill")
+    assert chapter_queue.get() is None
+
+
+class FakeApi:
+    """Offline api with three chapters per manga."""
+
+    api_name = "Fake"
+
+    def __init__(self, url_uuid: str, *_args: Any, **_kwargs: Any):  # noqa: D107
+        self.manga_uuid = url_uuid
+        self.manga_title = f"Manga {url_uuid}"
+        self.manga_chapter_data: dict[str, ChapterData] = {
+            str(n): {
+                "uuid": f"{url_uuid}{n}",
+                "volume": "1",
+                "chapter": str(n),
+                "name": "",
+                "pages": 1,
+                "publish_at": f"2024-01-0{n}T00:00:00",
+            }
+            for n in range(1, 4)
+        }
+        self.chapter_list = list(self.manga_chapter_data)
+
+    def get_chapter_images(self, chapter: str, _wait_time: float) -> list[str]:
+        return [f"https://img.fake.test/{self.manga_uuid}/{chapter}.png"]
+
+    def create_metadata(self, chapter: str) -> dict:
+        return {"Series": self.manga_title, "Number": chapter}
+
+
+def test_scheduler_global_queue(monkeypatch: MonkeyPatch, tmp_path: Path):
+    downloads: list[str] = []
+
+    def fake_download(image_urls: list[str], chapter_path: str | Path, *_args: Any) -> None:
+        downloads.append(image_urls[0])
+        if "b/2" in image_urls[0]:
+            raise ConnectionError
+        Path(f"{chapter_path}/001.png").write_text(image_urls[0], encoding="utf8")
+
+    monkeypatch.setattr(app, "match_api", lambda url_uuid: FakeApi if url_uuid != "error" else None)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    scheduler = MangaScheduler(
+        ["a", "error", "b"],
+        parallel=1,
+        global_queue=True,
+        chapters="all",
+        download_path=tmp_path,
+        download_wait=0,
+    )
+
+    assert scheduler.run() == ["error"]
+    # the newest chapters first
+    for manga in ("a", "b"):
+        assert [url.rsplit("/", 2)[2] for url in downloads if f"/{manga}/" in url] == [
+            "3.png",
+            "2.png",
+            "1.png",
+        ]
+    assert sorted(file.name for file in (tmp_path / "Manga a").iterdir()) == [
+        "Ch. 1.cbz",
+        "Ch. 2.cbz",
+        "Ch. 3.cbz",
+    ]
+    assert not (tmp_path / "Manga b" / "Ch. 2.cbz").exists()
+    assert set(scheduler.updated_at) == {"a", "b"}
+
+
+def test_scheduler_global_queue_hook_infos(monkeypatch: MonkeyPatch, tmp_path: Path):
+    hooks: list[dict[str, Any]] = []
+    # all chapters of the manga download at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fake_download(image_urls: list[str], chapter_path: str | Path, *_args: Any) -> None:
+        barrier.wait()
+        Path(f"{chapter_path}/001.png").write_text(image_urls[0], encoding="utf8")
+
+    def fake_run_hook(command: str, hook_type: str, status: str, **kwargs: Any) -> None:
+        if hook_type == "chapter_post":
+            hooks.append(kwargs)
+
+    monkeypatch.setattr(app, "match_api", lambda _: FakeApi)
+    monkeypatch.setattr(app, "prefetch_manga_data", lambda *_args: {})
+    monkeypatch.setattr(app, "run_hook", fake_run_hook)
+    monkeypatch.setattr(downloader, "download_chapter", fake_download)
+    scheduler = MangaScheduler(
+        ["a"],
+        parallel=3,
+        global_queue=True,
+        max_per_manga=3,
+        chapters="all",
+        download_path=tmp_path,
+        download_wait=0,
+    )
+
+    assert scheduler.run() == []
+    # every post hook has the infos of its own chapter
+    assert sorted(hook_infos["chapter_number"] for hook_infos in hooks) == ["1", "2", "3"]
+    for hook_infos in hooks:
+        assert hook_infos["chapter_uuid"] == f"a{hook_infos['chapter_number']}"
+        assert hook_infos["chapter_archive_path"].name == f"Ch. {hook_infos['chapter_number']}.cbz"
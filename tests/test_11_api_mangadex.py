@@ -1,8 +1,20 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 import requests
+from loguru import logger as log
 from pytest import MonkeyPatch
 
-from mangadlp.api.mangadex import Mangadex
+from mangadlp import network
+from mangadlp.api.mangadex import (
+    REPORT_QUEUE,
+    Mangadex,
+    get_manga_data_batch,
+    merge_feed_entries,
+)
+from mangadlp.cache import open_cache
 
 
 def test_uuid_link():
@@ -93,7 +105,7 @@ def test_non_existing_manga():
     forcevol = False
 
     with pytest.raises(Exception) as e:
-        Mangadex(url_uuid, language, forcevol)
+        _ = Mangadex(url_uuid, language, forcevol).manga_title
     assert e.type is KeyError
 
 
@@ -107,7 +119,7 @@ def test_api_failure(monkeypatch: MonkeyPatch):
     forcevol = False
 
     with pytest.raises(Exception) as e:
-        Mangadex(url_uuid, language, forcevol)
+        _ = Mangadex(url_uuid, language, forcevol).manga_title
     assert e.type is TypeError
 
 
@@ -130,7 +142,7 @@ def test_empty_chapter_lang():
     forcevol = False
 
     with pytest.raises(Exception) as e:
-        Mangadex(url_uuid, language, forcevol)
+        _ = Mangadex(url_uuid, language, forcevol).chapter_list
     assert e.type is KeyError
 
 
@@ -142,7 +154,7 @@ def test_not_existing_lang():
     forcevol = False
 
     with pytest.raises(Exception) as e:
-        Mangadex(url_uuid, language, forcevol)
+        _ = Mangadex(url_uuid, language, forcevol).chapter_list
     assert e.type is KeyError
 
 
@@ -251,7 +263,12 @@ def test_get_chapter_images():
         f"{img_base_url}/data/{chapter_hash}/34-3c7976456b3a872cf980aec580cc60f03b8fdee16aba3a6afc9d27190144a048.jpg",
         f"{img_base_url}/data/{chapter_hash}/35-f94ebf55f2358b989364d18c6d13ae02c4818037773ee4a847376be6db8e0931.jpg",
     ]
-    assert test.get_chapter_images(chapter_num, 2) == test_list
+    # images from a mangadex@home node
+    image_urls = test.get_chapter_images(chapter_num, 2)
+    assert [url.split("/data/")[1] for url in image_urls] == [
+        url.split("/data/")[1] for url in test_list
+    ]
+    assert test.get_fallback_images(chapter_num) == test_list
 
 
 def test_get_chapter_images_error(monkeypatch: MonkeyPatch):
@@ -261,6 +278,8 @@ def test_get_chapter_images_error(monkeypatch: MonkeyPatch):
     forcevol = False
     test = Mangadex(url_uuid, language, forcevol)
     chapter_num = "1"
+    # the chapter feed is requested on first access
+    _ = test.manga_chapter_data
     monkeypatch.setattr(requests, "get", fail_url)
 
     assert not test.get_chapter_images(chapter_num, 2)
@@ -285,3 +304,227 @@ def test_chapter_metadata():
         "1",
         "https://mangadex.org/title/7b0fbb36-7e17-4709-b616-742005b7e0e3",
     )
+
+
+class FakeFeedResponse:  # noqa: D101
+    def __init__(self, body: dict):  # noqa: D107
+        self.body = body
+        self.status_code = 200
+
+    def json(self) -> dict:
+        return self.body
+
+
+def fake_feed_chapter(uuid: str, volume: str, chapter: str) -> dict:
+    return {
+        "id": uuid,
+        "attributes": {
+            "volume": volume,
+            "chapter": chapter,
+            "title": "",
+            "pages": 5,
+            "publishAt": "2024-01-01T00:00:00+00:00",
+        },
+    }
+
+
+def test_merge_feed_entries():
+    cached = [
+        {"uuid": "u1", "volume": "1", "chapter": "1", "name": "", "pages": 5},
+        {"uuid": "u3", "volume": "1", "chapter": "3", "name": "", "pages": 5},
+    ]
+    new = [
+        {"uuid": "u3", "volume": "1", "chapter": "3", "name": "fixed", "pages": 6},
+        {"uuid": "u2", "volume": "1", "chapter": "2", "name": "", "pages": 5},
+        {"uuid": "u4", "volume": "", "chapter": "", "name": "oneshot", "pages": 5},
+    ]
+    merged = merge_feed_entries(cached, new)
+
+    assert [entry["uuid"] for entry in merged] == ["u1", "u2", "u3", "u4"]
+    assert merged[2]["name"] == "fixed"
+
+
+def test_incremental_feed(monkeypatch: MonkeyPatch, tmp_path):
+    requested_urls: list[str] = []
+    feed = [fake_feed_chapter("u1", "1", "1"), fake_feed_chapter("u2", "1", "2")]
+
+    def fake_get(url: str, *_args, **_kwargs) -> FakeFeedResponse:
+        requested_urls.append(url)
+        if "/feed" not in url:
+            return FakeFeedResponse(
+                {"result": "ok", "data": {"attributes": {"title": {"en": "Test"}}}}
+            )
+        # only the new chapter was updated since the last sync
+        chapters = [fake_feed_chapter("u3", "1", "3")] if "updatedAtSince" in url else feed
+        return FakeFeedResponse({"total": len(chapters), "data": chapters})
+
+    monkeypatch.setattr(network, "get", fake_get)
+    url_uuid = "a96676e5-8ae2-425e-b549-7f15dd34a6d8"
+    cache_path = tmp_path / "cache.json"
+
+    test = Mangadex(url_uuid, "en", False)
+    test.feed_cache = open_cache(cache_path, test.manga_uuid, "en", test.manga_title)
+    assert test.chapter_list == ["1", "2"]
+    assert not any("updatedAtSince" in url for url in requested_urls)
+
+    requested_urls.clear()
+    feed_cache = open_cache(cache_path, test.manga_uuid, "en", test.manga_title)
+    test = Mangadex(url_uuid, "en", False, feed_cache=feed_cache)
+    assert test.chapter_list == ["1", "2", "3"]
+    assert all("updatedAtSince" in url for url in requested_urls if "/feed" in url)
+    # publish times are kept in the cached feed
+    assert test.manga_chapter_data["1"]["publish_at"] == "2024-01-01T00:00:00+00:00"
+
+
+def test_parallel_feed_pages(monkeypatch: MonkeyPatch):
+    # 1200 chapters, the last chapter of every page is duplicated on the next page
+    feed = []
+    for number in range(1, 1201):
+        feed.append(fake_feed_chapter(f"u{number}", "", str(number)))
+        if number % 500 == 0:
+            feed.append(fake_feed_chapter(f"d{number}", "", str(number)))
+
+    def fake_get(url: str, *_args, **_kwargs) -> FakeFeedResponse:
+        if "/feed" not in url:
+            return FakeFeedResponse(
+                {"result": "ok", "data": {"attributes": {"title": {"en": "Test"}}}}
+            )
+        if "limit=0" in url:
+            return FakeFeedResponse({"total": len(feed), "data": []})
+        offset = int(url.split("offset=")[1].split("&")[0])
+        return FakeFeedResponse({"total": len(feed), "data": feed[offset : offset + 500]})
+
+    monkeypatch.setattr(network, "get", fake_get)
+    test = Mangadex("a96676e5-8ae2-425e-b549-7f15dd34a6d8", "en", False)
+
+    assert test.chapter_list == [str(number) for number in range(1, 1201)]
+    assert test.manga_chapter_data["500"]["uuid"] == "u500"
+
+
+def test_lazy_init(monkeypatch: MonkeyPatch):
+    requested_urls: list[str] = []
+
+    def fake_get(url: str, *_args, **_kwargs) -> FakeFeedResponse:
+        requested_urls.append(url)
+        if "/feed" not in url:
+            return FakeFeedResponse(
+                {"result": "ok", "data": {"attributes": {"title": {"en": "Test"}}}}
+            )
+        chapters = [fake_feed_chapter("u1", "1", "1")]
+        return FakeFeedResponse({"total": len(chapters), "data": chapters})
+
+    monkeypatch.setattr(network, "get", fake_get)
+    test = Mangadex("a96676e5-8ae2-425e-b549-7f15dd34a6d8", "en", False)
+    assert requested_urls == []
+
+    assert test.manga_title == "Test"
+    assert len(requested_urls) == 1
+
+    assert test.chapter_list == ["1"]
+    assert test.chapter_list == ["1"]
+    assert len(requested_urls) == 3
+
+
+def test_chapter_lang_invalid_body(monkeypatch: MonkeyPatch):
+    class InvalidResponse(FakeFeedResponse):
+        def json(self) -> dict:
+            # error page of a proxy
+            return json.loads("<html>")
+
+    monkeypatch.setattr(network, "get", lambda *_args, **_kwargs: InvalidResponse({}))
+    test = Mangadex("a96676e5-8ae2-425e-b549-7f15dd34a6d8", "en", False)
+    messages: list[str] = []
+    handler_id = log.add(messages.append, level="ERROR", format="{message}")
+    with pytest.raises(json.JSONDecodeError):
+        test.check_chapter_lang()
+    log.remove(handler_id)
+
+    assert messages[0].startswith("Error retrieving the chapters list")
+
+
+def test_manga_data_batch(monkeypatch: MonkeyPatch):
+    requested_urls: list[str] = []
+
+    def fake_get(url: str, *_args, **_kwargs) -> FakeFeedResponse:
+        requested_urls.append(url)
+        ids = [part.split("=")[1] for part in url.split("&") if "ids[]=" in part]
+        data = [{"id": uuid, "attributes": {"title": {"en": f"Manga {uuid[:8]}"}}} for uuid in ids]
+        return FakeFeedResponse({"result": "ok", "data": data})
+
+    monkeypatch.setattr(network, "get", fake_get)
+    uuids = [f"{number:08d}-aaaa-aaaa-aaaa-aaaaaaaaaaaa" for number in range(150)]
+    url_uuids = [f"https://mangadex.org/title/{uuid}/test" for uuid in uuids]
+    manga_data = get_manga_data_batch([*url_uuids, "invalid", url_uuids[0]])
+
+    assert len(requested_urls) == 2
+    assert sorted(manga_data) == uuids
+
+    requested_urls.clear()
+    test = Mangadex(url_uuids[5], "en", False, prefetched_manga=manga_data)
+    assert test.manga_title == "Manga 00000005"
+    assert requested_urls == []
+
+
+def test_report_image():
+    reports: list[dict] = []
+
+    class ReportHandler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            reports.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(200)
+            self.end_headers()
+
+    # local stand-in for the mangadex@home report endpoint
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReportHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    test = Mangadex("a96676e5-8ae2-425e-b549-7f15dd34a6d8", "en", False)
+    test.athome_report_url = f"http://127.0.0.1:{server.server_address[1]}/report"
+
+    test.report_image("https://abc.mangadex.network/data/abc/1.png", True, 1000, 0.25, True)
+    # the mangadex servers are not reported
+    test.report_image(f"{test.img_base_url}/data/abc/1.png", False, 0, 0.25, False)
+    # the reports are sent in the background
+    assert REPORT_QUEUE.wait(timeout=5)
+    server.shutdown()
+
+    assert reports == [
+        {
+            "url": "https://abc.mangadex.network/data/abc/1.png",
+            "success": True,
+            "bytes": 1000,
+            "duration": 250,
+            "cached": True,
+        }
+    ]
+
+    test.chapter_images["1"] = ("abc", ["1.png", "2.png"])
+    assert test.get_fallback_images("1") == [
+        f"{test.img_base_url}/data/abc/1.png",
+        f"{test.img_base_url}/data/abc/2.png",
+    ]
+    assert test.get_fallback_images("2") == []
+
+
+@pytest.mark.parametrize("data_saver", [["1.jpg", "2.jpg"], []])
+def test_get_chapter_images_data_saver(monkeypatch: MonkeyPatch, data_saver: list[str]):
+    athome = {
+        "result": "ok",
+        "baseUrl": "https://abc.mangadex.network",
+        "chapter": {"hash": "abc", "data": ["1.png", "2.png"], "dataSaver": data_saver},
+    }
+    monkeypatch.setattr(network, "get", lambda *_args, **_kwargs: FakeFeedResponse(athome))
+    test = Mangadex("a96676e5-8ae2-425e-b549-7f15dd34a6d8", "en", False, quality="data-saver")
+    test.manga_chapter_data = {
+        "1": {"uuid": "c1", "volume": "1", "chapter": "1", "name": "", "pages": 2}
+    }
+
+    if data_saver:
+        expected = [f"https://abc.mangadex.network/data-saver/abc/{n}.jpg" for n in (1, 2)]
+    else:
+        expected = [f"https://abc.mangadex.network/data/abc/{n}.png" for n in (1, 2)]
+    assert test.get_chapter_images("1", 0) == expected
+    # fallback to the originals
+    assert test.get_fallback_images("1") == [
+        f"{test.img_base_url}/data/abc/{n}.png" for n in (1, 2)
+    ]